@@ -0,0 +1,230 @@
+"""Drinking trends and relapse-risk scores from daily logs, computed in batch.
+
+``compute_insights`` turns the daily logs of many users into columnar NumPy
+arrays and derives, for every user in one vectorized pass over a
+users x days grid of the last ``ANALYTICS_WINDOW_DAYS`` days:
+
+- mean units per logged day over the last 7 and 28 days, and the 28-day
+  trend (least-squares slope, in units per week)
+- mean units per weekday, and the riskiest weekday
+- how often each trigger type was the reason for drinking (the drink reason
+  is classified with ``coping_resources.detect_triggers``)
+- the share of the last 14 logged days that met the goal or had a low,
+  anxious or angry mood, and the days since the last log
+- ``relapse_risk``: a logistic score in [0, 1] combining those signals
+  (``RISK_WEIGHTS``), and ``risk_level`` (low, medium or high)
+
+The results are stored as ``insights`` on each user's
+``conversation_summaries`` document, which the request path already reads:
+the prompt builder adds them to the summary message, and chat and daily-log
+model calls of high-risk users are scheduled as critical. Nothing is computed
+per request.
+
+Run nightly with ``python analytics.py --all``: active users are processed in
+chunks of ``ANALYTICS_CHUNK_USERS`` across a pool of ``ANALYTICS_WORKERS``
+processes, each loading its chunk with one query and storing it with one bulk
+write. ``--user-id`` recomputes one user.
+"""
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from coping_resources import TRIGGER_KEYWORDS, detect_moods, detect_triggers
+from repositories import DATA_BACKEND, get_repositories
+
+ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", "90"))
+ANALYTICS_CHUNK_USERS = int(os.getenv("ANALYTICS_CHUNK_USERS", "500"))
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", str(os.cpu_count() or 1)))
+
+TRIGGERS = list(TRIGGER_KEYWORDS) + ["unknown"]
+TRIGGER_CODES = {trigger: code for code, trigger in enumerate(TRIGGERS)}
+NEGATIVE_MOODS = {"low", "anxious", "angry"}
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Logistic relapse-risk model: bias plus weight per signal (signals are roughly in [0, 1])
+RISK_WEIGHTS = {
+    "bias": -2.5,
+    "missed_goal_rate": 2.5,      # share of the last 14 logged days that missed the goal
+    "negative_mood_rate": 1.5,    # share of the last 14 logged days with a low, anxious or angry mood
+    "rising_trend": 1.5,          # 28-day trend relative to the 28-day mean, clipped to [0, 1]
+    "recent_increase": 1.0,       # 7-day mean above the 28-day mean, relative, clipped to [0, 1]
+    "lapsed_logging": 0.75,       # no log for 3 days or more
+    "risky_tomorrow": 0.75,       # tomorrow's weekday is above the user's mean, relative, clipped to [0, 1]
+}
+RISK_LEVELS = ((0.66, "high"), (0.33, "medium"), (0.0, "low"))
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_columns(logs):
+    """User ids and columnar arrays (user index, day ordinal, units, goal, mood, trigger) of ``logs``"""
+    logs = [log for log in logs if isinstance(log.get("date"), datetime.datetime)]
+    user_ids = sorted({log["user_id"] for log in logs})
+    position = {user_id: index for index, user_id in enumerate(user_ids)}
+    count = len(logs)
+    # Reasons and moods repeat a lot; classify each distinct text once
+    triggers, moods = {}, {}
+
+    def trigger(reason):
+        if reason not in triggers:
+            triggers[reason] = TRIGGER_CODES[(detect_triggers(reason) or ["unknown"])[0]]
+        return triggers[reason]
+
+    def negative_mood(mood):
+        if mood not in moods:
+            moods[mood] = bool(detect_moods(mood) & NEGATIVE_MOODS)
+        return moods[mood]
+
+    columns = {
+        "user": np.fromiter((position[log["user_id"]] for log in logs), np.int64, count),
+        "day": np.fromiter((log["date"].toordinal() for log in logs), np.int64, count),
+        "units": np.fromiter((_number(log.get("alcohol_consumed")) for log in logs), np.float64, count),
+        "met_goal": np.fromiter((bool(log.get("meets_goal")) for log in logs), np.bool_, count),
+        "negative_mood": np.fromiter((negative_mood(log.get("mood")) for log in logs), np.bool_, count),
+        "trigger": np.fromiter((trigger(log.get("drink_reason")) for log in logs), np.int64, count),
+    }
+    return user_ids, columns
+
+
+def _per_logged_day(totals, days):
+    return np.divide(totals, days, out=np.zeros_like(totals, dtype=np.float64), where=days > 0)
+
+
+def compute_insights(logs, today=None, window_days=ANALYTICS_WINDOW_DAYS):
+    """Insights per user (``{user_id: insights}``) from their daily logs"""
+    today = (today or datetime.date.today()).toordinal()
+    user_ids, columns = to_columns(logs)
+    users, days = len(user_ids), window_days
+    if not users:
+        return {}
+
+    # users x days grids over the window; several logs on one day add up
+    first_day = today - days + 1
+    column = columns["day"] - first_day
+    keep = (column >= 0) & (column < days)
+    user, column = columns["user"][keep], column[keep]
+    units = np.zeros((users, days))
+    np.add.at(units, (user, column), columns["units"][keep])
+    logged = np.zeros((users, days))
+    np.add.at(logged, (user, column), 1)
+    logged = np.minimum(logged, 1)
+    missed = np.zeros((users, days))
+    np.add.at(missed, (user, column), ~columns["met_goal"][keep])
+    negative = np.zeros((users, days))
+    np.add.at(negative, (user, column), columns["negative_mood"][keep])
+
+    # Rolling means per logged day
+    logged_7, logged_14, logged_28 = (logged[:, -n:].sum(axis=1) for n in (7, 14, 28))
+    mean_7 = _per_logged_day(units[:, -7:].sum(axis=1), logged_7)
+    mean_28 = _per_logged_day(units[:, -28:].sum(axis=1), logged_28)
+
+    # Least-squares slope of units over the logged days of the last 28
+    x = np.arange(28, dtype=np.float64)
+    weights, y = logged[:, -28:], units[:, -28:]
+    n, sx, sy = weights.sum(axis=1), weights @ x, (weights * y).sum(axis=1)
+    sxx, sxy = weights @ (x * x), (weights * y) @ x
+    denominator = n * sxx - sx * sx
+    slope = np.divide(n * sxy - sx * sy, denominator, out=np.zeros(users), where=denominator > 0)
+    trend_per_week = slope * 7
+
+    # Weekday means through a days x 7 one-hot matrix
+    weekday_of_column = (first_day + np.arange(days) - 1) % 7  # ordinal 1 is a Monday
+    one_hot = np.eye(7)[weekday_of_column]
+    weekday_means = _per_logged_day(units @ one_hot, logged @ one_hot)
+    overall_mean = _per_logged_day(units.sum(axis=1), logged.sum(axis=1))
+
+    # Trigger frequencies of logs with drinking
+    drank = keep & (columns["units"] > 0)
+    trigger_counts = np.zeros((users, len(TRIGGERS)), dtype=np.int64)
+    np.add.at(trigger_counts, (columns["user"][drank], columns["trigger"][drank]), 1)
+
+    missed_goal_rate = _per_logged_day(np.minimum(missed, 1)[:, -14:].sum(axis=1), logged_14)
+    negative_mood_rate = _per_logged_day(np.minimum(negative, 1)[:, -14:].sum(axis=1), logged_14)
+    days_since_log = np.where(logged.any(axis=1), np.argmax(logged[:, ::-1] > 0, axis=1), days)
+
+    tomorrow = today % 7  # weekday of today + 1
+    signals = {
+        "missed_goal_rate": missed_goal_rate,
+        "negative_mood_rate": negative_mood_rate,
+        "rising_trend": np.clip(_per_logged_day(trend_per_week, mean_28 + 1), 0, 1),
+        "recent_increase": np.clip(_per_logged_day(mean_7 - mean_28, mean_28 + 1), 0, 1),
+        "lapsed_logging": (days_since_log >= 3).astype(np.float64),
+        "risky_tomorrow": np.clip(_per_logged_day(weekday_means[:, tomorrow] - overall_mean, overall_mean + 1), 0, 1),
+    }
+    z = RISK_WEIGHTS["bias"] + sum(RISK_WEIGHTS[name] * value for name, value in signals.items())
+    risk = 1 / (1 + np.exp(-z))
+
+    computed_at = datetime.datetime.now()
+    insights = {}
+    for index, user_id in enumerate(user_ids):
+        counts = trigger_counts[index]
+        insights[user_id] = {
+            "computed_at": computed_at,
+            "window_days": days,
+            "logged_days": int(logged[index].sum()),
+            "mean_units_7d": round(float(mean_7[index]), 3),
+            "mean_units_28d": round(float(mean_28[index]), 3),
+            "trend_units_per_week": round(float(trend_per_week[index]), 3),
+            "weekday_mean_units": [round(float(value), 3) for value in weekday_means[index]],
+            "riskiest_weekday": WEEKDAYS[int(np.argmax(weekday_means[index]))] if weekday_means[index].any() else None,
+            "trigger_counts": {TRIGGERS[code]: int(count) for code, count in enumerate(counts) if count},
+            "top_trigger": TRIGGERS[int(np.argmax(counts))] if counts.any() else None,
+            "goal_rate_14d": round(1 - float(missed_goal_rate[index]), 3) if logged_14[index] else None,
+            "negative_mood_rate_14d": round(float(negative_mood_rate[index]), 3),
+            "days_since_last_log": int(days_since_log[index]),
+            "relapse_risk": round(float(risk[index]), 3),
+            "risk_level": next(level for threshold, level in RISK_LEVELS if risk[index] >= threshold)
+        }
+    return insights
+
+
+def process_chunk(user_ids, today=None, window_days=ANALYTICS_WINDOW_DAYS):
+    """Load, score and store the insights of ``user_ids``. Returns the number of users stored."""
+    today = today or datetime.date.today()
+    since = datetime.datetime.combine(today - datetime.timedelta(days=window_days - 1), datetime.time())
+    repositories = get_repositories()
+    insights = compute_insights(repositories.daily_logs.for_users(user_ids, since), today, window_days)
+    repositories.summaries.save_insights(insights)
+    return len(insights)
+
+
+def run_batch(user_ids=None, chunk_size=ANALYTICS_CHUNK_USERS, workers=ANALYTICS_WORKERS, today=None,
+              window_days=ANALYTICS_WINDOW_DAYS):
+    """Score every user with a log in the window (or ``user_ids``), in chunks across ``workers`` processes.
+
+    ``workers=0`` runs in this process (required for the in-memory backend,
+    whose data other processes cannot see). Returns the number of users stored.
+    """
+    today = today or datetime.date.today()
+    if user_ids is None:
+        since = datetime.datetime.combine(today - datetime.timedelta(days=window_days - 1), datetime.time())
+        user_ids = get_repositories().daily_logs.active_users(since)
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    if workers <= 0 or len(chunks) <= 1:
+        return sum(process_chunk(chunk, today, window_days) for chunk in chunks)
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        return sum(executor.map(process_chunk, chunks, [today] * len(chunks), [window_days] * len(chunks)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute drinking trends and relapse-risk scores")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", help="Score one user")
+    target.add_argument("--all", action="store_true", help="Score every user with a log in the window")
+    parser.add_argument("--chunk-size", type=int, default=ANALYTICS_CHUNK_USERS, help="Users per chunk")
+    parser.add_argument("--workers", type=int, default=0 if DATA_BACKEND == "memory" else ANALYTICS_WORKERS,
+                        help="Worker processes (0 runs in this process)")
+    args = parser.parse_args()
+
+    started = datetime.datetime.now()
+    stored = run_batch([args.user_id] if args.user_id else None, args.chunk_size, args.workers)
+    print(json.dumps({"users": stored, "seconds": (datetime.datetime.now() - started).total_seconds()}))
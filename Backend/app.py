@@ -1,24 +1,36 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
-from azure.storage.blob import BlobServiceClient
-from azure.identity import DefaultAzureCredential
 import os
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-import json
 import datetime
+import itertools
+import mimetypes
+import re
+import threading
 import uuid
+from archive import export_lines as export_archived_lines, history as log_history
+from blob_uploads import (MAX_UPLOAD_BYTES, UPLOAD_BLOCK_SIZE, UPLOAD_MAX_PART_BYTES, UploadError,
+                          UploadTooLargeError, collect_parts, commit_blocks, stage_part, stage_upload)
+from bulk_data import BulkDataError, export_lines, import_lines
+from chat_engines import (CHAT_ENGINE, ENGINES, FLAT_ENGINE, GRAPH_ENGINE, WORKFLOW_PREWARM, engine_stats, graph_response,
+                          prewarm)
+from coping_resources import extract_coping_suggestion, extract_resource
+from database import LazyCollection, get_db, ping, pool_stats, set_db
+from idempotency import idempotent
+from ingestion import get_sources, ingestion_enabled, schedule_ingestion
+from llm_router import get_router
+from llm_scheduler import CRITICAL, INTERACTIVE, get_scheduler, llm_priority
+from repositories import get_repositories
+from summaries import SUMMARY_KEEP_RECENT, get_conversation_context, get_prompt_context, note_messages
+from tracing import end_span, metrics, span, start_round_trip_count, start_span, stop_round_trip_count
+from usage import (QUOTA_HARD, QUOTA_OK, QUOTA_SOFT, context_limit, end_usage_scope, get_ledger, get_response_cache,
+                   quota_state, start_usage_scope)
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__, static_folder='static')
-CORS(app)  # Enable CORS for all routes
-
-# MongoDB Configuration
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "drink-agent-app")
+# Routes are registered on a blueprint; create_app() builds the Flask app
+api = Blueprint('api', __name__)
 
 # Azure Blob Storage Configuration
 BLOB_CONNECTION_STRING = os.getenv("BLOB_CONNECTION_STRING")
@@ -31,31 +43,74 @@ GPT4_DEPLOYMENT = os.getenv("GPT4_DEPLOYMENT")
 EMBEDDING_DEPLOYMENT = os.getenv("EMBEDDING_DEPLOYMENT")
 API_VERSION = os.getenv("API_VERSION")
 
-
-# Initialize MongoDB client
-mongo_client = MongoClient(MONGODB_URI)
-db = mongo_client[MONGODB_DATABASE]
-
-# Initialize collections
-users_collection = db["users"]
-daily_logs_collection = db["daily_logs"]
-relapse_support_collection = db["relapse_support"]
-motivations_collection = db["motivations"]
-notifications_collection = db["notifications"]
-
-# Add agent memory collection
-agent_memory_collection = db["agent_memory"]
-
-# Initialize Azure Blob Storage client
-blob_service_client = BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
-blob_container_client = blob_service_client.get_container_client(BLOB_CONTAINER_NAME)
-
-# Initialize Azure OpenAI client
-openai_client = AzureOpenAI(
-    api_version=API_VERSION,
-    azure_endpoint=AZURE_ENDPOINT,
-    api_key=AZURE_API_KEY,
-)
+# External clients are created lazily on first use, once per process. Heavy SDKs
+# (pymongo, azure.storage.blob, openai) are only imported at that point, and a
+# forked worker never reuses its parent's clients. The MongoDB client is shared
+# with the LangGraph workflow through database.py.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _reset_clients_after_fork():
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+def require_env(name, value):
+    """Return a configuration value, failing with a clear message if it is missing"""
+    if not value:
+        raise RuntimeError(f"Missing required environment variable: {name}")
+    return value
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def get_blob_container_client():
+    """Azure Blob Storage container client for this process"""
+    def connect():
+        from azure.storage.blob import BlobServiceClient
+        blob_service_client = BlobServiceClient.from_connection_string(
+            require_env("BLOB_CONNECTION_STRING", BLOB_CONNECTION_STRING))
+        return blob_service_client.get_container_client(require_env("BLOB_CONTAINER_NAME", BLOB_CONTAINER_NAME))
+    return _get_client("blob_container", connect)
+
+def set_clients(db=None, blob_container_client=None):
+    """Use the given clients instead of connecting (tests and benchmarks pass local stand-ins)"""
+    if db is not None:
+        set_db(db)
+    with _clients_lock:
+        if blob_container_client is not None:
+            _clients["blob_container"] = blob_container_client
+
+# Users, logs, conversations, milestones, notifications and memory go through
+# repositories.py; the collections below are only used by uploads and ingestion
+upload_sessions_collection = LazyCollection("upload_sessions")
+
+# Uploaded file metadata: one "files" entry per upload, one "file_contents" entry per distinct blob
+files_collection = LazyCollection("files")
+file_contents_collection = LazyCollection("file_contents")
+# Retrieval chunks of uploaded documents (see ingestion.py)
+document_chunks_collection = LazyCollection("document_chunks")
+
+def ensure_file_indexes():
+    """Create the upload metadata indexes, once per process"""
+    def create():
+        files_collection.create_index([("user_id", 1), ("created_at", -1)])
+        files_collection.create_index("content_hash")
+        file_contents_collection.create_index("content_hash", unique=True)
+        document_chunks_collection.create_index([("content_hash", 1), ("chunk_index", 1)])
+        return True
+    return _get_client("file_indexes", create)
+
+# Azure OpenAI clients are created per deployment by the router (see llm_router.py)
+RELAPSE_SUPPORT_HEDGING = os.getenv("RELAPSE_SUPPORT_HEDGING", "true").lower() == "true"
 
 # System prompt for the AI agent
 SYSTEM_PROMPT = """
@@ -90,8 +145,83 @@ SYSTEM_PROMPT = """
 - **Always** prioritize emotional safety and user empowerment. Strictly only rely on the sources provided in generating your response. Never rely on external sources
 """
 
+# Returned immediately when the model deployment is unavailable
+FALLBACK_RESPONSE = (
+    "I'm having trouble responding right now, but I'm still here for you. "
+    "Take a slow, deep breath, drink a glass of water, and reach out to someone you trust. "
+    "Please try again in a moment."
+)
+
+# Returned without a model call once the token quota is used up and no earlier reply is cached
+QUOTA_RESPONSE = (
+    "I can't give you a detailed reply right now, but I'm still here for you. "
+    "Take a slow, deep breath, drink a glass of water, and reach out to someone you trust. "
+    "Please check back with me later."
+)
+
+
+def risk_priority(insights):
+    """Scheduling class for a user's model calls: critical when the nightly analytics rate them high risk"""
+    return CRITICAL if insights and insights.get("risk_level") == "high" else INTERACTIVE
+
+# Request tracing: every request is a root span; Mongo and LLM calls nest under it.
+# Database round trips made by the request are recorded as ``db.round_trips``,
+# and model tokens are charged to the request's route (see usage.py).
+def start_request_span():
+    route = request.url_rule.rule if request.url_rule else request.path
+    request.environ["tracing.round_trips"] = start_round_trip_count()
+    request.environ["usage.scope"] = start_usage_scope(route)
+    request.environ["tracing.span"] = start_span(
+        "http.request",
+        route,
+        **{"http.method": request.method, "payload.request_bytes": request.content_length or 0}
+    )
+
+def record_response_size(response):
+    started = request.environ.get("tracing.span")
+    if started is not None:
+        started[0].set_attribute("http.status_code", response.status_code)
+        if not response.is_streamed:
+            started[0].set_attribute("payload.response_bytes", response.calculate_content_length() or 0)
+    return response
+
+def end_request_span(error=None):
+    round_trips = request.environ.pop("tracing.round_trips", None)
+    usage_scope = request.environ.pop("usage.scope", None)
+    started = request.environ.pop("tracing.span", None)
+    if started is not None:
+        if round_trips is not None:
+            started[0].set_attribute("db.round_trips", stop_round_trip_count(round_trips))
+        end_span(started, error=error)
+    if usage_scope is not None:
+        end_usage_scope(usage_scope)
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Latency, token and payload-size histograms (Prometheus text, or ?format=json for percentiles)"""
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.summary())
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/health', methods=['GET'])
+def health():
+    """MongoDB reachability, connection pool usage and LLM scheduler queues"""
+    try:
+        return jsonify({
+            "mongo": {"ping_ms": ping() * 1000, "pools": pool_stats()},
+            "llm_scheduler": get_scheduler().stats(),
+            "status": "success"
+        })
+    except Exception as e:
+        return jsonify({
+            "mongo": {"pools": pool_stats()},
+            "llm_scheduler": get_scheduler().stats(),
+            "error": str(e),
+            "status": "error"
+        }), 503
+
 # API Documentation
-@app.route('/api', methods=['GET'])
+@api.route('/api', methods=['GET'])
 def api_documentation():
     """Return API documentation for frontend developers"""
     api_docs = {
@@ -102,25 +232,110 @@ def api_documentation():
             "/api/chat": {
                 "method": "POST",
                 "description": "Send a message to the AI agent and get a response",
+                "headers": {
+                    "Idempotency-Key": "string (optional) - Retries with the same key replay the first response instead of running again"
+                },
                 "request_body": {
                     "message": "string (required) - The user's message",
-                    "user_id": "string (required) - The user's unique identifier"
+                    "user_id": "string (required) - The user's unique identifier",
+                    "engine": "string (optional) - 'flat' (single completion) or 'graph' (trigger workflow); defaults to CHAT_ENGINE"
                 },
                 "response": {
                     "response": "string - The AI agent's response",
+                    "engine": "string - The engine that answered",
+                    "quota": "string - 'ok', or 'soft'/'hard' when the reply was degraded by a token quota",
+                    "sources": "array - Uploaded documents (file_id, filename, chunk_index) passed to the agent as sources",
+                    "status": "string - Success or error status"
+                }
+            },
+            "/api/chat/engines": {
+                "method": "GET",
+                "description": "Compare the latency and errors of the chat engines",
+                "response": {
+                    "default": "string - The deployment's default engine",
+                    "engines": "object - Requests, errors and mean/p50/p95/p99 latency in seconds per engine",
+                    "status": "string - Success or error status"
+                }
+            },
+            "/api/usage": {
+                "method": "GET",
+                "description": "Token usage over the accounting window, heaviest users, endpoints and workflow nodes",
+                "parameters": {
+                    "top": "integer (optional) - Rows per ranking (default 10)"
+                },
+                "response": {
+                    "quotas": "object - Configured soft and hard token quotas per user and globally (0 = off)",
+                    "total": "object - Prompt/completion tokens, calls and cost in USD over the window",
+                    "users": "array - Heaviest users with the same fields",
+                    "endpoints": "array - Heaviest endpoints and background jobs",
+                    "nodes": "array - Heaviest LangGraph nodes",
+                    "series": "array - Tokens per time bucket",
                     "status": "string - Success or error status"
                 }
             },
             "/api/upload": {
                 "method": "POST",
-                "description": "Upload a file to Azure Blob Storage",
+                "description": "Stream a file to Azure Blob Storage (raw body, or multipart form for existing clients)",
+                "parameters": {
+                    "user_id": "string (required) - The user's unique identifier (form field for multipart uploads)",
+                    "filename": "string (required for raw uploads) - Name of the uploaded file"
+                },
                 "request_body": {
-                    "file": "file (required) - The file to upload",
-                    "user_id": "string (required) - The user's unique identifier"
+                    "file": "file (required) - The file to upload, as the raw body or a multipart 'file' field"
                 },
                 "response": {
                     "message": "string - Success message",
-                    "blob_path": "string - Path to the uploaded file in blob storage"
+                    "file_id": "string - The uploaded file's unique identifier",
+                    "blob_path": "string - Path to the file's content in blob storage (shared by identical uploads)",
+                    "size": "integer - Size of the upload in bytes"
+                }
+            },
+            "/api/uploads": {
+                "method": "POST",
+                "description": "Start a resumable multi-part upload; send parts with PUT /api/uploads/<upload_id>/parts/<n>, check progress with GET /api/uploads/<upload_id> and finish with POST /api/uploads/<upload_id>/complete",
+                "request_body": {
+                    "user_id": "string (required) - The user's unique identifier",
+                    "filename": "string (required) - Name of the uploaded file",
+                    "content_type": "string (optional) - MIME type of the file"
+                },
+                "response": {
+                    "upload_id": "string - Identifier of the upload session",
+                    "part_size": "integer - Maximum part size; every part but the last must be a multiple of block_size",
+                    "block_size": "integer - Block size in bytes",
+                    "max_size": "integer - Maximum total upload size in bytes"
+                }
+            },
+            "/api/files": {
+                "method": "GET",
+                "description": "List or search a user's uploaded files",
+                "parameters": {
+                    "user_id": "string (required) - The user's unique identifier",
+                    "q": "string (optional) - Case-insensitive filename search",
+                    "content_type": "string (optional) - Only files of this MIME type",
+                    "limit": "integer (optional) - Maximum number of files to return (default: 50)"
+                },
+                "response": {
+                    "files": "array - File metadata (file_id, filename, content_type, size, content_hash, blob_path, ingest_status, created_at), newest first",
+                    "status": "string - Success or error status"
+                }
+            },
+            "/api/export": {
+                "method": "GET",
+                "description": "Download all of a user's data as NDJSON (one {collection, document} object per line)",
+                "parameters": {
+                    "user_id": "string (required) - The user's unique identifier"
+                },
+                "response": "application/x-ndjson stream of users, daily_logs (including archived entries), motivations, notifications, relapse_support and agent_memory documents"
+            },
+            "/api/import": {
+                "method": "POST",
+                "description": "Import a user's data from an NDJSON body in the /api/export format; existing documents are skipped",
+                "parameters": {
+                    "user_id": "string (required) - The user's unique identifier; every document must belong to this user"
+                },
+                "response": {
+                    "imported": "object - Inserted and skipped document counts per collection",
+                    "status": "string - Success or error status"
                 }
             },
             "/api/history": {
@@ -135,6 +350,19 @@ def api_documentation():
                     "status": "string - Success or error status"
                 }
             },
+            "/api/logs": {
+                "method": "GET",
+                "description": "Get a user's daily logs and conversation messages in a date range, including archived ones",
+                "parameters": {
+                    "user_id": "string (required) - The user's unique identifier",
+                    "start": "string (optional) - ISO date; only entries on or after it",
+                    "end": "string (optional) - ISO date; only entries before it"
+                },
+                "response": {
+                    "entries": "array - Daily logs (with date) and conversation messages (with timestamp), oldest first",
+                    "status": "string - Success or error status"
+                }
+            },
             "/api/user": {
                 "method": "POST",
                 "description": "Create a new user profile",
@@ -160,6 +388,9 @@ def api_documentation():
             "/api/daily-log": {
                 "method": "POST",
                 "description": "Create a daily drinking log",
+                "headers": {
+                    "Idempotency-Key": "string (optional) - Retries with the same key replay the first response instead of running again"
+                },
                 "request_body": {
                     "user_id": "string (required) - The user's unique identifier",
                     "alcohol_consumed": "integer (required) - The amount of alcohol consumed in units",
@@ -170,7 +401,8 @@ def api_documentation():
                 "response": {
                     "log_id": "string - The unique identifier for the daily log",
                     "agent_feedback": "string - The AI agent's feedback",
-                    "coping_suggestion": "string - A suggested coping strategy",
+                    "quota": "string - 'ok', or 'soft'/'hard' when the feedback was degraded by a token quota",
+                    "coping_suggestion": "string - A coping strategy from the feedback, or from the resource catalog",
                     "streak_count": "integer - The user's current streak count",
                     "status": "string - Success or error status"
                 }
@@ -178,6 +410,9 @@ def api_documentation():
             "/api/relapse-support": {
                 "method": "POST",
                 "description": "Create a relapse support entry",
+                "headers": {
+                    "Idempotency-Key": "string (optional) - Retries with the same key replay the first response instead of running again"
+                },
                 "request_body": {
                     "user_id": "string (required) - The user's unique identifier",
                     "trigger_event": "string (required) - The trigger event"
@@ -185,7 +420,8 @@ def api_documentation():
                 "response": {
                     "support_id": "string - The unique identifier for the relapse support entry",
                     "agent_response": "string - The AI agent's response",
-                    "resource_shared": "string - The shared resource",
+                    "resource_shared": "string - URL (or title) of the catalog resource that best fits the trigger",
+                    "quota": "string - 'ok', or 'soft' when the context was shortened by a token quota",
                     "status": "string - Success or error status"
                 }
             },
@@ -210,53 +446,267 @@ def api_documentation():
                     "notifications": "array - List of notifications",
                     "status": "string - Success or error status"
                 }
+            },
+            "/health": {
+                "method": "GET",
+                "description": "MongoDB ping time, connection pool usage and LLM queues (503 when MongoDB is unreachable)",
+                "response": {
+                    "mongo": "object - ping_ms and open/in_use/waiting connections per server",
+                    "llm_scheduler": "object - LLM calls in flight, the concurrency limit and queued calls per priority class",
+                    "status": "string - Success or error status"
+                }
+            },
+            "/metrics": {
+                "method": "GET",
+                "description": "Latency, token and payload-size histograms for requests, graph nodes, LLM and Mongo calls, plus Mongo pool gauges",
+                "parameters": {
+                    "format": "string (optional) - 'json' for count/mean/p50/p95/p99 per histogram, Prometheus text otherwise"
+                },
+                "response": {
+                    "histograms": "array - Percentile summary per span name and target (json format)"
+                }
             }
         }
     }
     return jsonify(api_docs)
 
 # Serve static files (for frontend developers)
-@app.route('/static/<path:path>')
+@api.route('/static/<path:path>')
 def serve_static(path):
     return send_from_directory('static', path)
 
 # API Endpoints
-@app.route('/api/chat', methods=['POST'])
+@api.route('/api/chat', methods=['POST'])
+@idempotent
 def chat():
     """Send a message to the AI agent and get a response"""
     try:
         data = request.json
         user_message = data.get('message')
         user_id = data.get('user_id')
+        engine = data.get('engine') or CHAT_ENGINE
 
         if not user_message or not user_id:
             return jsonify({
                 "error": "Missing required fields: message and user_id",
                 "status": "error"
             }), 400
+        if engine not in ENGINES:
+            return jsonify({
+                "error": f"Unknown engine: {engine} (expected one of {', '.join(ENGINES)})",
+                "status": "error"
+            }), 400
 
-        # Get user history from MongoDB
-        user_history = get_user_history(user_id)
-
-        # Generate AI response
-        response = openai_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                *user_history,
-                {"role": "user", "content": user_message}
-            ],
-            model=GPT4_DEPLOYMENT,
-            max_tokens=1000,
-            temperature=0.7
+        # Over a token quota: a single call with a short context and no document sources
+        quota = quota_state(user_id)
+        if quota != QUOTA_OK:
+            engine = FLAT_ENGINE
+
+        # Summary of earlier conversations, drinking insights and the newest messages
+        user_history, insights = get_prompt_context(user_id, context_limit(quota, SUMMARY_KEEP_RECENT))
+
+        with llm_priority(risk_priority(insights), user_id), span("chat.engine", engine):
+            # The trigger workflow answers drinking-related messages with a coping agent
+            ai_response = None
+            sources = []
+            if engine == GRAPH_ENGINE:
+                try:
+                    ai_response = graph_response(user_id, user_history, user_message)
+                except Exception:
+                    # A failed or timed out workflow run gets the flat reply
+                    metrics.increment("chat_graph_replies_total", {"outcome": "failed"})
+
+            if ai_response is None:
+                # Passages from the user's uploaded documents
+                if quota == QUOTA_OK:
+                    sources = get_sources(get_db(), user_id, user_message)
+
+                # Generate AI response
+                ai_response = generate_ai_response(user_history, user_message, sources=sources,
+                                                   user_id=user_id, quota=quota)
+
+        # Store conversation in MongoDB (canned replies are not part of the conversation)
+        if not is_degraded(ai_response):
+            store_conversation(user_id, user_message, ai_response)
+
+        return jsonify({
+            "response": ai_response,
+            "engine": engine,
+            "quota": quota,
+            "sources": [{key: source[key] for key in ("file_id", "filename", "chunk_index")} for source in sources],
+            "status": "success"
+        })
+
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+@api.route('/api/chat/engines', methods=['GET'])
+def get_chat_engines():
+    """Latency and error comparison of the chat engines"""
+    return jsonify({
+        "default": CHAT_ENGINE,
+        "engines": engine_stats(),
+        "status": "success"
+    })
+
+@api.route('/api/usage', methods=['GET'])
+def get_usage():
+    """Token usage over the accounting window: totals, heaviest users, endpoints and workflow nodes"""
+    top = request.args.get('top', 10, type=int)
+    return jsonify({**get_ledger().report(top=top), "status": "success"})
+
+def upload_error(e):
+    return jsonify({"error": str(e), "status": "error"}), e.status_code
+
+def get_upload_source():
+    """Return ``(stream, filename, content_type, user_id)`` for an upload request.
+
+    A raw body (any non-multipart content type) is streamed straight from the
+    socket with ``user_id`` and ``filename`` taken from the query string.
+    Multipart form uploads are still accepted for existing clients.
+    """
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit")
+    if request.mimetype == 'multipart/form-data':
+        if 'file' not in request.files:
+            raise UploadError("No file provided")
+        file = request.files['file']
+        if file.filename == '':
+            raise UploadError("No file selected")
+        return file.stream, file.filename, file.mimetype, request.form.get('user_id')
+    filename = request.args.get('filename')
+    if not filename:
+        raise UploadError("Missing required parameter: filename")
+    return request.stream, filename, request.mimetype or None, request.args.get('user_id')
+
+def new_blob_name():
+    """Unique blob path for new content; files refer to it through the metadata index"""
+    return f"content/{uuid.uuid4()}"
+
+def upload_response(file_record):
+    # Content is deduplicated across users, so whether it was already stored is not revealed
+    return {
+        "message": "File uploaded successfully",
+        "file_id": file_record["file_id"],
+        "blob_path": file_record["blob_path"],
+        "size": file_record["size"],
+        "status": "success"
+    }
+
+@api.route('/api/upload', methods=['POST'])
+def upload_file():
+    """Stream a file to Azure Blob Storage in parallel blocks"""
+    try:
+        stream, filename, content_type, user_id = get_upload_source()
+
+        if not user_id:
+            return jsonify({"error": "Missing required field: user_id", "status": "error"}), 400
+
+        # Stage to Blob Storage; blocks are only committed if the content is new
+        blob_client = get_blob_container_client().get_blob_client(new_blob_name())
+        block_ids, size, digest = stage_upload(blob_client, stream)
+        file_record = store_file(blob_client, block_ids, size, digest, user_id, filename, content_type)
+
+        return jsonify(upload_response(file_record))
+
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+@api.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    """Start a resumable multi-part upload"""
+    try:
+        data = request.json
+        user_id = data.get('user_id')
+        filename = data.get('filename')
+
+        if not user_id or not filename:
+            return jsonify({
+                "error": "Missing required fields: user_id and filename",
+                "status": "error"
+            }), 400
+
+        upload_id = str(uuid.uuid4())
+        upload_sessions_collection.insert_one({
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "filename": filename,
+            "content_type": data.get('content_type'),
+            "blob_path": new_blob_name(),
+            "parts": {},
+            "status": "open",
+            "created_at": datetime.datetime.now()
+        })
+
+        return jsonify({
+            "upload_id": upload_id,
+            "part_size": UPLOAD_MAX_PART_BYTES,
+            "block_size": UPLOAD_BLOCK_SIZE,
+            "max_size": MAX_UPLOAD_BYTES,
+            "status": "success"
+        })
+
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+def get_open_upload_session(upload_id):
+    session = upload_sessions_collection.find_one({"upload_id": upload_id}, {"_id": 0})
+    if session is None:
+        raise UploadError("Unknown upload_id")
+    if session["status"] != "open":
+        raise UploadError(f"Upload is already {session['status']}")
+    return session
+
+@api.route('/api/uploads/<upload_id>/parts/<int:part_number>', methods=['PUT'])
+def upload_part(upload_id, part_number):
+    """Upload (or re-upload) one part of a resumable upload"""
+    try:
+        session = get_open_upload_session(upload_id)
+        blob_client = get_blob_container_client().get_blob_client(session["blob_path"])
+        part = stage_part(blob_client, request.stream, part_number, request.headers.get('X-Content-SHA256'))
+        upload_sessions_collection.update_one(
+            {"upload_id": upload_id},
+            {"$set": {f"parts.{part_number}": part}}
         )
 
-        ai_response = response.choices[0].message.content
+        return jsonify({
+            "part_number": part_number,
+            "size": part["size"],
+            "sha256": part["sha256"],
+            "status": "success"
+        })
+
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
 
-        # Store conversation in MongoDB
-        store_conversation(user_id, user_message, ai_response)
+@api.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """Report which parts of a resumable upload have been received"""
+    try:
+        session = upload_sessions_collection.find_one({"upload_id": upload_id}, {"_id": 0})
+        if session is None:
+            return jsonify({"error": "Unknown upload_id", "status": "error"}), 404
 
         return jsonify({
-            "response": ai_response,
+            "upload_id": upload_id,
+            "upload_status": session["status"],
+            "parts": {n: {"size": p["size"], "sha256": p["sha256"]} for n, p in session["parts"].items()},
             "status": "success"
         })
 
@@ -266,40 +716,115 @@ def chat():
             "status": "error"
         }), 500
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    """Upload a file to Azure Blob Storage"""
+@api.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Commit the received parts of a resumable upload as one blob"""
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "No file provided", "status": "error"}), 400
+        session = get_open_upload_session(upload_id)
+        blob_client = get_blob_container_client().get_blob_client(session["blob_path"])
+        block_ids, size, digest = collect_parts(session["parts"])
+        file_record = store_file(blob_client, block_ids, size, digest, session["user_id"],
+                                 session["filename"], session.get("content_type"))
+        upload_sessions_collection.update_one(
+            {"upload_id": upload_id},
+            {"$set": {"status": "completed", "file_id": file_record["file_id"],
+                      "completed_at": datetime.datetime.now()},
+             "$unset": {"parts": ""}}
+        )
 
-        file = request.files['file']
-        user_id = request.form.get('user_id')
+        return jsonify(upload_response(file_record))
+
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+@api.route('/api/files', methods=['GET'])
+def list_files():
+    """List or search a user's uploaded files from the metadata index"""
+    try:
+        user_id = request.args.get('user_id')
+        query = request.args.get('q')
+        content_type = request.args.get('content_type')
+        limit = request.args.get('limit', 50, type=int)
 
         if not user_id:
-            return jsonify({"error": "Missing required field: user_id", "status": "error"}), 400
+            return jsonify({
+                "error": "Missing required parameter: user_id",
+                "status": "error"
+            }), 400
 
-        if file.filename == '':
-            return jsonify({"error": "No file selected", "status": "error"}), 400
+        ensure_file_indexes()
+        filters = {"user_id": user_id}
+        if query:
+            filters["filename"] = {"$regex": re.escape(query), "$options": "i"}
+        if content_type:
+            filters["content_type"] = content_type
+
+        files = list(files_collection.find(filters, {"_id": 0}).sort("created_at", -1).limit(limit))
+
+        return jsonify({
+            "files": files,
+            "status": "success"
+        })
+
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+@api.route('/api/export', methods=['GET'])
+def export_user_data():
+    """Stream all of a user's documents as NDJSON"""
+    user_id = request.args.get('user_id')
+
+    if not user_id:
+        return jsonify({
+            "error": "Missing required parameter: user_id",
+            "status": "error"
+        }), 400
+
+    # Archived daily logs and messages follow the documents still in MongoDB
+    lines = itertools.chain(export_lines(get_db(), user_id),
+                            export_archived_lines(get_blob_container_client(), user_id))
+    return Response(
+        stream_with_context(lines),
+        mimetype='application/x-ndjson',
+        headers={"Content-Disposition": f'attachment; filename="{user_id}.ndjson"'}
+    )
+
+@api.route('/api/import', methods=['POST'])
+def import_user_data():
+    """Import a user's documents from an NDJSON body (as produced by /api/export)"""
+    try:
+        user_id = request.args.get('user_id')
+
+        if not user_id:
+            return jsonify({
+                "error": "Missing required parameter: user_id",
+                "status": "error"
+            }), 400
 
-        # Upload to Blob Storage
-        blob_name = f"{user_id}/{file.filename}"
-        blob_client = blob_container_client.get_blob_client(blob_name)
-        blob_client.upload_blob(file)
+        counts = import_lines(get_db(), iter(request.stream.readline, b""), user_id)
 
         return jsonify({
-            "message": "File uploaded successfully",
-            "blob_path": blob_name,
+            "imported": counts,
             "status": "success"
         })
 
+    except BulkDataError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
     except Exception as e:
         return jsonify({
             "error": str(e),
             "status": "error"
         }), 500
 
-@app.route('/api/history', methods=['GET'])
+@api.route('/api/history', methods=['GET'])
 def get_history():
     """Get conversation history for a user"""
     try:
@@ -326,7 +851,40 @@ def get_history():
             "status": "error"
         }), 500
 
-@app.route('/api/user', methods=['POST'])
+@api.route('/api/logs', methods=['GET'])
+def get_logs():
+    """Get a user's daily logs and conversation messages in a date range, including archived ones"""
+    try:
+        user_id = request.args.get('user_id')
+
+        if not user_id:
+            return jsonify({
+                "error": "Missing required parameter: user_id",
+                "status": "error"
+            }), 400
+
+        try:
+            start, end = (datetime.datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+                          for name in ('start', 'end'))
+        except ValueError:
+            return jsonify({
+                "error": "start and end must be ISO dates (YYYY-MM-DD)",
+                "status": "error"
+            }), 400
+
+        # Recent entries come from MongoDB, older ones from their Blob Storage archives
+        return jsonify({
+            "entries": log_history(get_blob_container_client(), user_id, start, end),
+            "status": "success"
+        })
+
+    except Exception as e:
+        return jsonify({
+            "error": str(e),
+            "status": "error"
+        }), 500
+
+@api.route('/api/user', methods=['POST'])
 def create_user():
     """Create a new user profile"""
     try:
@@ -370,7 +928,7 @@ def create_user():
             "preferred_interaction_time": preferred_interaction_time,
             "created_at": datetime.datetime.now()
         }
-        users_collection.insert_one(user_profile)
+        get_repositories().users.create(user_profile)
 
         return jsonify({
             "user_id": user_id,
@@ -383,7 +941,8 @@ def create_user():
             "status": "error"
         }), 500
 
-@app.route('/api/daily-log', methods=['POST'])
+@api.route('/api/daily-log', methods=['POST'])
+@idempotent
 def create_daily_log():
     """Create a daily drinking log"""
     try:
@@ -405,14 +964,12 @@ def create_daily_log():
         date = datetime.datetime.now()
 
         # Get user's streak count
-        user = users_collection.find_one({"user_id": user_id})
+        repositories = get_repositories()
+        user = repositories.users.get(user_id)
         streak_count = 0
         if user and meets_goal:
             # Get the last log
-            last_log = daily_logs_collection.find_one(
-                {"user_id": user_id},
-                sort=[("date", -1)]
-            )
+            last_log = repositories.daily_logs.last_log(user_id)
             if last_log and last_log.get("meets_goal"):
                 streak_count = last_log.get("streak_count", 0) + 1
             else:
@@ -421,25 +978,19 @@ def create_daily_log():
         # Generate AI feedback based on the log
         user_message = f"I drank {alcohol_consumed} units of alcohol today. My mood was {mood}. The reason was {drink_reason}. Did I meet my goal? {meets_goal}."
         
-        # Get user history for context
-        user_history = get_user_history(user_id)
+        # Summary of earlier conversations and the newest messages, for context (shorter over a token quota)
+        quota = quota_state(user_id)
+        user_history, insights = get_prompt_context(user_id, context_limit(quota, SUMMARY_KEEP_RECENT))
         
-        # Generate AI response
-        response = openai_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                *user_history,
-                {"role": "user", "content": user_message}
-            ],
-            model=GPT4_DEPLOYMENT,
-            max_tokens=1000,
-            temperature=0.7
-        )
-
-        agent_feedback = response.choices[0].message.content
+        # Generate AI response (ahead of other model calls for high-risk users)
+        with llm_priority(risk_priority(insights), user_id):
+            agent_feedback = generate_ai_response(user_history, user_message, user_id=user_id, quota=quota)
         
-        # Extract coping suggestion from agent feedback
-        coping_suggestion = extract_coping_suggestion(agent_feedback)
+        # A canned reply is shown but not stored as the agent's feedback
+        degraded = is_degraded(agent_feedback)
+
+        # Extract coping suggestion from agent feedback (or the resource catalog)
+        coping_suggestion = extract_coping_suggestion(None if degraded else agent_feedback, drink_reason, mood)
 
         # Create daily log in MongoDB
         daily_log = {
@@ -448,25 +999,30 @@ def create_daily_log():
             "date": date,
             "alcohol_consumed": alcohol_consumed,
             "meets_goal": meets_goal,
-            "agent_feedback": agent_feedback,
             "drink_reason": drink_reason,
             "coping_suggestion": coping_suggestion,
             "mood": mood,
             "streak_count": streak_count
         }
-        daily_logs_collection.insert_one(daily_log)
+        if not degraded:
+            daily_log["agent_feedback"] = agent_feedback
+        # Write the log, the conversation and any milestone together
+        with repositories.unit_of_work():
+            repositories.daily_logs.create(daily_log)
 
-        # Store conversation in history
-        store_conversation(user_id, user_message, agent_feedback)
+            # Store conversation in history
+            if not degraded:
+                store_conversation(user_id, user_message, agent_feedback)
 
-        # Check if this is a milestone
-        check_and_create_milestone(user_id, streak_count, alcohol_consumed)
+            # Check if this is a milestone
+            check_and_create_milestone(user_id, streak_count, alcohol_consumed)
 
         return jsonify({
             "log_id": log_id,
             "agent_feedback": agent_feedback,
             "coping_suggestion": coping_suggestion,
             "streak_count": streak_count,
+            "quota": quota,
             "status": "success"
         })
 
@@ -476,7 +1032,8 @@ def create_daily_log():
             "status": "error"
         }), 500
 
-@app.route('/api/relapse-support', methods=['POST'])
+@api.route('/api/relapse-support', methods=['POST'])
+@idempotent
 def create_relapse_support():
     """Create a relapse support entry"""
     try:
@@ -497,25 +1054,19 @@ def create_relapse_support():
         # Generate AI response for relapse support
         user_message = f"I'm having a difficult time and might relapse. The trigger is: {trigger_event}"
         
-        # Get user history for context
-        user_history = get_user_history(user_id)
+        # Summary of earlier conversations and the newest messages, for context. Over a token
+        # quota the context is shorter, but relapse support always gets a model reply
+        quota = QUOTA_SOFT if quota_state(user_id) != QUOTA_OK else QUOTA_OK
+        user_history = get_conversation_context(user_id, context_limit(quota, SUMMARY_KEEP_RECENT))
         
-        # Generate AI response
-        response = openai_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                *user_history,
-                {"role": "user", "content": user_message}
-            ],
-            model=GPT4_DEPLOYMENT,
-            max_tokens=1000,
-            temperature=0.7
-        )
+        # Generate AI response; relapse support goes ahead of other model calls when saturated
+        with llm_priority(CRITICAL, user_id):
+            agent_response = generate_ai_response(user_history, user_message, hedge=RELAPSE_SUPPORT_HEDGING,
+                                                  user_id=user_id)
+        degraded = is_degraded(agent_response)
 
-        agent_response = response.choices[0].message.content
-        
-        # Extract resource from agent response
-        resource_shared = extract_resource(agent_response)
+        # Pick the catalog resource that best fits the trigger and the agent response
+        resource_shared = extract_resource(None if degraded else agent_response, trigger_event)
 
         # Create relapse support entry in MongoDB
         relapse_support = {
@@ -523,18 +1074,23 @@ def create_relapse_support():
             "user_id": user_id,
             "timestamp": timestamp,
             "trigger_event": trigger_event,
-            "agent_response": agent_response,
             "resource_shared": resource_shared
         }
-        relapse_support_collection.insert_one(relapse_support)
+        if not degraded:
+            relapse_support["agent_response"] = agent_response
+        repositories = get_repositories()
+        with repositories.unit_of_work():
+            repositories.relapse_support.create(relapse_support)
 
-        # Store conversation in history
-        store_conversation(user_id, user_message, agent_response)
+            # Store conversation in history
+            if not degraded:
+                store_conversation(user_id, user_message, agent_response)
 
         return jsonify({
             "support_id": support_id,
             "agent_response": agent_response,
             "resource_shared": resource_shared,
+            "quota": quota,
             "status": "success"
         })
 
@@ -544,7 +1100,7 @@ def create_relapse_support():
             "status": "error"
         }), 500
 
-@app.route('/api/motivations', methods=['GET'])
+@api.route('/api/motivations', methods=['GET'])
 def get_motivations():
     """Get user's motivations and milestones"""
     try:
@@ -556,11 +1112,8 @@ def get_motivations():
                 "status": "error"
             }), 400
 
-        # Get user's motivations from MongoDB
-        motivations = list(motivations_collection.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).sort("achieved_at", -1))
+        # Get user's motivations
+        motivations = get_repositories().milestones.list(user_id)
 
         return jsonify({
             "motivations": motivations,
@@ -573,7 +1126,7 @@ def get_motivations():
             "status": "error"
         }), 500
 
-@app.route('/api/notifications', methods=['GET'])
+@api.route('/api/notifications', methods=['GET'])
 def get_notifications():
     """Get user's notifications"""
     try:
@@ -585,11 +1138,8 @@ def get_notifications():
                 "status": "error"
             }), 400
 
-        # Get user's notifications from MongoDB
-        notifications = list(notifications_collection.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).sort("send_time_local", -1))
+        # Get user's notifications
+        notifications = get_repositories().notifications.list(user_id)
 
         return jsonify({
             "notifications": notifications,
@@ -603,35 +1153,61 @@ def get_notifications():
         }), 500
 
 # Helper functions
+def format_sources(sources):
+    """System message listing retrieved document passages, numbered for citation"""
+    passages = "\n\n".join(f"[{i}] {source['filename']}:\n{source['text']}" for i, source in enumerate(sources, 1))
+    return {
+        "role": "system",
+        "content": f"Sources provided by the user (cite them as [n] when you use them):\n\n{passages}"
+    }
+
+def is_degraded(response):
+    """Whether ``response`` is a canned reply (no deployment available, or over the token quota)"""
+    return response in (FALLBACK_RESPONSE, QUOTA_RESPONSE)
+
+def generate_ai_response(user_history, user_message, hedge=False, sources=None, user_id=None, quota=QUOTA_OK):
+    """Generate an AI response, falling back to a canned reply if no deployment is available.
+
+    Over the hard token quota, the user's last reply to the same message (or a
+    canned reply) is returned without a model call. Canned replies are shown
+    to the user but not stored as agent output (see ``is_degraded``).
+    """
+    cache = get_response_cache()
+    if quota == QUOTA_HARD:
+        return cache.get(user_id, user_message) or QUOTA_RESPONSE
+    response = get_router().chat_completion(
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            *([format_sources(sources)] if sources else []),
+            *user_history,
+            {"role": "user", "content": user_message}
+        ],
+        hedge=hedge,
+        fallback=FALLBACK_RESPONSE,
+        max_tokens=1000,
+        temperature=0.7
+    )
+    if user_id is not None and response != FALLBACK_RESPONSE:
+        cache.put(user_id, user_message, response)
+    return response
+
 def get_user_history(user_id, limit=10):
-    """Get conversation history for a user from MongoDB"""
-    # remove the sort to avoid sorting by date temporarily
-    cursor = daily_logs_collection.find(
-    {"user_id": user_id},
-    {"_id": 0, "agent_feedback": 1, "date": 1}
-    ).limit(limit)
-
-    # restore the sort to sort by date
-    # cursor = daily_logs_collection.find(
-    #     {"user_id": user_id},
-    #     {"_id": 0, "agent_feedback": 1, "date": 1}
-    # ).sort("date", -1).limit(limit)
-    
+    """Get conversation history for a user"""
     history = []
-    for item in cursor:
-        if "agent_feedback" in item:
-            history.append({
-                "role": "assistant",
-                "content": item["agent_feedback"]
-            })
+    for item in get_repositories().daily_logs.recent_feedback(user_id, limit):
+        history.append({
+            "role": "assistant",
+            "content": item["agent_feedback"]
+        })
     
     # Reverse to get chronological order
     history.reverse()
     return history
 
 def store_conversation(user_id, user_message, ai_response):
-    """Store conversation in MongoDB"""
+    """Store conversation in the user's log"""
     timestamp = datetime.datetime.now()
+    repositories = get_repositories()
     
     # Store user message
     user_item = {
@@ -641,7 +1217,6 @@ def store_conversation(user_id, user_message, ai_response):
         "is_user": True,
         "timestamp": timestamp
     }
-    daily_logs_collection.insert_one(user_item)
 
     # Store AI response
     ai_item = {
@@ -651,24 +1226,65 @@ def store_conversation(user_id, user_message, ai_response):
         "is_user": False,
         "timestamp": timestamp
     }
-    daily_logs_collection.insert_one(ai_item)
-
-def extract_coping_suggestion(agent_feedback):
-    """Extract coping suggestion from agent feedback"""
-    # This is a simple implementation - in a real app, you might use NLP or regex
-    # to extract the coping suggestion from the agent's feedback
-    return "Try deep breathing exercises or call a friend for support."
-
-def extract_resource(agent_response):
-    """Extract resource from agent response"""
-    # This is a simple implementation - in a real app, you might use NLP or regex
-    # to extract the resource from the agent's response
-    return "https://example.com/coping-strategies"
+    with repositories.unit_of_work():
+        repositories.conversations.add(user_item)
+        repositories.conversations.add(ai_item)
+
+    # Older messages are folded into the user's rolling summary in the background
+    note_messages(user_id, 2)
+
+def store_file(blob_client, block_ids, size, content_hash, user_id, filename, content_type):
+    """Record an upload in the metadata index, committing its staged blocks only if the content is new.
+
+    Returns the file record. Blocks that are not committed are discarded by
+    Blob Storage, so duplicate content is never stored twice.
+    """
+    from pymongo.errors import DuplicateKeyError
+
+    if not content_type or content_type == 'application/octet-stream':
+        content_type = mimetypes.guess_type(filename)[0] or content_type
+    ensure_file_indexes()
+    content = file_contents_collection.find_one({"content_hash": content_hash})
+    deduplicated = content is not None
+    if not deduplicated:
+        commit_blocks(blob_client, block_ids, content_type, {"content_hash": content_hash})
+        content = {
+            "content_hash": content_hash,
+            "blob_path": blob_client.blob_name,
+            "size": size,
+            "content_type": content_type,
+            "created_at": datetime.datetime.now()
+        }
+        try:
+            file_contents_collection.insert_one(content)
+        except DuplicateKeyError:
+            # A concurrent upload of the same content won; keep its blob
+            blob_client.delete_blob()
+            content = file_contents_collection.find_one({"content_hash": content_hash})
+            deduplicated = True
+
+    file_record = {
+        "file_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "filename": os.path.basename(filename),
+        "content_type": content_type,
+        "size": size,
+        "content_hash": content_hash,
+        "blob_path": content["blob_path"],
+        "created_at": datetime.datetime.now()
+    }
+    files_collection.insert_one(dict(file_record))
+    if ingestion_enabled():
+        schedule_ingestion(get_db(), get_blob_container_client(), file_record)
+    metrics.increment("upload_contents_total", {"result": "deduplicated" if deduplicated else "stored"})
+    return file_record
 
 def check_and_create_milestone(user_id, streak_count, alcohol_consumed):
     """Check if this is a milestone and create it if it is"""
     # This is a simple implementation - in a real app, you might have more complex logic
     if streak_count in [7, 30, 90, 180, 365]:
+        repositories = get_repositories()
+
         # Calculate money saved (assuming $10 per drink)
         money_saved_usd = alcohol_consumed * 10
         
@@ -686,7 +1302,6 @@ def check_and_create_milestone(user_id, streak_count, alcohol_consumed):
             "celebration_message": f"Congratulations! You've been sober for {streak_count} days!",
             "achieved_at": datetime.datetime.now()
         }
-        motivations_collection.insert_one(milestone)
         
         # Create notification
         notification_id = str(uuid.uuid4())
@@ -698,22 +1313,41 @@ def check_and_create_milestone(user_id, streak_count, alcohol_consumed):
             "type": "milestone",
             "status": "sent"
         }
-        notifications_collection.insert_one(notification)
+        with repositories.unit_of_work():
+            repositories.milestones.create(milestone)
+            repositories.notifications.create(notification)
 
 def store_agent_memory(user_id, memory):
-    """Store agent memory in MongoDB"""
+    """Store agent memory"""
     memory_doc = {
         "memory_id": str(uuid.uuid4()),
         "user_id": user_id,
         "memory": memory,
         "timestamp": datetime.datetime.now()
     }
-    agent_memory_collection.insert_one(memory_doc)
+    get_repositories().memory.create(memory_doc)
 
 def get_agent_memory(user_id, limit=10):
-    """Retrieve agent memory from MongoDB"""
-    memory_docs = agent_memory_collection.find({"user_id": user_id}).sort("timestamp", -1).limit(limit)
-    return list(memory_docs)
+    """Retrieve agent memory, most recent first"""
+    return get_repositories().memory.recent(user_id, limit)
+
+def create_app():
+    """Application factory: builds the Flask app without touching any external service"""
+    app = Flask(__name__, static_folder='static')
+    CORS(app)  # Enable CORS for all routes
+    app.before_request(start_request_span)
+    app.after_request(record_response_size)
+    app.teardown_request(end_request_span)
+    app.register_blueprint(api)
+    if os.getenv("CASSETTE_MODE"):
+        # Record or replay model and MongoDB calls (see cassettes.py)
+        from cassettes import install_from_env
+        install_from_env()
+    if WORKFLOW_PREWARM:
+        prewarm()
+    return app
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
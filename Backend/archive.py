@@ -0,0 +1,233 @@
+"""Hot/cold tiering of old daily logs and conversation messages.
+
+``daily_logs`` holds every daily log and chat message ever written. The
+archival job moves entries older than ``ARCHIVE_AFTER_DAYS`` out of MongoDB
+into one gzip-compressed NDJSON blob per user and month
+(``ARCHIVE_PREFIX<user_id>/<YYYY-MM>.ndjson.gz``), in the ``bulk_data.py``
+line format, so an archive can be restored with
+``gunzip -c <archive> | python bulk_data.py import``. What stays in MongoDB
+is a small stub per user and month in ``log_archives`` (blob name, record
+counts and the first and last dates it covers).
+
+Per user and month the job writes the blob, then the stub, then deletes the
+archived entries, so an interrupted run loses nothing; rerunning it merges
+the leftovers into the existing archive without duplicates. Conversation
+messages are only archived once they are folded into the user's rolling
+summary (see ``summaries.py``), so prompts never need the cold tier.
+
+``history`` and ``export_lines`` read a user's entries from both tiers. Cold
+reads find the overlapping archives through the stubs and download and
+decompress them on demand; the last ``ARCHIVE_CACHE_SIZE`` archives stay
+decompressed in process memory.
+
+Run nightly with ``python archive.py --all`` (or ``--user-id <id>``). Like
+ingestion, every function takes the Blob Storage container client, so tests
+and benchmarks can pass ``stubs.InMemoryBlobContainer``.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from bulk_data import encode_line, parse_line
+from repositories import get_repositories, record_key, record_time
+from summaries import SUMMARY_ENABLED
+from tracing import metrics, span
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive/daily_logs/")
+ARCHIVE_CACHE_SIZE = int(os.getenv("ARCHIVE_CACHE_SIZE", "64"))
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", "4"))
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+ARCHIVE_COLLECTION = "daily_logs"
+
+
+def archive_name(user_id, month):
+    return f"{ARCHIVE_PREFIX}{quote(str(user_id), safe='')}/{month}.ndjson.gz"
+
+
+def encode_archive(documents):
+    """Compressed NDJSON of ``documents`` (deterministic for the same input)"""
+    text = "".join(encode_line(ARCHIVE_COLLECTION, document) for document in documents)
+    return gzip.compress(text.encode("utf-8"), ARCHIVE_COMPRESSION_LEVEL, mtime=0)
+
+
+def decode_archive(data):
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return [parse_line(line, collections=(ARCHIVE_COLLECTION,))[1] for line in lines if line.strip()]
+
+
+def _oldest_first(documents):
+    return sorted(documents, key=lambda document: record_time(document) or datetime.datetime.min)
+
+
+class ArchiveCache:
+    """Decompressed archives, least recently used evicted first.
+
+    Entries are keyed by blob name and the stub's ``archived_at``, so an
+    archive rewritten by another process is fetched again.
+    """
+
+    def __init__(self, size=ARCHIVE_CACHE_SIZE):
+        self.size = size
+        self._archives = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, container, stub):
+        """The documents of the archive ``stub`` points to (shared; do not modify them)"""
+        key = (stub["blob_name"], stub["archived_at"])
+        with self._lock:
+            documents = self._archives.get(key)
+            if documents is not None:
+                self._archives.move_to_end(key)
+                metrics.increment("archive_cache_total", {"result": "hit"})
+                return documents
+        metrics.increment("archive_cache_total", {"result": "miss"})
+        with span("archive.fetch", stub["blob_name"]):
+            documents = decode_archive(container.get_blob_client(stub["blob_name"]).download_blob().readall())
+        with self._lock:
+            self._archives[key] = documents
+            self._archives.move_to_end(key)
+            while len(self._archives) > self.size:
+                self._archives.popitem(last=False)
+        return documents
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ArchiveCache()
+    return _cache
+
+
+def archive_user(container, user_id, cutoff):
+    """Move the user's entries dated before ``cutoff`` into their monthly archives.
+
+    Returns the number of entries archived.
+    """
+    repositories = get_repositories()
+    messages_cutoff = cutoff
+    if SUMMARY_ENABLED:
+        covered_until = (repositories.summaries.get(user_id) or {}).get("covered_until")
+        messages_cutoff = min(cutoff, covered_until) if covered_until else None
+    documents = repositories.daily_logs.archivable(user_id, cutoff, messages_cutoff)
+    by_month = {}
+    for document in documents:
+        by_month.setdefault(f"{record_time(document):%Y-%m}", []).append(document)
+
+    stubs = {stub["month"]: stub for stub in repositories.archives.for_user(user_id)} if by_month else {}
+    with span("archive.user", "archive_user"):
+        for month, batch in sorted(by_month.items()):
+            # Merge into the month's archive; entries left over by an interrupted run replace their copies
+            merged = {}
+            if month in stubs:
+                merged.update((record_key(document), document) for document in get_cache().get(container, stubs[month]))
+            merged.update((record_key(document), document) for document in batch)
+            merged = _oldest_first(merged.values())
+
+            blob_name = archive_name(user_id, month)
+            data = encode_archive(merged)
+            container.get_blob_client(blob_name).upload_blob(data, overwrite=True)
+            repositories.archives.save({
+                "user_id": user_id,
+                "month": month,
+                "blob_name": blob_name,
+                "records": len(merged),
+                "logs": sum(1 for document in merged if "is_user" not in document),
+                "messages": sum(1 for document in merged if "is_user" in document),
+                "first": record_time(merged[0]),
+                "last": record_time(merged[-1]),
+                "size": len(data),
+                "archived_at": datetime.datetime.now()
+            })
+            repositories.daily_logs.delete(batch)
+            metrics.increment("archive_records_total", {}, len(batch))
+    return len(documents)
+
+
+def _archive_or_skip(container, user_id, cutoff):
+    try:
+        return archive_user(container, user_id, cutoff)
+    except Exception as e:
+        # Whatever was not archived stays in MongoDB for the next run
+        metrics.increment("archive_failures_total", {"error": type(e).__name__})
+        return 0
+
+
+def run_archival(container, user_ids=None, older_than_days=ARCHIVE_AFTER_DAYS, workers=ARCHIVE_WORKERS):
+    """Archive the old entries of ``user_ids`` (every user with some when None).
+
+    Returns ``{user_id: entries archived}`` for users with archived entries.
+    """
+    cutoff = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=older_than_days),
+                                       datetime.time())
+    if user_ids is None:
+        user_ids = get_repositories().daily_logs.archivable_users(cutoff)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="archive") as executor:
+        counts = executor.map(lambda user_id: _archive_or_skip(container, user_id, cutoff), user_ids)
+        return {user_id: count for user_id, count in zip(user_ids, counts) if count}
+
+
+def archived(container, user_id, start=None, end=None):
+    """The user's archived entries dated in [start, end), oldest first"""
+    documents = []
+    for stub in get_repositories().archives.for_user(user_id, start, end):
+        for document in get_cache().get(container, stub):
+            when = record_time(document)
+            if when is not None and (start is None or when >= start) and (end is None or when < end):
+                documents.append(dict(document))
+    return documents
+
+
+def history(container, user_id, start=None, end=None):
+    """The user's daily logs and messages dated in [start, end) from both tiers, oldest first"""
+    documents = get_repositories().daily_logs.between(user_id, start, end)
+    # An interrupted archival run can leave an entry in both tiers
+    hot = {record_key(document) for document in documents}
+    documents.extend(document for document in archived(container, user_id, start, end)
+                     if record_key(document) not in hot)
+    return [{key: value for key, value in document.items() if key != "_id"} for document in _oldest_first(documents)]
+
+
+def export_lines(container, user_id):
+    """NDJSON lines (``bulk_data.py`` format) of the user's archived entries"""
+    for stub in get_repositories().archives.for_user(user_id):
+        for document in get_cache().get(container, stub):
+            yield encode_line(ARCHIVE_COLLECTION, document)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old daily logs and messages into Blob Storage archives")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", help="Archive one user's old entries")
+    target.add_argument("--all", action="store_true", help="Archive every user's old entries")
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="Archive entries older than this many days")
+    parser.add_argument("--workers", type=int, default=ARCHIVE_WORKERS, help="Users archived in parallel")
+    args = parser.parse_args()
+
+    from app import get_blob_container_client
+    counts = run_archival(get_blob_container_client(), [args.user_id] if args.user_id else None,
+                          args.older_than_days, args.workers)
+    print(json.dumps({"users": len(counts), "records": sum(counts.values())}))
@@ -0,0 +1,312 @@
+"""HTTP-level benchmark for the Flask endpoints.
+
+Drives each route through the Flask test client from ``--concurrency``
+threads, in-process, against local stand-ins: a mongomock database seeded by
+``seed_data.py``, ``stubs.InMemoryBlobContainer`` for Blob Storage and
+``stubs.FaultInjectingChatClient`` deployments (with ``--llm-latency``
+seconds of simulated model latency) for Azure OpenAI. Nothing connects out.
+With ``--backend memory`` the user data lives in the in-memory repositories
+of ``repositories.py`` instead (uploads still use mongomock). With
+``--cassette`` the model calls are answered from a cassette recorded with
+``cassettes.py`` instead, at the recorded latencies times ``--time-scale``
+(0 for full speed).
+
+For every endpoint and concurrency level it reports throughput, mean and
+p50/p95/p99 latency, the error count and the mean number of database round
+trips per request. Per-request allocations (peak and
+retained bytes, measured with tracemalloc) come from a separate
+single-threaded pass so concurrent requests do not blur them.
+
+Results are JSON (with the git commit) so runs can be compared; pass
+``--baseline`` with an earlier ``--output`` file to print the change.
+
+Usage: python benchmarks/http_bench.py [--concurrency 1,8] [--requests 200]
+       [--backend mongo|memory] [--endpoints chat,history] [--cassette prod.json.gz --time-scale 1]
+       [--output results.json] [--baseline old.json]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from seed_data import seed
+from startup_bench import BACKEND_DIR, DUMMY_ENV
+
+# The benchmark measures the request path, not the rate limiter or background jobs
+BENCH_ENV = {"LLM_RATE_LIMIT_RPS": "1000000", "LLM_RATE_LIMIT_BURST": "1000000", "INGEST_ON_UPLOAD": "false",
+             "SUMMARY_ENABLED": "false"}
+
+MOODS = ("happy", "stressed", "calm", "anxious", "sad")
+REASONS = ("none", "stress", "social event", "boredom")
+
+
+class Workload:
+    """Builds requests for each endpoint from the seeded users"""
+
+    def __init__(self, user_ids, upload_bytes, seed_value):
+        self.user_ids = user_ids
+        self.upload_bytes = upload_bytes
+        self._random = random.Random(seed_value)
+        self._lock = threading.Lock()
+
+    def user_id(self):
+        with self._lock:
+            return self._random.choice(self.user_ids)
+
+    def upload_body(self):
+        # Distinct content per request, so uploads are not deduplicated away
+        with self._lock:
+            return self._random.randbytes(self.upload_bytes)
+
+    def chat(self, client):
+        return client.post("/api/chat", json={"user_id": self.user_id(), "message": "I'm feeling a craving right now"})
+
+    def daily_log(self, client):
+        with self._lock:
+            units = self._random.randint(0, 5)
+            mood, reason = self._random.choice(MOODS), self._random.choice(REASONS)
+        return client.post("/api/daily-log", json={
+            "user_id": self.user_id(), "alcohol_consumed": units, "meets_goal": units <= 2,
+            "drink_reason": reason, "mood": mood
+        })
+
+    def relapse_support(self, client):
+        return client.post("/api/relapse-support", json={
+            "user_id": self.user_id(), "trigger_event": "Friends invited me to a bar"
+        })
+
+    def history(self, client):
+        return client.get(f"/api/history?user_id={self.user_id()}&limit=10")
+
+    def motivations(self, client):
+        return client.get(f"/api/motivations?user_id={self.user_id()}")
+
+    def notifications(self, client):
+        return client.get(f"/api/notifications?user_id={self.user_id()}")
+
+    def user(self, client):
+        return client.post("/api/user", json={
+            "name": "Bench User", "email": "bench@example.com", "age_range": "25-34",
+            "drinking_habits": "weekends", "goals": "alcohol-free weekdays"
+        })
+
+    def upload(self, client):
+        return client.post(f"/api/upload?user_id={self.user_id()}&filename=bench.bin", data=self.upload_body(),
+                           content_type="application/octet-stream")
+
+
+ENDPOINTS = {
+    "chat": Workload.chat,
+    "daily-log": Workload.daily_log,
+    "relapse-support": Workload.relapse_support,
+    "history": Workload.history,
+    "motivations": Workload.motivations,
+    "notifications": Workload.notifications,
+    "user": Workload.user,
+    "upload": Workload.upload,
+}
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def run_load(app, request_fn, requests, concurrency):
+    """Send ``requests`` requests from ``concurrency`` threads; returns latencies, errors and wall time"""
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    latencies, errors = [], []
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with counter_lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            response = request_fn(client)
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return latencies, errors, time.perf_counter() - start
+
+
+def measure_allocations(app, request_fn, samples):
+    """Median peak and retained tracemalloc bytes of single requests"""
+    client = app.test_client()
+    request_fn(client)  # warm caches and lazy imports
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            request_fn(client)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks), statistics.median(retained)
+
+
+def round_trip_totals():
+    """Total round trips and requests recorded so far (the ``db_round_trips`` histograms)"""
+    from tracing import metrics
+
+    rows = [row for row in metrics.summary()["histograms"] if row["metric"] == "db_round_trips"]
+    return sum(row["mean"] * row["count"] for row in rows), sum(row["count"] for row in rows)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def setup_app(args):
+    """Import the app wired to local stand-ins and a seeded in-memory database"""
+    for key, value in {**DUMMY_ENV, **BENCH_ENV}.items():
+        os.environ.setdefault(key, value)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import mongomock
+    import app as app_module
+    from llm_router import FAST_TIER, Deployment, DeploymentRouter, set_router
+    from repositories import create_repositories, set_repositories
+    from stubs import FaultInjectingChatClient, FaultInjector, InMemoryBlobContainer
+
+    db = mongomock.MongoClient()["bench"]
+    repositories = create_repositories(args.backend)
+    # The in-memory store takes the same insert_many batches as a database
+    target = repositories.store if args.backend == "memory" else db
+    seed(target, users=args.users, days=args.days, seed=args.seed)
+    app_module.set_clients(db=db, blob_container_client=InMemoryBlobContainer())
+    set_repositories(repositories)
+    if args.cassette:
+        from cassettes import REPLAY, Cassette, install
+        # SDK clients on the cassette's transport; the seeded data stays in place
+        install(Cassette(args.cassette, REPLAY, time_scale=args.time_scale), mongo=False)
+        client = None
+    else:
+        client = FaultInjectingChatClient(FaultInjector(latency=args.llm_latency, seed=args.seed))
+    endpoint, api_key = os.environ["AZURE_ENDPOINT"], os.environ["AZURE_API_KEY"]
+    set_router(DeploymentRouter([
+        Deployment("bench-large", "bench", endpoint=endpoint, api_key=api_key, client=client),
+        Deployment("bench-fast", "bench-fast", endpoint=endpoint, api_key=api_key, client=client, tier=FAST_TIER),
+    ]))
+    if args.backend == "memory":
+        user_ids = [user["user_id"] for user in repositories.store["users"].rows]
+    else:
+        user_ids = [user["user_id"] for user in db["users"].find({}, {"_id": 0, "user_id": 1})]
+    return app_module.app, user_ids
+
+
+def compare(results, baseline_path):
+    baseline = {(r["endpoint"], r["concurrency"]): r for r in json.loads(Path(baseline_path).read_text())["results"]}
+    print(f"\nChange vs {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        deltas = []
+        for key in ("throughput_rps", "p50_ms", "p99_ms", "db_round_trips", "alloc_peak_bytes"):
+            if old.get(key):
+                deltas.append(f"{key} {100 * (result[key] - old[key]) / old[key]:+.1f}%")
+        print(f"  {result['endpoint']:<16} c={result['concurrency']:<3} " + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated subset of endpoints")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--alloc-samples", type=int, default=20, help="Requests measured for allocations (0 to skip)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Simulated model latency in seconds")
+    parser.add_argument("--cassette", help="Replay model calls from this cassette instead of simulating them")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Multiplier of the cassette's recorded latencies (0 for full speed)")
+    parser.add_argument("--upload-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--users", type=int, default=100, help="Seeded users")
+    parser.add_argument("--days", type=int, default=60, help="Days of seeded history per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", choices=("mongo", "memory"), default="mongo",
+                        help="Data backend for user data (see repositories.py)")
+    parser.add_argument("--output")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    app, user_ids = setup_app(args)
+    workload = Workload(user_ids, args.upload_bytes, args.seed)
+    results = []
+    for name in endpoints:
+        request_fn = lambda client, fn=ENDPOINTS[name]: fn(workload, client)
+        alloc_peak = alloc_retained = None
+        if args.alloc_samples:
+            alloc_peak, alloc_retained = measure_allocations(app, request_fn, args.alloc_samples)
+        for concurrency in levels:
+            trips_before, requests_before = round_trip_totals()
+            latencies, errors, wall = run_load(app, request_fn, args.requests, concurrency)
+            trips_after, requests_after = round_trip_totals()
+            ordered = sorted(latencies)
+            result = {
+                "endpoint": name,
+                "concurrency": concurrency,
+                "requests": len(ordered),
+                "errors": len(errors),
+                "throughput_rps": len(ordered) / wall,
+                "mean_ms": statistics.fmean(ordered) * 1000,
+                "p50_ms": percentile(ordered, 0.50) * 1000,
+                "p95_ms": percentile(ordered, 0.95) * 1000,
+                "p99_ms": percentile(ordered, 0.99) * 1000,
+                "db_round_trips": (trips_after - trips_before) / max(1, requests_after - requests_before),
+                "alloc_peak_bytes": alloc_peak,
+                "alloc_retained_bytes": alloc_retained,
+            }
+            results.append(result)
+            print(f"{name:<16} c={concurrency:<3} {result['throughput_rps']:8.1f} req/s  "
+                  f"p50 {result['p50_ms']:7.1f} ms  p95 {result['p95_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+                  f"round trips {result['db_round_trips']:.1f}  errors {result['errors']}", file=sys.stderr)
+
+    output = {
+        "benchmark": "http",
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Synthetic data generator for benchmarks and load tests.
+
+Produces users with months of daily logs, chat messages, relapse-support
+entries, milestones and notifications, shaped exactly like the documents
+written by ``create_user``, ``create_daily_log``, ``store_conversation``,
+``create_relapse_support`` and ``check_and_create_milestone`` in ``app.py``
+(including the two conversation documents every daily log and relapse
+entry stores, and the streak rule). Output is fully determined by ``--seed``
+and ``--end-date``, so every run of a benchmark sees the same dataset.
+
+Documents are written with batched, unordered ``insert_many`` into MongoDB
+(``--mongo-uri``), as NDJSON for ``bulk_data.py import`` (``--output``), or,
+by default, into an in-memory mongomock database to time generation alone.
+Other benchmarks call ``seed(db, ...)`` directly, usually with mongomock.
+
+Usage: python benchmarks/seed_data.py [--users 1000] [--days 120] [--seed 42]
+       [--mongo-uri URI [--database NAME] | --output data.ndjson]
+"""
+import argparse
+import datetime
+import json
+import math
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+MILESTONE_DAYS = (7, 30, 90, 180, 365)
+
+# Categorical distributions: value -> relative weight
+AGE_RANGES = {"18-24": 2, "25-34": 4, "35-44": 3, "45-54": 2, "55-64": 1, "65+": 1}
+GENDERS = {"female": 5, "male": 5, "non-binary": 1, None: 1}
+DRINKING_HABITS = {"daily": 2, "weekends": 4, "social": 3, "binge": 1}
+MOTIVATIONS = {"health": 4, "family": 3, "money": 2, "sleep": 2, "fitness": 2}
+TRIGGERS = {"stress": 5, "social": 4, "boredom": 3, "loneliness": 2, "celebration": 2, "anxiety": 2}
+GOALS = {"quit": 2, "reduce to 2 drinks per week": 3, "alcohol-free weekdays": 3, "no binge drinking": 2}
+INTERACTION_TIMES = {"morning": 3, "afternoon": 2, "evening": 4}
+MOODS = {"happy": 3, "calm": 3, "stressed": 3, "anxious": 2, "sad": 2, "bored": 2, "proud": 2}
+DRINK_REASONS = {"none": 6, "stress": 3, "social event": 3, "boredom": 2, "celebration": 1, "habit": 2}
+RELAPSE_TRIGGERS = ("Had a fight with my partner", "Work deadline is crushing me", "Friends invited me to a bar",
+                    "Feeling lonely tonight", "Got some bad news")
+CHAT_MESSAGES = ("I'm feeling a craving right now", "How am I doing this week?",
+                 "I went to a party and only had water", "Any tips for sleeping without a drink?",
+                 "Work was stressful today", "I'm proud of my progress")
+AGENT_REPLIES = ("You're making amazing progress. Every step counts!",
+                 "It's okay to have a tough day. Let's refocus together.",
+                 "Remember why you started - you're doing this for yourself.",
+                 "That's a great choice. Try a short walk or a glass of water when the craving peaks.")
+COPING_SUGGESTION = "Try deep breathing exercises or call a friend for support."
+RESOURCE = "https://example.com/coping-strategies"
+
+
+class SeedConfig:
+    """Distribution parameters for the generated dataset"""
+
+    def __init__(self, users=1000, days=120, seed=42, end_date=datetime.datetime(2025, 1, 1),
+                 log_rate=0.8, drinking_day_rate=0.35, units_mean=3.0, goal_units=2,
+                 chats_per_day=0.6, relapse_rate=0.03):
+        self.users = users
+        self.days = days
+        self.seed = seed
+        self.end_date = end_date
+        self.log_rate = log_rate                    # chance a user logs on a given day
+        self.drinking_day_rate = drinking_day_rate  # chance a logged day involves drinking
+        self.units_mean = units_mean                # mean units on drinking days (geometric)
+        self.goal_units = goal_units                # meets_goal when units <= goal_units
+        self.chats_per_day = chats_per_day          # Poisson mean of extra chat exchanges
+        self.relapse_rate = relapse_rate            # chance of a relapse-support entry per day
+
+
+class Generator:
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.seed)
+
+    def uuid(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def pick(self, weights):
+        return self.random.choices(list(weights), weights=list(weights.values()))[0]
+
+    def poisson(self, mean):
+        limit, k, product = math.exp(-mean), 0, self.random.random()
+        while product > limit:
+            k += 1
+            product *= self.random.random()
+        return k
+
+    def units(self):
+        # Geometric number of units >= 1 with the configured mean
+        p = 1 / max(self.config.units_mean, 1)
+        return 1 + int(math.log(1 - self.random.random()) / math.log(1 - p)) if p < 1 else 1
+
+    def at(self, day, hour_low=7, hour_high=23):
+        return day + datetime.timedelta(seconds=self.random.randint(hour_low * 3600, hour_high * 3600))
+
+    def user(self, created_at):
+        """Shape of ``create_user``"""
+        first = self.random.choice(("Alex", "Sam", "Jordan", "Taylor", "Riley", "Casey", "Morgan", "Jamie"))
+        user_id = self.uuid()
+        return user_id, {
+            "user_id": user_id,
+            "name": f"{first} {user_id[:6]}",
+            "email": f"{first.lower()}.{user_id[:8]}@example.com",
+            "age_range": self.pick(AGE_RANGES),
+            "gender": self.pick(GENDERS),
+            "height_cm": self.random.randint(150, 200),
+            "weight_kg": self.random.randint(48, 120),
+            "drinking_habits": self.pick(DRINKING_HABITS),
+            "motivation": self.pick(MOTIVATIONS),
+            "health_conditions": self.random.choice((None, "none", "high blood pressure", "insomnia")),
+            "typical_triggers": self.pick(TRIGGERS),
+            "goals": self.pick(GOALS),
+            "preferred_interaction_time": self.pick(INTERACTION_TIMES),
+            "created_at": created_at
+        }
+
+    def conversation(self, user_id, user_message, ai_response, timestamp):
+        """The two documents of ``store_conversation``"""
+        for message, is_user in ((user_message, True), (ai_response, False)):
+            yield "daily_logs", {
+                "id": self.uuid(),
+                "user_id": user_id,
+                "message": message,
+                "is_user": is_user,
+                "timestamp": timestamp
+            }
+
+    def milestone(self, user_id, streak_count, alcohol_consumed, achieved_at):
+        """The documents of ``check_and_create_milestone``"""
+        message = f"Congratulations! You've been sober for {streak_count} days!"
+        yield "motivations", {
+            "milestone_id": self.uuid(),
+            "user_id": user_id,
+            "milestone": f"{streak_count} days sober",
+            "money_saved_usd": alcohol_consumed * 10,
+            "calories_avoided": alcohol_consumed * 100,
+            "celebration_message": message,
+            "achieved_at": achieved_at
+        }
+        yield "notifications", {
+            "notification_id": self.uuid(),
+            "user_id": user_id,
+            "send_time_local": achieved_at,
+            "message": message,
+            "type": "milestone",
+            "status": "sent"
+        }
+
+    def user_documents(self):
+        """Yield ``(collection, document)`` for one user and their history"""
+        config = self.config
+        start = config.end_date - datetime.timedelta(days=config.days)
+        user_id, profile = self.user(self.at(start))
+        yield "users", profile
+        last_log = None
+        for offset in range(config.days):
+            day = start + datetime.timedelta(days=offset)
+            if self.random.random() < config.log_rate:
+                drinking = self.random.random() < config.drinking_day_rate
+                alcohol_consumed = self.units() if drinking else 0
+                meets_goal = alcohol_consumed <= config.goal_units
+                mood = self.pick(MOODS)
+                drink_reason = self.pick(DRINK_REASONS) if drinking else "none"
+                # Streak rule of create_daily_log
+                streak_count = 0
+                if meets_goal:
+                    streak_count = last_log["streak_count"] + 1 if last_log and last_log["meets_goal"] else 1
+                date = self.at(day, 18)
+                agent_feedback = self.random.choice(AGENT_REPLIES)
+                last_log = {
+                    "log_id": self.uuid(),
+                    "user_id": user_id,
+                    "date": date,
+                    "alcohol_consumed": alcohol_consumed,
+                    "meets_goal": meets_goal,
+                    "agent_feedback": agent_feedback,
+                    "drink_reason": drink_reason,
+                    "coping_suggestion": COPING_SUGGESTION,
+                    "mood": mood,
+                    "streak_count": streak_count
+                }
+                yield "daily_logs", last_log
+                user_message = (f"I drank {alcohol_consumed} units of alcohol today. My mood was {mood}. "
+                                f"The reason was {drink_reason}. Did I meet my goal? {meets_goal}.")
+                yield from self.conversation(user_id, user_message, agent_feedback, date)
+                if streak_count in MILESTONE_DAYS:
+                    yield from self.milestone(user_id, streak_count, alcohol_consumed, date)
+            for _ in range(self.poisson(config.chats_per_day)):
+                yield from self.conversation(user_id, self.random.choice(CHAT_MESSAGES),
+                                             self.random.choice(AGENT_REPLIES), self.at(day))
+            if self.random.random() < config.relapse_rate:
+                trigger_event = self.random.choice(RELAPSE_TRIGGERS)
+                timestamp = self.at(day, 17)
+                agent_response = self.random.choice(AGENT_REPLIES)
+                yield "relapse_support", {
+                    "support_id": self.uuid(),
+                    "user_id": user_id,
+                    "timestamp": timestamp,
+                    "trigger_event": trigger_event,
+                    "agent_response": agent_response,
+                    "resource_shared": RESOURCE
+                }
+                user_message = f"I'm having a difficult time and might relapse. The trigger is: {trigger_event}"
+                yield from self.conversation(user_id, user_message, agent_response, timestamp)
+
+    def documents(self):
+        for _ in range(self.config.users):
+            yield from self.user_documents()
+
+
+def generate_documents(config=None, **options):
+    """Yield ``(collection, document)`` pairs for a dataset (``options`` override SeedConfig fields)"""
+    return Generator(config or SeedConfig(**options)).documents()
+
+
+def insert_documents(db, documents, batch_size=1000):
+    """Bulk-insert ``(collection, document)`` pairs with unordered batches. Returns counts per collection."""
+    batches, counts = {}, {}
+    for collection, document in documents:
+        batch = batches.setdefault(collection, [])
+        batch.append(document)
+        if len(batch) >= batch_size:
+            db[collection].insert_many(batch, ordered=False)
+            batches[collection] = []
+        counts[collection] = counts.get(collection, 0) + 1
+    for collection, batch in batches.items():
+        if batch:
+            db[collection].insert_many(batch, ordered=False)
+    return counts
+
+
+def seed(db, config=None, batch_size=1000, **options):
+    """Generate a dataset straight into ``db`` (pymongo or mongomock). Returns counts per collection."""
+    return insert_documents(db, generate_documents(config, **options), batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    defaults = SeedConfig()
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--end-date", type=datetime.datetime.fromisoformat, default=defaults.end_date)
+    parser.add_argument("--log-rate", type=float, default=defaults.log_rate)
+    parser.add_argument("--drinking-day-rate", type=float, default=defaults.drinking_day_rate)
+    parser.add_argument("--units-mean", type=float, default=defaults.units_mean)
+    parser.add_argument("--goal-units", type=int, default=defaults.goal_units)
+    parser.add_argument("--chats-per-day", type=float, default=defaults.chats_per_day)
+    parser.add_argument("--relapse-rate", type=float, default=defaults.relapse_rate)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--mongo-uri", help="Insert into this MongoDB deployment")
+    target.add_argument("--output", help="Write NDJSON for bulk_data.py import")
+    parser.add_argument("--database", default="drink-agent-app")
+    args = parser.parse_args()
+
+    config = SeedConfig(users=args.users, days=args.days, seed=args.seed, end_date=args.end_date,
+                        log_rate=args.log_rate, drinking_day_rate=args.drinking_day_rate,
+                        units_mean=args.units_mean, goal_units=args.goal_units,
+                        chats_per_day=args.chats_per_day, relapse_rate=args.relapse_rate)
+    start = time.perf_counter()
+    if args.output:
+        sys.path.insert(0, str(BACKEND_DIR))
+        from bulk_data import encode_line
+        counts = {}
+        with open(args.output, "w", encoding="utf-8") as f:
+            for collection, document in generate_documents(config):
+                f.write(encode_line(collection, document))
+                counts[collection] = counts.get(collection, 0) + 1
+    else:
+        if args.mongo_uri:
+            from pymongo import MongoClient
+            db = MongoClient(args.mongo_uri)[args.database]
+        else:
+            import mongomock
+            db = mongomock.MongoClient()[args.database]
+        counts = seed(db, config, batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"documents": counts, "total": sum(counts.values()), "seconds": round(elapsed, 2)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
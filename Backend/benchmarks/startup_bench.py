@@ -0,0 +1,111 @@
+"""Startup-time benchmark for the Flask app module.
+
+Measures, in fresh interpreters:
+
+- cold start: time to ``import app`` and serve a first ``GET /api``
+- fork time: time from ``os.fork()`` of an already-imported app (as a
+  gunicorn worker would be) to the child answering its first request
+
+Point ``--app-dir`` at another checkout (e.g. ``git worktree add /tmp/base <rev>``)
+to compare revisions. Dummy credentials are supplied so older revisions that
+build clients at import time can still be imported; nothing connects out.
+
+Usage: python benchmarks/startup_bench.py [--runs 10] [--app-dir DIR] [--output results.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+DUMMY_ENV = {
+    "MONGODB_URI": "mongodb://localhost:27017",
+    "BLOB_CONNECTION_STRING": ("DefaultEndpointsProtocol=https;AccountName=bench;"
+                               "AccountKey=YmVuY2g=;EndpointSuffix=core.windows.net"),
+    "BLOB_CONTAINER_NAME": "bench",
+    "AZURE_ENDPOINT": "https://bench.openai.azure.com/",
+    "AZURE_API_KEY": "bench",
+    "GPT4_DEPLOYMENT": "bench",
+    "API_VERSION": "2024-02-15-preview",
+}
+
+COLD_START_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/api')
+served = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "first_request_s": served - start}))
+"""
+
+FORK_SCRIPT = """
+import json, os, sys, time
+import app
+app.app.test_client().get('/api')  # warm the parent, like gunicorn --preload
+samples = []
+for _ in range(int(sys.argv[1])):
+    read_fd, write_fd = os.pipe()
+    start = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        app.app.test_client().get('/api')
+        os.write(write_fd, b"x")
+        os._exit(0)
+    os.close(write_fd)
+    os.read(read_fd, 1)
+    samples.append(time.perf_counter() - start)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+print(json.dumps({"fork_to_first_request_s": samples}))
+"""
+
+
+def run_script(script, app_dir, *args):
+    env = {**os.environ, **{k: v for k, v in DUMMY_ENV.items() if not os.getenv(k)}}
+    output = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        cwd=app_dir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def describe(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--app-dir", default=str(BACKEND_DIR))
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    cold = [run_script(COLD_START_SCRIPT, args.app_dir) for _ in range(args.runs)]
+    fork = run_script(FORK_SCRIPT, args.app_dir, str(args.runs))
+    results = {
+        "benchmark": "startup",
+        "app_dir": args.app_dir,
+        "import": describe([r["import_s"] for r in cold]),
+        "cold_start_first_request": describe([r["first_request_s"] for r in cold]),
+        "fork_to_first_request": describe(fork["fork_to_first_request_s"]),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
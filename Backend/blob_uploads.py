@@ -0,0 +1,192 @@
+"""Streaming and resumable uploads to Azure Blob Storage.
+
+Request bodies are read in fixed-size blocks and staged as block-blob
+blocks by a small thread pool, so a worker never holds more than
+``UPLOAD_PARALLELISM`` blocks in memory and the transfer overlaps with
+reading the request. Uploads larger than ``MAX_UPLOAD_BYTES`` are rejected.
+
+Every upload gets a content hash that does not depend on how it was sent:
+the SHA-256 of the concatenated SHA-256 digests of its
+``UPLOAD_BLOCK_SIZE`` blocks. Single-shot and multi-part uploads of the same
+bytes therefore hash identically, which is what deduplication keys on.
+"""
+import hashlib
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", str(4 * 1024 * 1024)))
+UPLOAD_PARALLELISM = int(os.getenv("UPLOAD_PARALLELISM", "4"))
+# Multi-part uploads: each part is a whole number of blocks (except the last part)
+UPLOAD_MAX_PART_BYTES = int(os.getenv("UPLOAD_MAX_PART_BYTES", str(4 * UPLOAD_BLOCK_SIZE)))
+UPLOAD_MAX_PARTS = 10000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Upload rejected; ``status_code`` is the HTTP status to answer with"""
+
+    status_code = 400
+
+
+class UploadTooLargeError(UploadError):
+    status_code = 413
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=UPLOAD_PARALLELISM, thread_name_prefix="blob-upload")
+    return _executor
+
+
+def block_id(part_number, block_index, attempt):
+    """Fixed-width block id (Azure requires all ids of a blob to have the same length).
+
+    ``attempt`` is unique per staging call, so re-sending a part never
+    overwrites blocks that an earlier, successful attempt already recorded.
+    """
+    return f"{part_number:05d}-{block_index:05d}-{attempt}"
+
+
+def content_hash(block_digests):
+    """Content hash of an upload from the hex SHA-256 digests of its blocks, in order"""
+    root = hashlib.sha256()
+    for digest in block_digests:
+        root.update(bytes.fromhex(digest))
+    return root.hexdigest()
+
+
+def read_block(stream, size):
+    """Read up to ``size`` bytes, looping over short reads; b"" at end of stream"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = stream.read(size - len(buffer))
+        if not chunk:
+            break
+        buffer += chunk
+    return bytes(buffer)
+
+
+def stage_stream(blob_client, stream, part_number=0, max_bytes=MAX_UPLOAD_BYTES, block_size=UPLOAD_BLOCK_SIZE):
+    """Stage ``stream`` as blocks of ``blob_client`` with bounded parallelism.
+
+    Returns ``(block_ids, block_digests, size)``. Raises UploadTooLargeError as
+    soon as more than ``max_bytes`` have been read; blocks already staged are
+    never committed and are discarded by the service.
+    """
+    executor = get_executor()
+    slots = threading.BoundedSemaphore(UPLOAD_PARALLELISM)
+    futures, block_ids, digests = [], [], []
+    size = 0
+    attempt = secrets.token_hex(4)
+
+    def stage(block, data):
+        try:
+            blob_client.stage_block(block, data, length=len(data))
+        finally:
+            slots.release()
+
+    index = 0
+    while True:
+        data = read_block(stream, block_size)
+        if not data:
+            break
+        size += len(data)
+        if size > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+        block = block_id(part_number, index, attempt)
+        block_ids.append(block)
+        digests.append(hashlib.sha256(data).hexdigest())
+        slots.acquire()
+        # Stop reading early if a block already failed to stage
+        for future in futures:
+            if future.done():
+                future.result()
+        futures.append(executor.submit(stage, block, data))
+        index += 1
+    for future in futures:
+        future.result()
+    return block_ids, digests, size
+
+
+def commit_blocks(blob_client, block_ids, content_type=None, metadata=None):
+    """Commit staged blocks, in order, as the blob's content"""
+    content_settings = None
+    if content_type:
+        from azure.storage.blob import ContentSettings
+        content_settings = ContentSettings(content_type=content_type)
+    blob_client.commit_block_list(block_ids, content_settings=content_settings, metadata=metadata)
+
+
+def stage_upload(blob_client, stream, max_bytes=MAX_UPLOAD_BYTES):
+    """Stage a whole upload without committing it. Returns ``(block_ids, size, content_hash)``."""
+    block_ids, digests, size = stage_stream(blob_client, stream, max_bytes=max_bytes)
+    return block_ids, size, content_hash(digests)
+
+
+def upload_stream(blob_client, stream, content_type=None, metadata=None, max_bytes=MAX_UPLOAD_BYTES):
+    """Stream a whole upload into ``blob_client``. Returns ``(size, content_hash)``."""
+    block_ids, size, digest = stage_upload(blob_client, stream, max_bytes)
+    commit_blocks(blob_client, block_ids, content_type, {**(metadata or {}), "content_hash": digest})
+    return size, digest
+
+
+def stage_part(blob_client, stream, part_number, expected_sha256=None):
+    """Stage one part of a multi-part upload. Returns ``{block_ids, block_digests, size, sha256}``.
+
+    ``expected_sha256`` (hex SHA-256 of the part) is checked when given.
+    """
+    if not 1 <= part_number <= UPLOAD_MAX_PARTS:
+        raise UploadError(f"Part number must be between 1 and {UPLOAD_MAX_PARTS}")
+    part_hash = hashlib.sha256()
+
+    class HashingStream:
+        def read(self, size):
+            chunk = stream.read(size)
+            part_hash.update(chunk)
+            return chunk
+
+    block_ids, digests, size = stage_stream(blob_client, HashingStream(), part_number,
+                                            max_bytes=UPLOAD_MAX_PART_BYTES)
+    if size == 0:
+        raise UploadError("Part is empty")
+    if expected_sha256 and expected_sha256.lower() != part_hash.hexdigest():
+        raise UploadError("Part content does not match the supplied SHA-256")
+    return {"block_ids": block_ids, "block_digests": digests, "size": size, "sha256": part_hash.hexdigest()}
+
+
+def collect_parts(parts, max_bytes=MAX_UPLOAD_BYTES):
+    """Validate the recorded parts of a multi-part upload (``{part_number: stage_part result}``).
+
+    Parts must be numbered 1..N without gaps and all but the last must be a
+    whole number of blocks, so the content hash matches a single-shot upload.
+    Returns ``(block_ids, size, content_hash)``.
+    """
+    numbers = sorted(int(n) for n in parts)
+    if not numbers or numbers != list(range(1, len(numbers) + 1)):
+        raise UploadError("Parts must be numbered from 1 without gaps")
+    block_ids, digests, size = [], [], 0
+    for number in numbers:
+        part = parts[str(number)] if str(number) in parts else parts[number]
+        if number != numbers[-1] and part["size"] % UPLOAD_BLOCK_SIZE:
+            raise UploadError(f"Part {number} must be a multiple of {UPLOAD_BLOCK_SIZE} bytes")
+        block_ids += part["block_ids"]
+        digests += part["block_digests"]
+        size += part["size"]
+    if size > max_bytes:
+        raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+    return block_ids, size, content_hash(digests)
+
+
+def complete_parts(blob_client, parts, content_type=None, metadata=None, max_bytes=MAX_UPLOAD_BYTES):
+    """Commit a multi-part upload from its recorded parts. Returns ``(size, content_hash)``."""
+    block_ids, size, digest = collect_parts(parts, max_bytes)
+    commit_blocks(blob_client, block_ids, content_type, {**(metadata or {}), "content_hash": digest})
+    return size, digest
@@ -0,0 +1,134 @@
+"""Bulk export and import of user data as NDJSON.
+
+Each line is one document: ``{"collection": "<name>", "document": {...}}``,
+encoded as MongoDB relaxed extended JSON so dates and ObjectIds round-trip.
+Exports read with batched cursors and imports write with unordered
+``insert_many`` batches, so memory stays constant whatever the data size.
+Documents keep their ``_id``; re-importing the same file skips documents
+that already exist, which makes imports safe to resume.
+
+Used by the ``/api/export`` and ``/api/import`` endpoints for one user, and
+from the command line for whole-database backfills and load-test seeding::
+
+    python bulk_data.py export --user-id <id> > user.ndjson
+    python bulk_data.py export --all > backup.ndjson
+    python bulk_data.py import backup.ndjson
+"""
+import argparse
+import json
+import os
+import sys
+
+# Collections holding user data, in export order
+USER_DATA_COLLECTIONS = ("users", "daily_logs", "motivations", "notifications",
+                         "relapse_support", "agent_memory", "conversation_summaries")
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+
+class BulkDataError(ValueError):
+    """An import line is malformed or not allowed"""
+
+
+def encode_line(collection, document):
+    """One NDJSON line for a document of ``collection``"""
+    from bson import json_util
+
+    return json_util.dumps({"collection": collection, "document": document},
+                           json_options=json_util.RELAXED_JSON_OPTIONS) + "\n"
+
+
+def export_lines(db, user_id=None, collections=USER_DATA_COLLECTIONS, batch_size=EXPORT_BATCH_SIZE):
+    """Yield NDJSON lines for every document of ``collections`` (only ``user_id``'s when given)"""
+    filters = {"user_id": user_id} if user_id else {}
+    for name in collections:
+        for document in db[name].find(filters).batch_size(batch_size):
+            yield encode_line(name, document)
+
+
+def parse_line(line, user_id=None, collections=USER_DATA_COLLECTIONS):
+    """Decode one NDJSON line into ``(collection, document)``"""
+    from bson import json_util
+
+    try:
+        record = json_util.loads(line)
+    except (ValueError, TypeError) as e:
+        raise BulkDataError(f"Invalid JSON: {e}")
+    if not isinstance(record, dict) or not isinstance(record.get("document"), dict):
+        raise BulkDataError("Each line must be an object with 'collection' and 'document'")
+    name = record.get("collection")
+    if name not in collections:
+        raise BulkDataError(f"Unknown collection: {name}")
+    document = record["document"]
+    if user_id and document.get("user_id") != user_id:
+        raise BulkDataError(f"Document in {name} does not belong to user {user_id}")
+    return name, document
+
+
+def import_lines(db, lines, user_id=None, collections=USER_DATA_COLLECTIONS, batch_size=IMPORT_BATCH_SIZE):
+    """Insert the documents of an NDJSON line iterable, batched per collection.
+
+    With ``user_id`` every document must belong to that user. Existing
+    documents (duplicate ``_id``) are skipped. Returns
+    ``{collection: {"inserted": n, "skipped": n}}``.
+    """
+    from pymongo.errors import BulkWriteError
+
+    batches = {name: [] for name in collections}
+    counts = {name: {"inserted": 0, "skipped": 0} for name in collections}
+
+    def flush(name):
+        batch = batches[name]
+        if not batch:
+            return
+        try:
+            counts[name]["inserted"] += len(db[name].insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in errors):
+                raise
+            counts[name]["inserted"] += e.details.get("nInserted", 0)
+            counts[name]["skipped"] += len(errors)
+        batches[name] = []
+
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            name, document = parse_line(line, user_id, collections)
+        except BulkDataError as e:
+            raise BulkDataError(f"Line {number}: {e}")
+        batches[name].append(document)
+        if len(batches[name]) >= batch_size:
+            flush(name)
+    for name in collections:
+        flush(name)
+    return {name: count for name, count in counts.items() if count["inserted"] or count["skipped"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import user data as NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write NDJSON to stdout")
+    target = export_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", help="Export one user's data")
+    target.add_argument("--all", action="store_true", help="Export the whole database")
+    import_parser = commands.add_parser("import", help="Read NDJSON from a file or stdin")
+    import_parser.add_argument("path", nargs="?", default="-", help="NDJSON file ('-' for stdin)")
+    import_parser.add_argument("--user-id", help="Only accept documents of this user")
+    for command_parser in (export_parser, import_parser):
+        command_parser.add_argument("--collections", default=",".join(USER_DATA_COLLECTIONS),
+                                    help="Comma-separated collections (default: all user data)")
+    args = parser.parse_args()
+    selected = tuple(name for name in args.collections.split(",") if name)
+
+    from app import get_db
+    if args.command == "export":
+        sys.stdout.writelines(export_lines(get_db(), args.user_id, selected))
+    else:
+        source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+        with source:
+            print(json.dumps(import_lines(get_db(), source, args.user_id, selected)), file=sys.stderr)
@@ -0,0 +1,516 @@
+"""Record/replay cassettes for model (HTTP) and MongoDB calls.
+
+A cassette is a file of request/response interactions (gzip-compressed JSON
+when its name ends in ``.gz``), written in MongoDB extended JSON so dates and
+ObjectIds round-trip. In ``record`` mode calls go to the real services and
+every interaction is captured; in ``replay`` mode they are answered from the
+cassette and nothing connects out, so ``app.py`` and the LangGraph workflow
+run without Azure OpenAI or MongoDB.
+
+- Model calls are captured at the HTTP transport: ``http_client()`` returns
+  the ``httpx.Client`` that the router's ``AzureOpenAI`` clients and the
+  workflow's ``AzureChatOpenAI`` models use while a cassette is installed.
+  Responses are stored as body chunks with their arrival offsets, so
+  streamed (SSE) responses replay chunk by chunk with the recorded pacing.
+  Request headers (and with them the API keys) are never stored.
+- MongoDB calls are captured by ``CassetteDatabase``, installed with
+  ``database.set_db``: every collection method in
+  ``database.ROUND_TRIP_METHODS`` is stored with its arguments and its result
+  (cursors are read to the end, write results keep their counts and ids).
+  Errors, such as duplicate keys or timeouts, are stored and raised again.
+  Transactions are not recorded: the proxy's client hands out no-op sessions,
+  so with ``MONGO_TRANSACTIONS=true`` a unit of work's writes are recorded
+  (and, in record mode, applied) one by one outside a transaction.
+
+Replay looks an interaction up by its request (method, path and body; or
+collection, method and arguments); identical requests are answered in
+recorded order, cycling once they run out. A request that is not in the
+cassette gets the next interaction of the same endpoint or collection
+method, so a benchmark with a randomized workload can replay a production
+recording; with ``strict`` it raises ``CassetteMissError`` instead.
+
+``time_scale`` multiplies recorded latencies on replay: 0 answers at once,
+1 reproduces the recorded timings (an answer slower than the caller's read
+timeout raises ``httpx.ReadTimeout`` like a real one would).
+
+``CASSETTE_MODE`` (``record`` or ``replay``), ``CASSETTE_PATH`` and
+``CASSETTE_TIME_SCALE`` install a cassette for the app (``create_app``) or
+``langgraph_agents/test_workflow.py``. Record in a single process; the
+cassette is written when the process exits.
+"""
+import atexit
+import base64
+import copy
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import types
+
+import httpx
+
+import database
+from database import ROUND_TRIP_METHODS, set_db
+from tracing import metrics
+
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "cassette.json.gz")
+CASSETTE_TIME_SCALE = float(os.getenv("CASSETTE_TIME_SCALE", "0"))
+CASSETTE_STRICT = os.getenv("CASSETTE_STRICT", "false").lower() == "true"
+
+RECORD = "record"
+REPLAY = "replay"
+
+HTTP = "http"
+MONGO = "mongo"
+
+# Response headers that are not stored
+SKIPPED_HEADERS = frozenset({"set-cookie", "date", "apim-request-id", "x-request-id", "x-ms-client-request-id"})
+
+# Cursor methods that return the cursor, recorded as part of the query
+CURSOR_METHODS = frozenset({"sort", "limit", "skip", "batch_size", "max_time_ms", "hint", "collation", "comment"})
+
+# Fields of pymongo write results kept in a cassette
+RESULT_FIELDS = ("inserted_id", "inserted_ids", "matched_count", "modified_count", "upserted_id", "deleted_count",
+                 "inserted_count", "upserted_count", "upserted_ids")
+
+
+class CassetteMissError(LookupError):
+    """A replayed request has no recorded interaction (``strict`` cassettes only)"""
+
+
+def _dumps(value, **kwargs):
+    from bson import json_util
+
+    def default(obj):
+        try:
+            return json_util.default(obj, json_util.RELAXED_JSON_OPTIONS)
+        except TypeError:
+            return repr(obj)  # e.g. bulk_write operations
+
+    return json.dumps(value, default=default, **kwargs)
+
+
+def _loads(text):
+    from bson import json_util
+
+    return json_util.loads(text)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _error_record(error):
+    record = {"type": type(error).__name__, "module": type(error).__module__, "message": str(error)}
+    if getattr(error, "code", None) is not None:
+        record["code"] = error.code
+    return record
+
+
+def _raise(record):
+    """Raise a stored error as its own class when it can be rebuilt, else as ``RuntimeError``"""
+    try:
+        cls = getattr(importlib.import_module(record["module"]), record["type"])
+        error = cls(record["message"], record["code"]) if "code" in record else cls(record["message"])
+    except Exception:
+        error = RuntimeError(f"{record['type']}: {record['message']}")
+    raise error
+
+
+class Cassette:
+    """Interactions recorded or replayed by one process"""
+
+    def __init__(self, path, mode=REPLAY, time_scale=CASSETTE_TIME_SCALE, strict=CASSETTE_STRICT):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected {RECORD} or {REPLAY}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self.strict = strict
+        self.interactions = []
+        self._exact = {}     # (kind, key, digest) -> [interactions, next position]
+        self._similar = {}   # (kind, key) -> [interactions, next position]
+        self._lock = threading.Lock()
+        if mode == REPLAY:
+            self.load()
+
+    @property
+    def recording(self):
+        return self.mode == RECORD
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if self.path.endswith(".gz"):
+            data = gzip.decompress(data)
+        self.interactions = _loads(data.decode("utf-8"))["interactions"]
+        for interaction in self.interactions:
+            exact = (interaction["kind"], interaction["key"], interaction["digest"])
+            self._exact.setdefault(exact, [[], 0])[0].append(interaction)
+            self._similar.setdefault((interaction["kind"], interaction["key"]), [[], 0])[0].append(interaction)
+
+    def save(self):
+        with self._lock:
+            text = _dumps({"version": 1, "interactions": self.interactions}, separators=(",", ":"))
+        data = text.encode("utf-8")
+        if self.path.endswith(".gz"):
+            data = gzip.compress(data, mtime=0)
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def add(self, interaction):
+        with self._lock:
+            self.interactions.append(interaction)
+        metrics.increment("cassette_interactions_total", {"kind": interaction["kind"], "outcome": "recorded"})
+
+    def find(self, kind, key, digest):
+        """The interaction answering a request (see the module docstring for the matching rules)"""
+        with self._lock:
+            matches = self._exact.get((kind, key, digest))
+            if matches is not None:
+                outcome = "replayed" if matches[1] < len(matches[0]) else "repeated"
+            elif not self.strict and (kind, key) in self._similar:
+                outcome, matches = "similar", self._similar[(kind, key)]
+            else:
+                outcome = "missed"
+            if matches is not None:
+                interaction = matches[0][matches[1] % len(matches[0])]
+                matches[1] += 1
+        metrics.increment("cassette_interactions_total", {"kind": kind, "outcome": outcome})
+        if matches is None:
+            raise CassetteMissError(f"No recorded {kind} interaction for {key}")
+        return interaction
+
+    def wait(self, seconds):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def wait_until(self, started, offset):
+        """Sleep until ``offset`` recorded seconds (scaled) have passed since ``started``"""
+        if self.time_scale > 0:
+            delay = offset * self.time_scale - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+
+# Model calls: an httpx transport
+
+def _http_key(request):
+    # Deployment names differ between environments; the endpoint is what matters
+    return request.method + " " + re.sub(r"/deployments/[^/]+", "/deployments/*", request.url.path)
+
+
+def _http_digest(request):
+    body = request.read()
+    try:
+        payload = json.loads(body)
+        if isinstance(payload, dict):
+            payload.pop("model", None)  # the deployment name again
+        text = json.dumps(payload, sort_keys=True)
+    except ValueError:
+        text = body.decode("utf-8", "replace")
+    return _digest(_http_key(request) + "\0" + text)
+
+
+def _encode_chunk(chunk):
+    try:
+        return chunk.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(chunk).decode("ascii")}
+
+
+def _decode_chunk(chunk):
+    return base64.b64decode(chunk["base64"]) if isinstance(chunk, dict) else chunk.encode("utf-8")
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """Passes a response body through, recording each chunk's offset from the request start"""
+
+    def __init__(self, cassette, interaction, stream, started):
+        self._cassette = cassette
+        self._interaction = interaction
+        self._stream = stream
+        self._started = started
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._interaction["chunks"].append([round(time.perf_counter() - self._started, 4), _encode_chunk(chunk)])
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+        self._cassette.add(self._interaction)
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """Yields recorded chunks, paced by their offsets times the cassette's ``time_scale``"""
+
+    def __init__(self, cassette, chunks, started):
+        self._cassette = cassette
+        self._chunks = chunks
+        self._started = started
+
+    def __iter__(self):
+        for offset, chunk in self._chunks:
+            self._cassette.wait_until(self._started, offset)
+            yield _decode_chunk(chunk)
+
+    def close(self):
+        pass
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """httpx transport recording to or replaying from a cassette"""
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self._inner = httpx.HTTPTransport() if cassette.recording else None
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        key, digest = _http_key(request), _http_digest(request)
+        if self.cassette.recording:
+            interaction = {"kind": HTTP, "key": key, "digest": digest, "chunks": []}
+            try:
+                response = self._inner.handle_request(request)
+            except httpx.HTTPError as e:
+                interaction.update(latency_s=round(time.perf_counter() - started, 4), error=_error_record(e))
+                self.cassette.add(interaction)
+                raise
+            interaction.update(
+                status=response.status_code,
+                headers=[[name, value] for name, value in response.headers.items()
+                         if name.lower() not in SKIPPED_HEADERS],
+                latency_s=round(time.perf_counter() - started, 4)
+            )
+            return httpx.Response(response.status_code, headers=response.headers,
+                                  stream=_RecordingStream(self.cassette, interaction, response.stream, started),
+                                  extensions=response.extensions)
+
+        interaction = self.cassette.find(HTTP, key, digest)
+        timeout = (request.extensions.get("timeout") or {}).get("read")
+        first = interaction["chunks"][0][0] if interaction.get("chunks") else interaction["latency_s"]
+        if timeout is not None and first * self.cassette.time_scale > timeout:
+            time.sleep(timeout)
+            raise httpx.ReadTimeout("Replayed response is slower than the read timeout", request=request)
+        if "error" in interaction:
+            self.cassette.wait(interaction["latency_s"])
+            _raise(interaction["error"])
+        return httpx.Response(interaction["status"], headers=interaction["headers"],
+                              stream=_ReplayStream(self.cassette, interaction["chunks"], started))
+
+    def close(self):
+        if self._inner is not None:
+            self._inner.close()
+
+
+# MongoDB calls: a database proxy
+
+def _mongo_result(result):
+    if any(hasattr(result, field) for field in RESULT_FIELDS):
+        fields = {}
+        for field in RESULT_FIELDS:
+            try:
+                fields[field] = getattr(result, field)
+            except Exception:
+                continue  # e.g. counts of unacknowledged writes
+        return {"write_result": fields}
+    return {"value": result}
+
+
+def _replay_result(stored):
+    if "write_result" in stored:
+        return types.SimpleNamespace(acknowledged=True, **copy.deepcopy(stored["write_result"]))
+    return copy.deepcopy(stored["value"])
+
+
+class CassetteCursor:
+    """``find`` / ``aggregate`` result: records the cursor calls and runs the query when iterated"""
+
+    def __init__(self, collection, method, args, kwargs):
+        self._collection = collection
+        self._method = method
+        self._args = args
+        self._kwargs = kwargs
+        self._chain = []
+
+    def __getattr__(self, attr):
+        if attr not in CURSOR_METHODS:
+            raise AttributeError(attr)
+
+        def chained(*args, **kwargs):
+            self._chain.append((attr, args, kwargs))
+            return self
+        return chained
+
+    def __iter__(self):
+        def run():
+            cursor = getattr(self._collection.source(), self._method)(*self._args, **self._kwargs)
+            for attr, args, kwargs in self._chain:
+                cursor = getattr(cursor, attr)(*args, **kwargs)
+            return list(cursor)
+        return iter(self._collection._call(self._method, (self._args, self._kwargs, self._chain), run))
+
+
+class CassetteCollection:
+    def __init__(self, database, name):
+        self._database = database
+        self.name = name
+
+    def source(self):
+        return self._database.source()[self.name]
+
+    def _call(self, method, request, run):
+        cassette = self._database.cassette
+        key = f"{self.name}.{method}"
+        digest = _digest(_dumps(request, sort_keys=True))
+        if cassette.recording:
+            started = time.perf_counter()
+            interaction = {"kind": MONGO, "key": key, "digest": digest}
+            try:
+                result = run()
+            except Exception as e:
+                interaction.update(latency_s=round(time.perf_counter() - started, 4), error=_error_record(e))
+                cassette.add(interaction)
+                raise
+            interaction.update(latency_s=round(time.perf_counter() - started, 4), result=_mongo_result(result))
+            cassette.add(interaction)
+            return result
+        interaction = cassette.find(MONGO, key, digest)
+        cassette.wait(interaction["latency_s"])
+        if "error" in interaction:
+            _raise(interaction["error"])
+        return _replay_result(interaction["result"])
+
+    def __getattr__(self, attr):
+        if attr not in ROUND_TRIP_METHODS:
+            raise AttributeError(attr)
+        if attr in ("find", "aggregate"):
+            return lambda *args, **kwargs: CassetteCursor(self, attr, args, kwargs)
+
+        def call(*args, **kwargs):
+            # Serialized before the call: inserts add an _id to their documents
+            request = json.loads(_dumps((args, kwargs), sort_keys=True))
+            return self._call(attr, request, lambda: getattr(self.source(), attr)(*args, **kwargs))
+        return call
+
+
+class CassetteSession:
+    """No-op client session: the callback of ``with_transaction`` runs without a transaction"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def with_transaction(self, callback, *args, **kwargs):
+        return callback(None)
+
+    def end_session(self):
+        pass
+
+
+class CassetteClient:
+    """The ``client`` of a ``CassetteDatabase``, for code that starts sessions"""
+
+    def start_session(self, *args, **kwargs):
+        return CassetteSession()
+
+
+class CassetteDatabase:
+    """Stand-in for a pymongo ``Database`` recording to or replaying from a cassette"""
+
+    def __init__(self, cassette, source=None):
+        self.cassette = cassette
+        self._source = source
+
+    def source(self):
+        """The real database, connected on first use (record mode only)"""
+        if self._source is None:
+            self._source = database.get_client()[database.MONGODB_DATABASE]
+        return self._source
+
+    def __getitem__(self, name):
+        return CassetteCollection(self, name)
+
+    @property
+    def name(self):
+        return database.MONGODB_DATABASE
+
+    @property
+    def client(self):
+        return CassetteClient()
+
+    def _call(self, method, args, kwargs):
+        # Database-level calls are stored under the "$cmd" pseudo-collection
+        return CassetteCollection(self, "$cmd")._call(
+            method, json.loads(_dumps((args, kwargs), sort_keys=True)),
+            lambda: getattr(self.source(), method)(*args, **kwargs))
+
+    def command(self, *args, **kwargs):
+        return self._call("command", args, kwargs)
+
+    def list_collection_names(self, *args, **kwargs):
+        return self._call("list_collection_names", args, kwargs)
+
+
+# Installation
+
+_cassette = None
+_http_client = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _http_client, _lock
+    _http_client = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_cassette():
+    return _cassette
+
+
+def install(cassette, mongo=True):
+    """Route model calls (and MongoDB calls, with ``mongo``) of this process through ``cassette``.
+
+    Model clients created before this call keep their own transport.
+    """
+    global _cassette, _http_client
+    with _lock:
+        _cassette = cassette
+        _http_client = None
+    if mongo:
+        db = CassetteDatabase(cassette)
+        db._source = set_db(db)
+    if cassette.recording:
+        atexit.register(cassette.save)
+    return cassette
+
+
+def install_from_env():
+    """Install the cassette configured by ``CASSETTE_MODE`` / ``CASSETTE_PATH``, if any"""
+    if CASSETTE_MODE and _cassette is None:
+        install(Cassette(CASSETTE_PATH, CASSETTE_MODE))
+    return _cassette
+
+
+def http_client():
+    """``httpx.Client`` for model SDK clients: the cassette's, or None (the SDK default) without one"""
+    global _http_client
+    if _cassette is None:
+        return None
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                _http_client = httpx.Client(transport=CassetteTransport(_cassette), follow_redirects=True)
+    return _http_client
@@ -0,0 +1,144 @@
+"""Engines answering ``/api/chat``.
+
+- ``flat``: one chat completion over the user's history and document sources
+- ``graph``: the LangGraph trigger workflow (``langgraph_agents/workflow.py``):
+  drinking classification, trigger identification and the matching coping
+  agent. Messages the workflow does not classify as drinking get the flat reply,
+  and so do messages whose run fails or outlasts ``WORKFLOW_TIMEOUT_S``.
+
+``CHAT_ENGINE`` sets the default for a deployment; a request picks one with
+``engine`` in its body. Graph runs are scheduled with ``ainvoke`` on one event
+loop per process, so concurrent requests share it, using compiled graphs from
+the workflow's warm pool (built at startup with ``WORKFLOW_PREWARM=true``).
+
+Every answer is timed as a ``chat.engine`` span with the engine as target;
+``engine_stats()`` (``GET /api/chat/engines``) puts the engines side by side.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from tracing import metrics
+
+FLAT_ENGINE = "flat"
+GRAPH_ENGINE = "graph"
+ENGINES = (FLAT_ENGINE, GRAPH_ENGINE)
+
+CHAT_ENGINE = os.getenv("CHAT_ENGINE", FLAT_ENGINE)
+WORKFLOW_TIMEOUT_S = float(os.getenv("WORKFLOW_TIMEOUT_S", "60"))
+WORKFLOW_MAX_CONCURRENCY = int(os.getenv("WORKFLOW_MAX_CONCURRENCY", "32"))
+WORKFLOW_PREWARM = os.getenv("WORKFLOW_PREWARM", "false").lower() == "true"
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _loop, _loop_lock
+    _loop = None
+    _loop_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_event_loop():
+    """Event loop running graph calls for this process, started on first use"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                # Sync graph nodes run on the loop's default executor
+                loop.set_default_executor(ThreadPoolExecutor(
+                    max_workers=WORKFLOW_MAX_CONCURRENCY, thread_name_prefix="graph-node"))
+                threading.Thread(target=loop.run_forever, name="chat-engine-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_coroutine(coro, timeout):
+    """Run ``coro`` on the engine loop in the caller's context (spans, round-trip counts) and wait for it"""
+    loop = get_event_loop()
+    done = Future()
+    started = {}
+
+    def copy_result(task):
+        if task.cancelled():
+            done.cancel()
+        elif task.exception() is not None:
+            done.set_exception(task.exception())
+        else:
+            done.set_result(task.result())
+
+    def start():
+        started["task"] = loop.create_task(coro)
+        started["task"].add_done_callback(copy_result)
+
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    try:
+        return done.result(timeout)
+    except FutureTimeoutError:  # not the builtin TimeoutError before Python 3.11
+        loop.call_soon_threadsafe(lambda: started["task"].cancel() if "task" in started else None)
+        raise
+
+
+def to_messages(history, user_message):
+    """LangChain messages for a prompt history of ``{"role", "content"}`` dicts and the new user message"""
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    message_types = {"assistant": AIMessage, "system": SystemMessage, "user": HumanMessage}
+    messages = [message_types[item["role"]](content=item["content"]) for item in history]
+    messages.append(HumanMessage(content=user_message))
+    return messages
+
+
+def graph_response(user_id, history, user_message):
+    """The coping agent's reply from the trigger workflow, or None if it gave none (not drinking)"""
+    from langchain_core.messages import AIMessage
+    from langgraph_agents.workflow import arun_workflow
+
+    messages = to_messages(history, user_message)
+    result = run_coroutine(arun_workflow(list(messages), user_id), WORKFLOW_TIMEOUT_S)
+    reply = result["messages"][-1] if len(result["messages"]) > len(messages) else None
+    if not isinstance(reply, AIMessage):
+        metrics.increment("chat_graph_replies_total", {"outcome": "flat"})
+        return None
+    metrics.increment("chat_graph_replies_total", {"outcome": "coping"})
+    return reply.content
+
+
+def prewarm():
+    """Build the workflow's warm pool on a background thread"""
+    def warm():
+        from langgraph_agents.workflow import warm_workflow_pool
+        warm_workflow_pool()
+        get_event_loop()
+
+    threading.Thread(target=warm, name="chat-engine-prewarm", daemon=True).start()
+
+
+def engine_stats():
+    """Request count, error count and latency percentiles per engine, and how graph replies were made"""
+    summary = metrics.summary()
+    engines = {engine: {"requests": 0, "errors": 0} for engine in ENGINES}
+    for row in summary["histograms"]:
+        if row["metric"] == "span_duration_seconds" and row["labels"].get("span") == "chat.engine":
+            engines.setdefault(row["labels"]["target"], {"errors": 0}).update({
+                "requests": row["count"],
+                "mean_s": row["mean"],
+                "p50_s": row["p50"],
+                "p95_s": row["p95"],
+                "p99_s": row["p99"],
+            })
+    graph_replies = {}
+    for counter in summary["counters"]:
+        if counter["metric"] == "span_errors_total" and counter["labels"].get("span") == "chat.engine":
+            engines.setdefault(counter["labels"]["target"], {"requests": 0})["errors"] = counter["value"]
+        elif counter["metric"] == "chat_graph_replies_total":
+            graph_replies[counter["labels"]["outcome"]] = counter["value"]
+    engines[GRAPH_ENGINE]["replies"] = graph_replies
+    return engines
@@ -0,0 +1,367 @@
+"""Catalog of coping resources (strategies, exercises, articles and helplines).
+
+Daily logs get a ``coping_suggestion`` and relapse-support entries a
+``resource_shared`` from here, without another model call:
+
+- ``extract_coping_suggestion`` takes the most actionable sentence of the
+  agent's reply ("Try ...", "Consider ...", a bullet point), or the best
+  catalog entry's suggestion when the reply has none
+- ``extract_resource`` picks the catalog entry that best fits the relapse
+  trigger and the agent's reply
+
+Entries are tagged with trigger types (the values of the workflow's
+``TriggerType``) and moods. ``ResourceCatalog`` keeps an inverted index from
+words to entries, so matching is a few dictionary lookups per word of input.
+
+Helplines and articles that only apply in one country list it in ``regions``;
+the catalog keeps the entries of ``COPING_RESOURCES_REGION`` (``us`` or
+``uk``) and the entries without regions. ``COPING_RESOURCES_PATH`` points to
+a JSON list of entries that replaces the built-in catalog.
+"""
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+
+COPING_RESOURCES_PATH = os.getenv("COPING_RESOURCES_PATH")
+COPING_RESOURCES_REGION = os.getenv("COPING_RESOURCES_REGION", "us").lower()
+
+KINDS = ("strategy", "exercise", "article", "helpline")
+
+# Words that point to each trigger type (single words, matched after stemming)
+TRIGGER_KEYWORDS = {
+    "stress": ["stress", "stressed", "work", "job", "deadline", "boss", "pressure", "overwhelmed", "busy", "exam",
+               "money", "bills", "tense", "nerves"],
+    "social_pressure": ["friends", "party", "pub", "bar", "peer", "pushed", "offered", "round", "colleagues",
+                        "team", "awkward", "refuse", "everyone"],
+    "boredom": ["bored", "boredom", "nothing", "weekend", "idle", "restless", "pass", "time"],
+    "negative_emotions": ["sad", "depressed", "angry", "upset", "anxious", "anxiety", "grief", "hurt", "numb",
+                          "guilty", "shame", "argument", "fight", "news", "cry"],
+    "fatigue": ["tired", "exhausted", "sleep", "insomnia", "shift", "unwind", "energy", "drained", "wired"],
+    "celebrations": ["birthday", "wedding", "celebrate", "celebration", "holiday", "christmas", "promotion",
+                     "anniversary", "toast", "festival"],
+    "loneliness": ["lonely", "alone", "isolated", "nobody", "single", "breakup", "miss", "empty"],
+    "habitual_patterns": ["habit", "routine", "usual", "always", "automatic", "evening", "dinner", "nightly",
+                          "home", "craving", "crave"],
+}
+
+# Mood words grouped into the moods entries are tagged with
+MOOD_KEYWORDS = {
+    "anxious": ["anxious", "stressed", "nervous", "worried", "tense", "panicky", "overwhelmed"],
+    "low": ["sad", "down", "low", "depressed", "lonely", "empty", "hopeless", "bad"],
+    "angry": ["angry", "frustrated", "irritated", "annoyed", "mad"],
+    "tired": ["tired", "exhausted", "drained", "sleepy"],
+    "restless": ["bored", "restless", "fidgety", "meh"],
+    "good": ["good", "great", "happy", "fine", "ok", "okay", "proud", "calm", "excited", "relaxed"],
+}
+
+RESOURCES = [
+    {"id": "box-breathing", "kind": "exercise", "title": "Box breathing",
+     "suggestion": "Try box breathing: breathe in for 4 counts, hold for 4, breathe out for 4 and hold for 4, for two minutes.",
+     "triggers": ["stress", "negative_emotions"], "moods": ["anxious", "angry"],
+     "keywords": ["breathing", "breath", "calm", "panic", "relax"]},
+    {"id": "progressive-relaxation", "kind": "exercise", "title": "Progressive muscle relaxation",
+     "suggestion": "Tense and release each muscle group from your feet to your face, holding each for five seconds.",
+     "triggers": ["stress", "fatigue"], "moods": ["anxious", "tired"],
+     "keywords": ["muscle", "relaxation", "tension", "body", "unwind"]},
+    {"id": "stress-walk", "kind": "strategy", "title": "A short walk after work",
+     "suggestion": "Go for a ten-minute walk straight after work to put some distance between the day and the evening.",
+     "triggers": ["stress", "habitual_patterns"], "moods": ["anxious", "restless"],
+     "keywords": ["walk", "outside", "fresh", "air", "commute"]},
+    {"id": "refusal-script", "kind": "strategy", "title": "Have your 'no thanks' ready",
+     "suggestion": "Decide on a short, friendly refusal before you go out, such as \"No thanks, I'm driving\", and repeat it if asked again.",
+     "triggers": ["social_pressure", "celebrations"], "moods": ["anxious", "good"],
+     "keywords": ["refuse", "refusal", "say", "no", "assertive", "pressure", "offer"]},
+    {"id": "alcohol-free-order", "kind": "strategy", "title": "Order your drink first",
+     "suggestion": "Order an alcohol-free drink as soon as you arrive so you always have a glass in hand.",
+     "triggers": ["social_pressure", "celebrations"], "moods": ["good", "anxious"],
+     "keywords": ["order", "mocktail", "soda", "non-alcoholic", "glass", "round"]},
+    {"id": "sober-social-plans", "kind": "strategy", "title": "Suggest plans that aren't about drinking",
+     "suggestion": "Suggest meeting friends for a walk, a film or a coffee instead of the pub.",
+     "triggers": ["social_pressure", "loneliness"], "moods": ["good", "low"],
+     "keywords": ["friends", "coffee", "cinema", "film", "meet", "activity"]},
+    {"id": "boredom-list", "kind": "strategy", "title": "Keep a list of things to do",
+     "suggestion": "Write down five things you enjoy that take under an hour and pick one when boredom hits.",
+     "triggers": ["boredom", "habitual_patterns"], "moods": ["restless"],
+     "keywords": ["list", "hobby", "activity", "enjoy", "plan"]},
+    {"id": "new-hobby", "kind": "strategy", "title": "Start a hands-on hobby",
+     "suggestion": "Pick up a hobby that keeps your hands busy, like cooking, drawing or a puzzle, for the hours you used to drink.",
+     "triggers": ["boredom", "loneliness"], "moods": ["restless", "low"],
+     "keywords": ["hobby", "cooking", "drawing", "puzzle", "music", "learn", "class"]},
+    {"id": "urge-surfing", "kind": "exercise", "title": "Urge surfing",
+     "suggestion": "When a craving comes, notice it without acting on it; cravings peak and pass within about 20 to 30 minutes.",
+     "triggers": ["habitual_patterns", "stress", "negative_emotions"], "moods": ["anxious", "restless"],
+     "keywords": ["craving", "urge", "wave", "notice", "pass", "mindful"]},
+    {"id": "journaling", "kind": "exercise", "title": "Write it down",
+     "suggestion": "Spend ten minutes writing down what you're feeling and what set it off before deciding whether to drink.",
+     "triggers": ["negative_emotions", "loneliness"], "moods": ["low", "angry", "anxious"],
+     "keywords": ["journal", "journaling", "write", "feelings", "emotions", "diary"]},
+    {"id": "name-the-feeling", "kind": "exercise", "title": "Name the feeling",
+     "suggestion": "Name the feeling out loud (\"I'm angry\", \"I'm sad\") and rate it from 1 to 10; naming an emotion takes some of its intensity away.",
+     "triggers": ["negative_emotions"], "moods": ["low", "angry"],
+     "keywords": ["feeling", "emotion", "name", "accept", "awareness"]},
+    {"id": "sleep-hygiene", "kind": "strategy", "title": "Wind down without alcohol",
+     "suggestion": "Set a regular bedtime with a wind-down routine (a warm shower, dim lights, no screens) instead of a nightcap.",
+     "triggers": ["fatigue", "habitual_patterns"], "moods": ["tired"],
+     "keywords": ["sleep", "bedtime", "nightcap", "rest", "routine", "insomnia"]},
+    {"id": "energy-snack", "kind": "strategy", "title": "Eat and hydrate after a long shift",
+     "suggestion": "Have a proper meal and a large glass of water when you get in; hunger and thirst are easily mistaken for a craving.",
+     "triggers": ["fatigue", "stress"], "moods": ["tired"],
+     "keywords": ["eat", "meal", "water", "hydrate", "hungry", "snack", "energy"]},
+    {"id": "celebration-plan", "kind": "strategy", "title": "Plan the celebration ahead",
+     "suggestion": "Before the event, decide how long you'll stay, what you'll drink and who you can text if it gets hard.",
+     "triggers": ["celebrations", "social_pressure"], "moods": ["good", "anxious"],
+     "keywords": ["plan", "event", "party", "leave", "boundary", "boundaries"]},
+    {"id": "mocktail-recipes", "kind": "article", "title": "Alcohol-free drink ideas",
+     "suggestion": "Bring an alcohol-free drink you actually enjoy, such as a sparkling water with lime or an alcohol-free beer.",
+     "url": "https://www.nhs.uk/live-well/alcohol-advice/tips-on-cutting-down-alcohol/", "regions": ["uk"],
+     "triggers": ["celebrations", "habitual_patterns"], "moods": ["good"],
+     "keywords": ["mocktail", "recipe", "alcohol-free", "beer", "sparkling", "drink"]},
+    {"id": "reach-out", "kind": "strategy", "title": "Reach out to someone",
+     "suggestion": "Call or message one person you trust tonight, even just to say hello.",
+     "triggers": ["loneliness", "negative_emotions"], "moods": ["low"],
+     "keywords": ["call", "text", "message", "friend", "family", "talk", "connect"]},
+    {"id": "support-group", "kind": "article", "title": "Find a support group",
+     "suggestion": "Look for a local or online support group; meeting people working on the same goal makes evenings less lonely.",
+     "url": "https://www.rethinkingdrinking.niaaa.nih.gov/", "regions": ["us"],
+     "triggers": ["loneliness", "habitual_patterns"], "moods": ["low"],
+     "keywords": ["group", "meeting", "community", "online", "support", "volunteer"]},
+    {"id": "support-group-uk", "kind": "article", "title": "Find alcohol support near you (NHS)",
+     "suggestion": "Look for a local or online support group; meeting people working on the same goal makes evenings less lonely.",
+     "url": "https://www.nhs.uk/live-well/alcohol-advice/alcohol-support/", "regions": ["uk"],
+     "triggers": ["loneliness", "habitual_patterns"], "moods": ["low"],
+     "keywords": ["group", "meeting", "community", "online", "support", "volunteer"]},
+    {"id": "change-the-cue", "kind": "strategy", "title": "Change the cue",
+     "suggestion": "Change the first thing you do when you get home (make tea, change clothes, go for a walk) to break the drinking routine.",
+     "triggers": ["habitual_patterns"], "moods": ["restless", "tired"],
+     "keywords": ["cue", "routine", "habit", "home", "replace", "tea", "automatic"]},
+    {"id": "alcohol-free-home", "kind": "strategy", "title": "Keep alcohol out of the house",
+     "suggestion": "Don't keep alcohol at home for now, so a drink takes effort instead of a reach into the fridge.",
+     "triggers": ["habitual_patterns", "boredom"], "moods": ["restless"],
+     "keywords": ["home", "fridge", "buy", "shop", "house", "stock"]},
+    {"id": "rethinking-drinking", "kind": "article", "title": "Rethinking Drinking (NIAAA)",
+     "suggestion": "Read about tools for cutting down and tracking your drinking on the NIAAA Rethinking Drinking site.",
+     "url": "https://www.rethinkingdrinking.niaaa.nih.gov/", "regions": ["us"],
+     "triggers": ["stress", "habitual_patterns", "unknown"], "moods": ["good", "restless"],
+     "keywords": ["cut", "down", "track", "tips", "goal", "reduce"]},
+    {"id": "samhsa-helpline", "kind": "helpline", "title": "SAMHSA National Helpline (1-800-662-4357)",
+     "suggestion": "If the urge feels too strong, call the free, confidential SAMHSA helpline at 1-800-662-4357, any time of day.",
+     "url": "https://www.samhsa.gov/find-help/national-helpline", "regions": ["us"],
+     "triggers": ["negative_emotions", "loneliness", "stress", "unknown"], "moods": ["low", "anxious"],
+     "keywords": ["relapse", "help", "urge", "crisis", "helpline", "slip", "strong"]},
+    {"id": "drinkline", "kind": "helpline", "title": "Drinkline (0300 123 1110)",
+     "suggestion": "If the urge feels too strong, call Drinkline, the free, confidential national alcohol helpline, on 0300 123 1110.",
+     "url": "https://www.nhs.uk/live-well/alcohol-advice/alcohol-support/", "regions": ["uk"],
+     "triggers": ["negative_emotions", "loneliness", "stress", "unknown"], "moods": ["low", "anxious"],
+     "keywords": ["relapse", "help", "urge", "crisis", "helpline", "slip", "strong"]},
+]
+
+# Weights of the signals combined in ResourceCatalog.match
+TRIGGER_WEIGHT = 3.0
+MOOD_WEIGHT = 2.0
+KEYWORD_WEIGHT = 1.5
+TITLE_WEIGHT = 0.5
+
+_WORD = re.compile(r"[a-z][a-z'-]*")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n+")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+_MARKUP = re.compile(r"[*_`#]+")
+# Openings of actionable advice in an agent reply
+_ADVICE = re.compile(
+    r"^(?:try|consider|you (?:could|might|can)|why not|how about|instead|take|go|call|reach out|"
+    r"write|practice|practise|set|plan|make|keep|find|start|pick|order|remember|swap|replace|"
+    r"have|drink a|eat|breathe|spend|schedule|join|ask|tell|decide|notice)\b")
+_ADVICE_ANYWHERE = re.compile(r"\b(?:try|consider|suggest|recommend|instead of|helpful to|could help)\b")
+
+MIN_SUGGESTION_CHARS = 20
+MAX_SUGGESTION_CHARS = 250
+
+
+def stem(word):
+    """Crude suffix stripping, enough to match 'stressed' with 'stress' and 'feelings' with 'feeling'"""
+    if len(word) > 4:
+        if word.endswith(("sses", "shes", "ches", "xes")):
+            word = word[:-2]
+        elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+            word = word[:-1]
+    for suffix in ("ing", "ed"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text):
+    return [stem(word) for word in _WORD.findall((text or "").lower())]
+
+
+def _phrase_terms(phrases):
+    return {term for phrase in phrases for term in terms(phrase)}
+
+
+_TRIGGER_INDEX = defaultdict(set)  # term -> trigger types
+for _trigger, _words in TRIGGER_KEYWORDS.items():
+    for _term in _phrase_terms(_words):
+        _TRIGGER_INDEX[_term].add(_trigger)
+
+_MOOD_INDEX = {}  # term -> mood
+for _mood, _words in MOOD_KEYWORDS.items():
+    for _term in _phrase_terms(_words):
+        _MOOD_INDEX.setdefault(_term, _mood)
+
+
+def detect_triggers(text):
+    """Trigger types mentioned in ``text``, most mentioned first"""
+    counts = defaultdict(int)
+    for term in terms(text):
+        for trigger in _TRIGGER_INDEX.get(term, ()):
+            counts[trigger] += 1
+    return sorted(counts, key=counts.get, reverse=True)
+
+
+def detect_moods(text):
+    return {_MOOD_INDEX[term] for term in terms(text) if term in _MOOD_INDEX}
+
+
+class ResourceCatalog:
+    """Coping resources with an inverted index from trigger types, moods and words to entries"""
+
+    def __init__(self, resources):
+        self.resources = []
+        self.by_trigger = defaultdict(list)
+        self.by_mood = defaultdict(list)
+        self.by_term = defaultdict(dict)  # term -> {entry index: weight}
+        for resource in resources:
+            self.add(resource)
+
+    def add(self, resource):
+        if not resource.get("id") or not resource.get("suggestion"):
+            raise ValueError("Coping resources need an 'id' and a 'suggestion'")
+        if resource.get("kind", "strategy") not in KINDS:
+            raise ValueError(f"Unknown kind {resource['kind']!r} of coping resource {resource['id']}")
+        index = len(self.resources)
+        self.resources.append(resource)
+        for trigger in resource.get("triggers", ()):
+            self.by_trigger[trigger].append(index)
+        for mood in resource.get("moods", ()):
+            self.by_mood[mood].append(index)
+        for term in _phrase_terms(resource.get("keywords", ())):
+            self.by_term[term][index] = KEYWORD_WEIGHT
+        for term in terms(resource.get("title")):
+            self.by_term[term].setdefault(index, TITLE_WEIGHT)
+
+    def __len__(self):
+        return len(self.resources)
+
+    def match(self, text="", mood=None, triggers=None, kinds=None, limit=1):
+        """The ``limit`` best entries for ``text``, as ``(score, resource)`` pairs, best first.
+
+        Trigger types are detected in ``text`` unless given; ``mood`` is free
+        text (the mood a user logged). Entries of other ``kinds`` are skipped.
+        """
+        scores = defaultdict(float)
+        text_terms = terms(text)
+        detected = detect_triggers(text) if triggers is None else list(triggers)
+        for rank, trigger in enumerate(detected[:3]):
+            for index in self.by_trigger.get(trigger, ()):
+                scores[index] += TRIGGER_WEIGHT / (rank + 1)
+        for mood_name in detect_moods(mood):
+            for index in self.by_mood.get(mood_name, ()):
+                scores[index] += MOOD_WEIGHT
+        for term in set(text_terms):
+            for index, weight in self.by_term.get(term, {}).items():
+                scores[index] += weight
+        ranked = sorted(
+            ((score, index) for index, score in scores.items()
+             if kinds is None or self.resources[index].get("kind", "strategy") in kinds),
+            key=lambda pair: (-pair[0], pair[1]))
+        return [(score, self.resources[index]) for score, index in ranked[:limit]]
+
+    def best(self, text="", mood=None, triggers=None, kinds=None):
+        """The best matching entry, or the first ``unknown``-tagged entry when nothing matches"""
+        matches = self.match(text, mood, triggers, kinds)
+        if matches:
+            return matches[0][1]
+        fallback = self.by_trigger.get("unknown") or [0]
+        return self.resources[fallback[0]]
+
+
+def extract_suggestion(text):
+    """The most actionable sentence or bullet point of an agent reply, or None"""
+    best, best_score = None, 0.0
+    for position, raw in enumerate(_SENTENCE.split(text or "")):
+        sentence = _MARKUP.sub("", _BULLET.sub("", raw)).strip()
+        if not MIN_SUGGESTION_CHARS <= len(sentence) <= MAX_SUGGESTION_CHARS or sentence.endswith("?"):
+            continue
+        lowered = sentence.lower()
+        score = 0.0
+        if _ADVICE.match(lowered):
+            score += 2.0
+        if _ADVICE_ANYWHERE.search(lowered):
+            score += 1.0
+        if _BULLET.match(raw):
+            score += 0.5
+        if score == 0:
+            continue
+        # Prefer advice that names a known coping technique, then earlier sentences
+        score += min(1.5, 0.25 * sum(term in get_catalog().by_term for term in terms(sentence)))
+        score -= 0.01 * position
+        if score > best_score:
+            best, best_score = sentence, score
+    return best
+
+
+def extract_coping_suggestion(agent_feedback, drink_reason=None, mood=None):
+    """Coping suggestion for a daily log: from the agent's feedback, else from the catalog"""
+    suggestion = extract_suggestion(agent_feedback)
+    if suggestion is not None:
+        return suggestion
+    return get_catalog().best(f"{drink_reason or ''} {agent_feedback or ''}", mood=mood,
+                              kinds=("strategy", "exercise"))["suggestion"]
+
+
+def extract_resource(agent_response, trigger_event=None):
+    """Resource to share for a relapse-support entry: its URL, or its title for exercises"""
+    catalog = get_catalog()
+    triggers = detect_triggers(trigger_event) or None
+    resource = catalog.best(f"{trigger_event or ''} {agent_response or ''}", triggers=triggers)
+    return resource.get("url") or resource["title"]
+
+
+def load_resources(path):
+    with open(path) as f:
+        resources = json.load(f)
+    if not isinstance(resources, list):
+        raise ValueError("The coping resource file must hold a JSON list of entries")
+    return resources
+
+
+def for_region(resources, region):
+    """The entries without ``regions`` and those that list ``region``"""
+    regional = {r for resource in resources for r in resource.get("regions", ())}
+    if regional and region not in regional:
+        raise ValueError(f"No coping resources for region {region!r}; known regions: {', '.join(sorted(regional))}")
+    return [resource for resource in resources if not resource.get("regions") or region in resource["regions"]]
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """The process-wide catalog, built on first use"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                resources = load_resources(COPING_RESOURCES_PATH) if COPING_RESOURCES_PATH else RESOURCES
+                _catalog = ResourceCatalog(for_region(resources, COPING_RESOURCES_REGION))
+    return _catalog
+
+
+def set_catalog(catalog):
+    """Replace the process-wide catalog (tests)"""
+    global _catalog
+    with _catalog_lock:
+        _catalog = catalog
+
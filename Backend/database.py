@@ -0,0 +1,207 @@
+"""Process-wide MongoDB client shared by ``app.py``, the LangGraph workflow and tools.
+
+One ``MongoClient`` is created per process on first use, with pool settings
+from the environment. A forked child (e.g. a gunicorn worker started with
+``--preload``) never touches its parent's client and sockets: the reference is
+dropped after fork and the child connects on its own first use.
+
+Connection pool events feed the metrics registry in ``tracing.py``:
+
+- ``mongo_pool_checkout_wait_seconds``: time spent waiting for a connection
+- ``mongo_pool_connections_open`` / ``_in_use`` / ``_waiting`` and
+  ``mongo_pool_utilization`` (in use / max pool size) per server
+- ``mongo_pool_checkout_failures_total`` by reason (e.g. wait-queue timeout)
+"""
+import os
+import threading
+import time
+
+from tracing import count_round_trip, create_mongo_command_tracer, metrics
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "drink-agent-app")
+
+# Pool configuration (all optional)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+_client = None
+_db = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _client, _db, _lock, _pool_stats_lock
+    _client = None
+    _db = None
+    _lock = threading.Lock()
+    _pool_stats.clear()
+    _pool_stats_lock = threading.Lock()
+
+
+def get_client():
+    """MongoClient for this process, created on first use"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from pymongo import MongoClient
+                if not MONGODB_URI:
+                    raise RuntimeError("Missing required environment variable: MONGODB_URI")
+                _client = MongoClient(
+                    MONGODB_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    readPreference=MONGO_READ_PREFERENCE,
+                    event_listeners=[create_mongo_command_tracer(), create_pool_monitor()],
+                    connect=False
+                )
+    return _client
+
+
+def get_db():
+    """Database handle for this process (a stand-in when one was set with ``set_db``)"""
+    global _db
+    if _db is None:
+        client = get_client()
+        with _lock:
+            if _db is None:
+                _db = client[MONGODB_DATABASE]
+    return _db
+
+
+def set_db(db):
+    """Use ``db`` instead of connecting (tests and benchmarks pass mongomock).
+
+    Returns the database used until now (None if none was created yet).
+    """
+    global _db
+    with _lock:
+        previous, _db = _db, db
+    return previous
+
+
+# Collection methods that send one command to the server (a cursor counts once)
+ROUND_TRIP_METHODS = frozenset({
+    "find", "find_one", "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "bulk_write", "count_documents", "aggregate", "distinct",
+    "find_one_and_update", "find_one_and_replace", "find_one_and_delete", "create_index",
+})
+
+
+class LazyCollection:
+    """Collection handle that resolves against get_db() on first use.
+
+    Every call in ``ROUND_TRIP_METHODS`` is counted as a round trip (see ``tracing.count_round_trip``).
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        if attr in ROUND_TRIP_METHODS:
+            count_round_trip()
+        return getattr(get_db()[self.name], attr)
+
+
+def ping(timeout=2.0):
+    """Round-trip time of a ``ping`` command in seconds; raises if the server is unreachable"""
+    start = time.perf_counter()
+    get_db().command("ping", maxTimeMS=int(timeout * 1000))
+    return time.perf_counter() - start
+
+
+_pool_stats = {}
+_pool_stats_lock = threading.Lock()
+_pool_monitor_class = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def pool_stats():
+    """Connection counts per server address, as last reported by pool events"""
+    with _pool_stats_lock:
+        return {address: dict(stats) for address, stats in _pool_stats.items()}
+
+
+def create_pool_monitor():
+    """pymongo listener turning connection pool events into pool gauges and wait-time histograms.
+
+    pymongo is imported on first use so that importing this module stays cheap.
+    """
+    global _pool_monitor_class
+    if _pool_monitor_class is None:
+        from pymongo import monitoring
+
+        class PoolMonitor(monitoring.ConnectionPoolListener):
+            def __init__(self):
+                self._checkout_started = threading.local()
+
+            def _update(self, event, **deltas):
+                address = "%s:%s" % event.address
+                with _pool_stats_lock:
+                    stats = _pool_stats.setdefault(address, {"open": 0, "in_use": 0, "waiting": 0})
+                    for key, delta in deltas.items():
+                        stats[key] = max(0, stats[key] + delta)
+                    snapshot = dict(stats)
+                labels = {"address": address}
+                metrics.set_gauge("mongo_pool_connections_open", labels, snapshot["open"])
+                metrics.set_gauge("mongo_pool_connections_in_use", labels, snapshot["in_use"])
+                metrics.set_gauge("mongo_pool_connections_waiting", labels, snapshot["waiting"])
+                metrics.set_gauge("mongo_pool_utilization", labels, snapshot["in_use"] / MONGO_MAX_POOL_SIZE)
+                return labels
+
+            def _wait_time(self, event):
+                # Check-out started and finished events are delivered on the requesting thread
+                started = getattr(self._checkout_started, "value", None)
+                self._checkout_started.value = None
+                return time.perf_counter() - started if started is not None else 0.0
+
+            def pool_created(self, event):
+                self._update(event)
+
+            def pool_ready(self, event):
+                pass
+
+            def pool_cleared(self, event):
+                metrics.increment("mongo_pool_cleared_total", {"address": "%s:%s" % event.address})
+
+            def pool_closed(self, event):
+                pass
+
+            def connection_created(self, event):
+                self._update(event, open=1)
+
+            def connection_ready(self, event):
+                pass
+
+            def connection_closed(self, event):
+                self._update(event, open=-1)
+
+            def connection_check_out_started(self, event):
+                self._checkout_started.value = time.perf_counter()
+                self._update(event, waiting=1)
+
+            def connection_checked_out(self, event):
+                wait = self._wait_time(event)
+                labels = self._update(event, waiting=-1, in_use=1)
+                metrics.histogram("mongo_pool_checkout_wait_seconds", labels).observe(wait)
+
+            def connection_check_out_failed(self, event):
+                wait = self._wait_time(event)
+                labels = self._update(event, waiting=-1)
+                metrics.histogram("mongo_pool_checkout_wait_seconds", labels).observe(wait)
+                metrics.increment("mongo_pool_checkout_failures_total", {**labels, "reason": str(event.reason)})
+
+            def connection_checked_in(self, event):
+                self._update(event, in_use=-1)
+
+        _pool_monitor_class = PoolMonitor
+    return _pool_monitor_class()
@@ -0,0 +1,215 @@
+"""``Idempotency-Key`` support for POST endpoints that call the model.
+
+A client that retries a request with the same ``Idempotency-Key`` header gets
+the first request's response back instead of a second model call and a second
+set of writes:
+
+- a completed request's response (status below 500) is stored for
+  ``IDEMPOTENCY_TTL_S`` and replayed, with ``Idempotent-Replayed: true``
+- a duplicate of a request still in progress waits up to
+  ``IDEMPOTENCY_WAIT_S`` for it, then gets 409
+- reusing a key with a different body is rejected with 422
+- a request that failed with a 5xx or an exception frees its key for a retry;
+  one whose worker died frees it when its ``IDEMPOTENCY_LEASE_S`` lease runs out
+
+Keys are scoped to the endpoint path and the request's ``user_id`` (from the
+JSON body or the query string), so two users picking the same key do not
+collide. Requests in flight and recent responses are kept in process memory,
+so duplicates reaching the same worker never touch the database; across
+workers, the ``idempotency_keys`` collection (through
+``repositories.py``, with a TTL index on ``expires_at``) is authoritative.
+Requests without the header are not affected.
+"""
+import datetime
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote
+
+from flask import Response, jsonify, make_response, request
+
+from repositories import get_repositories
+from tracing import metrics
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", "86400"))
+IDEMPOTENCY_WAIT_S = float(os.getenv("IDEMPOTENCY_WAIT_S", "30"))
+# How long a claim of a request in flight holds its key; a worker that dies mid-request frees it after this
+IDEMPOTENCY_LEASE_S = float(os.getenv("IDEMPOTENCY_LEASE_S", str(4 * IDEMPOTENCY_WAIT_S)))
+IDEMPOTENCY_POLL_S = float(os.getenv("IDEMPOTENCY_POLL_S", "0.25"))
+IDEMPOTENCY_LOCAL_KEYS = int(os.getenv("IDEMPOTENCY_LOCAL_KEYS", "10000"))
+MAX_KEY_LENGTH = 255
+
+_local = OrderedDict()  # scoped key -> _Entry, least recently used first
+_local_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _local_lock
+    _local.clear()
+    _local_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _Entry:
+    """A request with a given key in this process: in flight until ``done`` is set"""
+    __slots__ = ("fingerprint", "done", "response", "expires")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+        self.expires = None
+
+
+def _error(message, status):
+    return jsonify({"error": message, "status": "error"}), status
+
+
+def _replay(stored, outcome):
+    metrics.increment("idempotency_requests_total", {"outcome": outcome})
+    response = Response(stored["body"], status=stored["status"], mimetype=stored["mimetype"])
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _remember(scoped, entry):
+    with _local_lock:
+        _local[scoped] = entry
+        _local.move_to_end(scoped)
+        while len(_local) > IDEMPOTENCY_LOCAL_KEYS:
+            oldest_key, oldest = next(iter(_local.items()))
+            if not oldest.done.is_set():
+                break  # never forget a request in flight
+            del _local[oldest_key]
+
+
+def _forget(scoped, entry):
+    with _local_lock:
+        if _local.get(scoped) is entry:
+            del _local[scoped]
+
+
+def _await_stored(repository, scoped):
+    """Poll for another worker's response; None if its claim is released or the wait runs out"""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_S
+    while time.monotonic() < deadline:
+        time.sleep(IDEMPOTENCY_POLL_S)
+        record = repository.get(scoped)
+        if record is None or record["state"] == "completed":
+            return record
+        if record["expires_at"] <= datetime.datetime.utcnow():
+            return None  # the original's lease ran out (its worker died): take the key over
+    return False
+
+
+def _run(view, args, kwargs, scoped, fingerprint, entry):
+    """Claim the key, then run the view or replay the stored response"""
+    repository = get_repositories().idempotency
+    while True:
+        now = datetime.datetime.utcnow()
+        existing = repository.claim({
+            "_id": scoped,
+            "fingerprint": fingerprint,
+            "state": "in_flight",
+            "created_at": now,
+            "expires_at": now + datetime.timedelta(seconds=IDEMPOTENCY_LEASE_S)
+        })
+        if existing is None:
+            break
+        if existing["fingerprint"] != fingerprint:
+            metrics.increment("idempotency_requests_total", {"outcome": "mismatch"})
+            return None, _error(f"{IDEMPOTENCY_HEADER} was already used with a different request body", 422)
+        if existing["state"] == "in_flight":
+            # The original is running in another worker
+            existing = _await_stored(repository, scoped)
+            if existing is False:
+                metrics.increment("idempotency_requests_total", {"outcome": "conflict"})
+                return None, _error("A request with this idempotency key is still in progress", 409)
+            if existing is None:
+                continue  # it failed and released the key: run it here
+        return existing["response"], _replay(existing["response"], "replayed")
+
+    try:
+        response = make_response(view(*args, **kwargs))
+    except Exception:
+        repository.release(scoped)
+        raise
+    if response.status_code >= 500 or response.is_streamed:
+        repository.release(scoped)
+        return None, response
+    stored = {
+        "status": response.status_code,
+        "mimetype": response.mimetype,
+        "body": response.get_data(as_text=True)
+    }
+    repository.complete(scoped, stored,
+                        datetime.datetime.utcnow() + datetime.timedelta(seconds=IDEMPOTENCY_TTL_S))
+    metrics.increment("idempotency_requests_total", {"outcome": "new"})
+    return stored, response
+
+
+def _user_id():
+    body = request.get_json(silent=True)
+    user_id = body.get("user_id") if isinstance(body, dict) else None
+    return str(user_id or request.args.get("user_id") or "")
+
+
+def idempotent(view):
+    """Make a POST view replay its response for repeated ``Idempotency-Key`` headers"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters", 400)
+        scoped = f"{request.path}:{quote(_user_id(), safe='')}:{key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        while True:
+            with _local_lock:
+                entry = _local.get(scoped)
+                if entry is not None and entry.done.is_set() and entry.expires < time.monotonic():
+                    del _local[scoped]
+                    entry = None
+                if entry is None:
+                    entry = _Entry(fingerprint)
+                    _local[scoped] = entry
+                    owner = True
+                else:
+                    owner = False
+            if owner:
+                break
+            if entry.fingerprint != fingerprint:
+                metrics.increment("idempotency_requests_total", {"outcome": "mismatch"})
+                return _error(f"{IDEMPOTENCY_HEADER} was already used with a different request body", 422)
+            # A duplicate in this worker: wait for the original instead of asking the database
+            if not entry.done.wait(IDEMPOTENCY_WAIT_S):
+                metrics.increment("idempotency_requests_total", {"outcome": "conflict"})
+                return _error("A request with this idempotency key is still in progress", 409)
+            if entry.response is not None:
+                return _replay(entry.response, "replayed_local")
+            # The original failed and freed the key; try again
+
+        try:
+            stored, response = _run(view, args, kwargs, scoped, fingerprint, entry)
+        except Exception:
+            _forget(scoped, entry)
+            entry.done.set()
+            raise
+        if stored is None:
+            _forget(scoped, entry)
+        else:
+            entry.response = stored
+            entry.expires = time.monotonic() + IDEMPOTENCY_TTL_S
+            _remember(scoped, entry)
+        entry.done.set()
+        return response
+
+    return wrapper
@@ -0,0 +1,386 @@
+"""Ingestion of uploaded documents into per-user retrieval indexes.
+
+After an upload, ``schedule_ingestion`` streams the blob on a background
+thread, extracts its text, splits it into overlapping chunks and embeds them
+in batches on the embedding deployment (``EMBEDDING_DEPLOYMENT``). Chunks and
+their float32 vectors are stored once per content hash in the
+``document_chunks`` collection, so identical uploads are embedded once.
+
+``get_sources`` answers chat requests from an in-process ``UserIndex`` per
+user: a single contiguous float32 array of the user's chunk vectors that is
+extended incrementally as files are indexed, and rebuilt only when a file is
+replaced (re-uploaded under the same name) or re-indexed (its ``indexed_at``
+changes). The index is checked against ``files`` at most every
+``INGEST_INDEX_REFRESH_S`` (and right after this process indexes one of the
+user's files); a user without indexed documents costs no query embedding.
+Blobs are never read on the request path.
+
+Run ``python ingestion.py --user-id <id>`` (or ``--all``) to index files
+offline, e.g. after changing the chunking settings.
+"""
+import argparse
+import codecs
+import datetime
+import math
+import os
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_router import EMBEDDING_TIER, get_router
+from llm_scheduler import BACKGROUND, llm_priority
+from tracing import set_span_attribute, span
+from usage import usage_scope
+
+INGEST_ON_UPLOAD = os.getenv("INGEST_ON_UPLOAD", "true").lower() == "true"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_CHUNK_CHARS = int(os.getenv("INGEST_CHUNK_CHARS", "1500"))
+INGEST_CHUNK_OVERLAP = min(int(os.getenv("INGEST_CHUNK_OVERLAP", "200")), INGEST_CHUNK_CHARS // 4)
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "16"))
+INGEST_INDEX_CACHE_USERS = int(os.getenv("INGEST_INDEX_CACHE_USERS", "256"))
+# How long a user's index is used before checking the files index again (files indexed by
+# this worker show up at once)
+INGEST_INDEX_REFRESH_S = float(os.getenv("INGEST_INDEX_REFRESH_S", "60"))
+INGEST_CONTENT_LOCKS = 64
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))
+
+# Bump when chunking changes; content indexed with an older version is re-indexed
+CHUNKER_VERSION = 1
+
+TEXT_CONTENT_TYPES = {"application/json", "application/xml", "application/x-ndjson",
+                      "application/csv", "application/javascript", "application/x-yaml"}
+
+# files.ingest_status values
+PENDING = "pending"
+INDEXED = "indexed"
+UNSUPPORTED = "unsupported"
+FAILED = "failed"
+
+_executor = None
+_executor_lock = threading.Lock()
+# Striped by content hash: a fixed set of locks however many contents get indexed
+_content_locks = [threading.Lock() for _ in range(INGEST_CONTENT_LOCKS)]
+
+
+class UnsupportedContentError(Exception):
+    """Raised when no text can be extracted from a file's content type"""
+
+
+def ingestion_enabled():
+    """Ingestion needs an embedding deployment"""
+    return INGEST_ON_UPLOAD and get_router().has_tier(EMBEDDING_TIER)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+    return _executor
+
+
+def is_text(content_type):
+    return bool(content_type) and (content_type.startswith("text/") or content_type in TEXT_CONTENT_TYPES)
+
+
+def iter_text(blob_client, content_type):
+    """Yield the text of a blob piece by piece, streaming it from storage"""
+    if content_type == "application/pdf":
+        yield from iter_pdf_text(blob_client)
+        return
+    if not is_text(content_type):
+        raise UnsupportedContentError(f"Cannot extract text from {content_type or 'unknown content type'}")
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for data in blob_client.download_blob().chunks():
+        yield decoder.decode(data)
+    yield decoder.decode(b"", final=True)
+
+
+def iter_pdf_text(blob_client):
+    """Yield the text of a PDF page by page (needs the optional ``pypdf`` package)"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedContentError("PDF text extraction requires the pypdf package")
+    # PDFs need random access, so the blob is spooled to a temporary file rather than memory
+    with tempfile.TemporaryFile() as f:
+        for data in blob_client.download_blob().chunks():
+            f.write(data)
+        f.seek(0)
+        for page in PdfReader(f).pages:
+            yield (page.extract_text() or "") + "\n\n"
+
+
+def find_boundary(text, size):
+    """Cut position at or before ``size``, preferring paragraph, sentence, then word breaks"""
+    window = text[size // 2:size]
+    for separator in ("\n\n", ". ", "\n", " "):
+        index = window.rfind(separator)
+        if index != -1:
+            return size // 2 + index + len(separator)
+    return size
+
+
+def iter_chunks(pieces, size=INGEST_CHUNK_CHARS, overlap=INGEST_CHUNK_OVERLAP):
+    """Split streamed text into chunks of at most ``size`` characters, overlapping by ``overlap``"""
+    buffer = ""
+    carried = 0  # length of the overlap at the start of the buffer
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= size:
+            cut = find_boundary(buffer, size)
+            chunk = buffer[:cut].strip()
+            if chunk:
+                yield chunk
+            buffer = buffer[cut - overlap:]
+            carried = overlap
+    if len(buffer) > carried and buffer.strip():
+        yield buffer.strip()
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def _content_lock(content_hash):
+    return _content_locks[hash(content_hash) % INGEST_CONTENT_LOCKS]
+
+
+def ingest_content(db, blob_container_client, content, force=False):
+    """Chunk and embed one stored blob (a ``file_contents`` document). Returns the chunk count.
+
+    Content already indexed with the current CHUNKER_VERSION is skipped unless ``force``.
+    """
+    from pymongo.errors import BulkWriteError
+
+    content_hash = content["content_hash"]
+    with _content_lock(content_hash):
+        current = db["file_contents"].find_one({"content_hash": content_hash}, {"_id": 0}) or content
+        if not force and current.get("chunker_version") == CHUNKER_VERSION:
+            return current.get("chunk_count", 0)
+        db["document_chunks"].delete_many({"content_hash": content_hash})
+
+        blob_client = blob_container_client.get_blob_client(content["blob_path"])
+        router = get_router()
+        chunk_count = 0
+
+        def flush(batch):
+            with llm_priority(BACKGROUND), usage_scope("ingestion"):
+                vectors = router.embeddings(batch)
+            documents = [{
+                "_id": f"{content_hash}:{chunk_count + i}",
+                "content_hash": content_hash,
+                "chunk_index": chunk_count + i,
+                "text": text,
+                "embedding": array("f", normalize(vector)).tobytes(),
+                "dim": len(vector),
+                "chunker_version": CHUNKER_VERSION
+            } for i, (text, vector) in enumerate(zip(batch, vectors))]
+            try:
+                db["document_chunks"].insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                # Another worker indexed the same content concurrently
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+            return len(documents)
+
+        batch = []
+        for chunk in iter_chunks(iter_text(blob_client, content.get("content_type"))):
+            batch.append(chunk)
+            if len(batch) >= INGEST_EMBED_BATCH:
+                chunk_count += flush(batch)
+                batch = []
+        if batch:
+            chunk_count += flush(batch)
+
+        db["file_contents"].update_one(
+            {"content_hash": content_hash},
+            {"$set": {"chunker_version": CHUNKER_VERSION, "chunk_count": chunk_count}}
+        )
+        return chunk_count
+
+
+def ingest_file(db, blob_container_client, file_record, force=False):
+    """Index one uploaded file, recording the outcome in its ``files`` entry"""
+    files = db["files"]
+    with span("ingest.file", file_record.get("content_type") or "unknown",
+              **{"payload.request_bytes": file_record.get("size", 0)}):
+        files.update_one({"file_id": file_record["file_id"]}, {"$set": {"ingest_status": PENDING}})
+        content = db["file_contents"].find_one({"content_hash": file_record["content_hash"]}, {"_id": 0})
+        update = {"indexed_at": datetime.datetime.now()}
+        try:
+            if content is None:
+                raise UnsupportedContentError("Content is missing from the file_contents index")
+            update["chunk_count"] = ingest_content(db, blob_container_client, content, force=force)
+            update["ingest_status"] = INDEXED
+        except UnsupportedContentError as e:
+            update.update(ingest_status=UNSUPPORTED, ingest_error=str(e))
+        except Exception as e:
+            update.update(ingest_status=FAILED, ingest_error=str(e))
+        set_span_attribute("ingest.status", update["ingest_status"])
+        files.update_one({"file_id": file_record["file_id"]}, {"$set": update})
+        mark_index_stale(file_record.get("user_id"))
+        return update["ingest_status"]
+
+
+def schedule_ingestion(db, blob_container_client, file_record):
+    """Index a new upload on a background thread"""
+    db["files"].update_one({"file_id": file_record["file_id"]}, {"$set": {"ingest_status": PENDING}})
+    return get_executor().submit(ingest_file, db, blob_container_client, file_record)
+
+
+def reindex(db, blob_container_client, user_id=None, force=False):
+    """Index every file (of one user, or all users) that is not indexed with the current chunker.
+
+    Returns a count of files per resulting ingest status.
+    """
+    filters = {"user_id": user_id} if user_id else {}
+    stale = {c["content_hash"] for c in db["file_contents"].find(
+        {"chunker_version": {"$ne": CHUNKER_VERSION}}, {"_id": 0, "content_hash": 1})}
+    results = {}
+    for file_record in db["files"].find(filters, {"_id": 0}):
+        if not force and file_record.get("ingest_status") == INDEXED and file_record["content_hash"] not in stale:
+            continue
+        status = ingest_file(db, blob_container_client, file_record, force=force)
+        results[status] = results.get(status, 0) + 1
+    return results
+
+
+class UserIndex:
+    """A user's chunk vectors in one contiguous float32 array, with cosine-similarity search"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.dim = None
+        self.vectors = array("f")
+        self.entries = []  # (file_id, filename, chunk_index, text), one per vector
+        self.file_ids = {}  # file_id -> indexed_at of the chunks loaded
+        self.refreshed_at = None
+        self.stale = True
+        self._lock = threading.Lock()
+
+    def _clear(self):
+        self.dim = None
+        self.vectors = array("f")
+        self.entries = []
+        self.file_ids = {}
+
+    def needs_refresh(self):
+        return (self.stale or self.refreshed_at is None
+                or time.monotonic() - self.refreshed_at >= INGEST_INDEX_REFRESH_S)
+
+    def refresh(self, db):
+        """Bring the index in line with the user's indexed files, loading only new chunks"""
+        self.stale = False
+        self.refreshed_at = time.monotonic()
+        current = {}
+        for file_record in db["files"].find(
+                {"user_id": self.user_id, "ingest_status": INDEXED},
+                {"_id": 0, "file_id": 1, "filename": 1, "content_hash": 1, "indexed_at": 1}).sort("created_at", -1):
+            # The newest upload of a filename replaces older versions
+            current.setdefault(file_record["filename"], file_record)
+        wanted = {f["file_id"]: f.get("indexed_at") for f in current.values()}
+        with self._lock:
+            # Rebuild when a loaded file was replaced, or re-indexed since (new indexed_at)
+            if any(file_id not in wanted or wanted[file_id] != indexed_at
+                   for file_id, indexed_at in self.file_ids.items()):
+                self._clear()
+            for file_record in current.values():
+                if file_record["file_id"] in self.file_ids:
+                    continue
+                for chunk in db["document_chunks"].find(
+                        {"content_hash": file_record["content_hash"]},
+                        {"_id": 0, "chunk_index": 1, "text": 1, "embedding": 1, "dim": 1}).sort("chunk_index", 1):
+                    if self.dim is None:
+                        self.dim = chunk["dim"]
+                    if chunk["dim"] != self.dim:
+                        continue
+                    self.vectors.frombytes(bytes(chunk["embedding"]))
+                    self.entries.append((file_record["file_id"], file_record["filename"],
+                                         chunk["chunk_index"], chunk["text"]))
+                self.file_ids[file_record["file_id"]] = file_record.get("indexed_at")
+        return self
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, query_vector, top_k=RETRIEVAL_TOP_K, min_score=RETRIEVAL_MIN_SCORE):
+        """Best matching chunks as ``{file_id, filename, chunk_index, text, score}``"""
+        with self._lock:
+            if not self.entries or len(query_vector) != self.dim:
+                return []
+            query = normalize(query_vector)
+            try:
+                import numpy
+                matrix = numpy.frombuffer(self.vectors, dtype=numpy.float32).reshape(-1, self.dim)
+                scores = (matrix @ numpy.asarray(query, dtype=numpy.float32)).tolist()
+            except ImportError:
+                scores = [sum(a * b for a, b in zip(self.vectors[i * self.dim:(i + 1) * self.dim], query))
+                          for i in range(len(self.entries))]
+            ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:top_k]
+            return [{
+                "file_id": self.entries[i][0],
+                "filename": self.entries[i][1],
+                "chunk_index": self.entries[i][2],
+                "text": self.entries[i][3],
+                "score": scores[i]
+            } for i in ranked if scores[i] >= min_score]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_user_index(user_id):
+    """Process-wide index for a user (least recently used indexes are dropped)"""
+    with _indexes_lock:
+        index = _indexes.pop(user_id, None)
+        if index is None:  # not ``or``: an empty index is falsy
+            index = UserIndex(user_id)
+        _indexes[user_id] = index
+        while len(_indexes) > INGEST_INDEX_CACHE_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def mark_index_stale(user_id):
+    """Make the user's index check the files index on its next use (a file was indexed)"""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+    if index is not None:
+        index.stale = True
+
+
+def get_sources(db, user_id, message, top_k=RETRIEVAL_TOP_K):
+    """Chunks of the user's uploaded documents relevant to ``message`` (empty if none or on error)"""
+    if not get_router().has_tier(EMBEDDING_TIER):
+        return []
+    index = get_user_index(user_id)
+    if index.needs_refresh():
+        index.refresh(db)
+    if not len(index):
+        return []  # no indexed documents: no query embedding either
+    try:
+        query_vector = get_router().embeddings([message])[0]
+    except Exception:
+        return []
+    return index.search(query_vector, top_k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index uploaded documents for retrieval")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", help="Index one user's files")
+    target.add_argument("--all", action="store_true", help="Index every user's files")
+    parser.add_argument("--force", action="store_true", help="Re-chunk and re-embed files that are already indexed")
+    args = parser.parse_args()
+
+    from app import ensure_file_indexes, get_blob_container_client, get_db
+    ensure_file_indexes()
+    print(reindex(get_db(), get_blob_container_client(), user_id=args.user_id, force=args.force))
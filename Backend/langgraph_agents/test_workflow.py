@@ -1,19 +1,23 @@
 from langchain_core.messages import HumanMessage
 from workflow import run_workflow, TriggerType
+from cassettes import install_from_env
 from dotenv import load_dotenv
 import os
 from pathlib import Path
-from workflow import agent_memory_collection, get_latest_agent_memory, insert_test_user, agent_memory_collection
+from workflow import get_db, get_latest_agent_memory, insert_test_user
 from typing import List, Dict
 
 def main():
     # Load environment variables from parent directory
     dotenv_path = Path(__file__).parent.parent / '.env'
     load_dotenv(dotenv_path)
+
+    # CASSETTE_MODE=record|replay (with CASSETTE_PATH) records the scenarios or replays them offline
+    install_from_env()
     
     # Clean up memory for test user before running tests
     user_id = "test_user"
-    agent_memory_collection.delete_many({"user_id": user_id})
+    get_db()["agent_memory"].delete_many({"user_id": user_id})
     
     insert_test_user(user_id, name="Test User", email="test@example.com")
     
@@ -75,6 +79,10 @@ def main():
         print("\nFinal messages:")
         for msg in result["messages"]:
             print(f"{msg.type}: {msg.content[:100]}..." if len(msg.content) > 100 else f"{msg.type}: {msg.content}")
+
+        print("\nNode metrics:")
+        for metric in result.get("node_metrics", []):
+            print(f"{metric['node']} ({metric['tier']}): {metric['latency_s']:.2f}s, ${metric['cost_usd']:.5f}")
     
     # Test memory persistence
     print("\n\n--- Testing MEMORY PERSISTENCE ---")
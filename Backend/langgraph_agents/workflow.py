@@ -1,30 +1,43 @@
-from typing import Annotated, Any, Dict, List, Tuple, TypedDict
-from langchain_core.messages import BaseMessage, HumanMessage
+from typing import Annotated, Any, Callable, Dict, List, Optional, Tuple, TypedDict
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langgraph.graph import Graph, StateGraph
 from langchain_openai import AzureChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableSequence
 import operator
 import os
 from enum import Enum, auto
-from pymongo import MongoClient
 import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import threading
+import contextvars
 import datetime
-
-# MongoDB setup (reuse your .env variables)
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "drink-agent-app")
-mongo_client = MongoClient(MONGODB_URI)
-db = mongo_client[MONGODB_DATABASE]
-agent_memory_collection = db["agent_memory"]
-
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Shared backend modules live one directory up
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from cassettes import http_client
+from database import get_db
+from llm_router import FAST_TIER, LARGE_TIER, get_router
+from repositories import get_repositories
+from resilience import LLM_ATTEMPT_TIMEOUT_S
+from tracing import metrics, payload_size, set_span_attribute, span
+from usage import record_usage
+
+# Agent memory: the process-wide repositories shared with app.py (see repositories.py)
 def store_agent_memory(user_id, memory):
-    """Store agent memory in MongoDB."""
+    """Store agent memory."""
     memory_doc = {
         "user_id": user_id,
         "memory": memory,
         "timestamp": datetime.datetime.now()
     }
-    agent_memory_collection.insert_one(memory_doc)
+    get_repositories().memory.create(memory_doc)
 
 # def get_latest_agent_memory(user_id):
 #     """Retrieve the latest agent memory for a user from MongoDB."""
@@ -35,10 +48,7 @@ def store_agent_memory(user_id, memory):
 #     return doc["memory"] if doc else {}
 
 def get_latest_agent_memory(user_id):
-    doc = agent_memory_collection.find_one(
-        {"user_id": user_id},
-        sort=[("_id", -1)]  # Use _id, which is always indexed
-    )
+    doc = get_repositories().memory.latest(user_id)
     return doc["memory"] if doc else {}
 
 # Define trigger types as an Enum
@@ -59,16 +69,119 @@ class AgentState(TypedDict):
     drinking_status: bool | None
     trigger_type: TriggerType | None
     memory: Dict[str, Any]  # For storing user preferences and history
-
-def get_azure_chat_model(temperature=0):
+    node_metrics: List[Dict[str, Any]]  # Latency, tokens and cost of each LLM node in this run
+
+# Model tier and temperature per node. The classification nodes only answer with
+# one word, so they run on the fast tier; coping replies use the large tier.
+# Override with WORKFLOW_NODE_MODELS, e.g. {"trigger_identification": {"tier": "large"}}
+NODE_MODEL_CONFIG = {
+    "core_agent": {"tier": FAST_TIER, "temperature": 0},
+    "trigger_identification": {"tier": FAST_TIER, "temperature": 0.3},
+    "coping": {"tier": LARGE_TIER, "temperature": 0.7},
+}
+for _node, _overrides in json.loads(os.getenv("WORKFLOW_NODE_MODELS", "{}")).items():
+    NODE_MODEL_CONFIG.setdefault(_node, {}).update(_overrides)
+
+def get_azure_chat_model(temperature=0, tier=LARGE_TIER):
+    # The router picks the deployment of this tier with the best observed latency and quota
+    deployment = get_router().choose(tier=tier)
     return AzureChatOpenAI(
-        azure_deployment=os.getenv("GPT4_DEPLOYMENT"),
-        openai_api_version="2024-02-15-preview",
-        azure_endpoint=os.getenv("AZURE_ENDPOINT").rstrip('/'),  # Remove trailing slash if present
-        api_key=os.getenv("AZURE_API_KEY"),
-        temperature=temperature
+        azure_deployment=deployment.deployment,
+        openai_api_version=deployment.api_version,
+        azure_endpoint=deployment.endpoint.rstrip('/'),  # Remove trailing slash if present
+        api_key=deployment.api_key,
+        temperature=temperature,
+        timeout=LLM_ATTEMPT_TIMEOUT_S,
+        max_retries=0,  # Retries are handled by the resilience layer
+        http_client=http_client(),  # Records or replays requests when a cassette is installed
+        name=deployment.name
     )
 
+# Fallback replies used when the model deployment is unavailable
+CLASSIFIER_FALLBACK = "NOT_DRINKING"
+TRIGGER_FALLBACK = TriggerType.UNKNOWN.value
+COPING_FALLBACK = (
+    "I'm having trouble putting together suggestions right now. In the meantime, try taking a few slow, "
+    "deep breaths, drinking a glass of water, or reaching out to someone you trust."
+)
+
+def get_node_model(node: str):
+    """Chat model for a node, using the tier and temperature from NODE_MODEL_CONFIG"""
+    config = NODE_MODEL_CONFIG[node]
+    return get_azure_chat_model(temperature=config.get("temperature", 0), tier=config.get("tier", LARGE_TIER))
+
+# Process-wide per-node totals: calls, latency, tokens and cost
+_node_stats: Dict[str, Dict[str, Any]] = {}
+_node_stats_lock = threading.Lock()
+
+def get_token_usage(response: BaseMessage) -> Tuple[int, int]:
+    """(prompt_tokens, completion_tokens) reported for a model response"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = getattr(response, "response_metadata", {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+def record_node_call(state: AgentState, node: str, deployment, latency: float, response: BaseMessage):
+    """Record one LLM node call in the run's node_metrics and the process-wide totals"""
+    prompt_tokens, completion_tokens = get_token_usage(response)
+    metric = {
+        "node": node,
+        "deployment": deployment.name,
+        "tier": deployment.tier,
+        "latency_s": latency,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": deployment.cost(prompt_tokens, completion_tokens),
+    }
+    state.setdefault("node_metrics", []).append(metric)
+    with _node_stats_lock:
+        stats = _node_stats.setdefault(node, {
+            "calls": 0, "total_latency_s": 0.0, "max_latency_s": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0, "tier": deployment.tier
+        })
+        stats["calls"] += 1
+        stats["total_latency_s"] += latency
+        stats["max_latency_s"] = max(stats["max_latency_s"], latency)
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["cost_usd"] += metric["cost_usd"]
+        stats["tier"] = deployment.tier
+
+def get_node_stats() -> Dict[str, Dict[str, Any]]:
+    """Per-node totals with average latency, for comparing tiers"""
+    with _node_stats_lock:
+        return {
+            node: {**stats, "avg_latency_s": stats["total_latency_s"] / stats["calls"]}
+            for node, stats in _node_stats.items()
+        }
+
+def invoke_chain(node: str, chain, state: AgentState, fallback: str) -> BaseMessage:
+    """Invoke a node's chain on its model's deployment, answering with ``fallback`` if the deployment is unavailable."""
+    router = get_router()
+    deployment = router.get(chain.last.name)
+    start = time.perf_counter()
+
+    def attempt(deployment, timeout):
+        # One span per attempt, as in llm_router, with the timeout the guard allows for it
+        with span("llm.call", deployment.name, **{
+            "llm.tier": deployment.tier,
+            "graph.node": node,
+            "payload.request_bytes": payload_size(state["messages"])
+        }) as llm_span:
+            timed = RunnableSequence(*chain.steps[:-1], chain.last.bind(timeout=timeout))
+            response = timed.invoke({"messages": state["messages"]})
+            llm_span.set_tokens(*get_token_usage(response))
+            llm_span.set_attribute("payload.response_bytes", len(str(response.content).encode("utf-8")))
+            return response
+
+    response = router.call_on(deployment, attempt, fallback=lambda: AIMessage(content=fallback))
+    prompt_tokens, completion_tokens = get_token_usage(response)
+    if prompt_tokens or completion_tokens:
+        record_usage(prompt_tokens, completion_tokens, deployment.cost(prompt_tokens, completion_tokens), node=node)
+    record_node_call(state, node, deployment, time.perf_counter() - start, response)
+    return response
+
 # Core agent that processes the conversation and makes initial assessment
 def create_core_agent():
     prompt = ChatPromptTemplate.from_messages([
@@ -79,11 +192,11 @@ def create_core_agent():
                   "Respond with 'DRINKING' if you detect alcohol consumption, 'NOT_DRINKING' if you don't.")
     ])
     
-    model = get_azure_chat_model(temperature=0)
+    model = get_node_model("core_agent")
     chain = prompt | model
     
     def core_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
+        response = invoke_chain("core_agent", chain, state, CLASSIFIER_FALLBACK)
         state["drinking_status"] = response.content == "DRINKING"
         return state
     
@@ -101,7 +214,7 @@ def create_trigger_identification_agent():
                   "Respond with exactly one word from the list of triggers provided.")
     ])
     
-    model = get_azure_chat_model(temperature=0.3)
+    model = get_node_model("trigger_identification")
     chain = prompt | model
     
     def trigger_agent(state: AgentState) -> AgentState:
@@ -111,9 +224,9 @@ def create_trigger_identification_agent():
             # Use memory to influence the identification (simplified logic)
             # In a real implementation, this would be more sophisticated
             
-        response = chain.invoke({"messages": state["messages"]})
-        print("LLM output for trigger:", response.content)
+        response = invoke_chain("trigger_identification", chain, state, TRIGGER_FALLBACK)
         trigger = response.content.strip().lower()
+        set_span_attribute("trigger.raw", trigger)
         
         # Map response to TriggerType enum
         try:
@@ -141,181 +254,277 @@ def create_trigger_identification_agent():
     
     return trigger_agent
 
-# Create specialized coping strategy agents for each trigger type
-def create_stress_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users manage stress without alcohol. "
+# Coping agents, one per trigger type: the prompt of each is declared here; temperature
+# and tier default to NODE_MODEL_CONFIG["coping"] and can be set per entry.
+COPING_AGENTS: Dict[TriggerType, Dict[str, Any]] = {
+    TriggerType.STRESS: {
+        "node": "stress_coping",
+        "system": "You are a supportive AI assistant specialized in helping users manage stress without alcohol. "
                   "Provide compassionate, practical stress-reduction strategies such as deep breathing exercises, "
-                  "progressive muscle relaxation, and guided imagery."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking due to stress. What stress management strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def stress_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return stress_agent
-
-def create_social_pressure_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users resist social pressure to drink. "
-                  "Provide strategies for assertive refusal skills and suggestions for alternative social activities."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking due to social pressure. What strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def social_pressure_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return social_pressure_agent
-
-def create_boredom_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users address boredom without alcohol. "
-                  "Provide engaging hobby ideas and mindfulness practices to prevent boredom-induced drinking."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking due to boredom. What alternative activities would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def boredom_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return boredom_agent
-
-# Add the missing coping agent functions
-
-def create_negative_emotions_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users manage negative emotions without alcohol. "
-                  "Provide compassionate strategies for emotional awareness, acceptance, and healthy coping mechanisms like journaling."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking due to negative emotions. What emotional coping strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def negative_emotions_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return negative_emotions_agent
-
-def create_fatigue_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users manage fatigue without alcohol. "
-                  "Provide effective sleep hygiene tips, energy-boosting activities, and nutritional advice."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking due to fatigue. What energy management strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def fatigue_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return fatigue_agent
-
-def create_celebrations_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users navigate celebrations without alcohol. "
-                  "Provide ideas for alcohol-free events, non-alcoholic beverage options, and setting personal boundaries."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be concerned about drinking at celebrations. What alcohol-free celebration strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def celebrations_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return celebrations_agent
-
-def create_loneliness_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users cope with loneliness without alcohol. "
-                  "Provide strategies for social connection, volunteering opportunities, and meaningful solitary activities."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking due to loneliness. What social connection strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def loneliness_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return loneliness_agent
-
-def create_habitual_patterns_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant specialized in helping users break habitual drinking patterns. "
-                  "Provide habit tracking methods, ideas for new rituals, and mindfulness techniques for habit disruption."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking out of habit. What habit-breaking strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def habitual_patterns_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
+                  "progressive muscle relaxation, and guided imagery.",
+        "instruction": "The user appears to be drinking due to stress. What stress management strategies would you suggest?",
+    },
+    TriggerType.SOCIAL_PRESSURE: {
+        "node": "social_pressure_coping",
+        "system": "You are a supportive AI assistant specialized in helping users resist social pressure to drink. "
+                  "Provide strategies for assertive refusal skills and suggestions for alternative social activities.",
+        "instruction": "The user appears to be drinking due to social pressure. What strategies would you suggest?",
+    },
+    TriggerType.BOREDOM: {
+        "node": "boredom_coping",
+        "system": "You are a supportive AI assistant specialized in helping users address boredom without alcohol. "
+                  "Provide engaging hobby ideas and mindfulness practices to prevent boredom-induced drinking.",
+        "instruction": "The user appears to be drinking due to boredom. What alternative activities would you suggest?",
+    },
+    TriggerType.NEGATIVE_EMOTIONS: {
+        "node": "negative_emotions_coping",
+        "system": "You are a supportive AI assistant specialized in helping users manage negative emotions without alcohol. "
+                  "Provide compassionate strategies for emotional awareness, acceptance, and healthy coping mechanisms like journaling.",
+        "instruction": "The user appears to be drinking due to negative emotions. What emotional coping strategies would you suggest?",
+    },
+    TriggerType.FATIGUE: {
+        "node": "fatigue_coping",
+        "system": "You are a supportive AI assistant specialized in helping users manage fatigue without alcohol. "
+                  "Provide effective sleep hygiene tips, energy-boosting activities, and nutritional advice.",
+        "instruction": "The user appears to be drinking due to fatigue. What energy management strategies would you suggest?",
+    },
+    TriggerType.CELEBRATIONS: {
+        "node": "celebrations_coping",
+        "system": "You are a supportive AI assistant specialized in helping users navigate celebrations without alcohol. "
+                  "Provide ideas for alcohol-free events, non-alcoholic beverage options, and setting personal boundaries.",
+        "instruction": "The user appears to be concerned about drinking at celebrations. What alcohol-free celebration strategies would you suggest?",
+    },
+    TriggerType.LONELINESS: {
+        "node": "loneliness_coping",
+        "system": "You are a supportive AI assistant specialized in helping users cope with loneliness without alcohol. "
+                  "Provide strategies for social connection, volunteering opportunities, and meaningful solitary activities.",
+        "instruction": "The user appears to be drinking due to loneliness. What social connection strategies would you suggest?",
+    },
+    TriggerType.HABITUAL_PATTERNS: {
+        "node": "habitual_patterns_coping",
+        "system": "You are a supportive AI assistant specialized in helping users break habitual drinking patterns. "
+                  "Provide habit tracking methods, ideas for new rituals, and mindfulness techniques for habit disruption.",
+        "instruction": "The user appears to be drinking out of habit. What habit-breaking strategies would you suggest?",
+    },
+    # Default coping solution agent for unknown triggers
+    TriggerType.UNKNOWN: {
+        "node": "default_coping",
+        "system": "You are a supportive AI assistant helping users who are drinking or considering drinking alcohol. "
+                  "Provide compassionate, practical coping strategies and alternatives to drinking.",
+        "instruction": "The user appears to be drinking. What coping strategies would you suggest?",
+    },
+}
+
+# Graph node name for each trigger's coping agent
+COPING_NODES = {trigger: definition["node"] for trigger, definition in COPING_AGENTS.items()}
+
+# Prompt overrides, reloaded when the file changes (checked at most every COPING_AGENTS_RELOAD_S),
+# e.g. {"stress": {"system": "...", "instruction": "...", "temperature": 0.5, "tier": "fast"}}
+COPING_AGENTS_PATH = os.getenv("COPING_AGENTS_PATH")
+COPING_AGENTS_RELOAD_S = float(os.getenv("COPING_AGENTS_RELOAD_S", "5"))
+COPING_OVERRIDE_FIELDS = {"system", "instruction", "temperature", "tier"}
+
+_coping_definitions = {"version": 0, "agents": COPING_AGENTS, "mtime": None, "checked_at": 0.0}
+_coping_definitions_lock = threading.Lock()
+
+def load_coping_overrides(path: str) -> Dict[TriggerType, Dict[str, Any]]:
+    """Read and validate a coping prompt override file"""
+    with open(path) as f:
+        overrides = json.load(f)
+    if not isinstance(overrides, dict):
+        raise ValueError("Coping agent overrides must be an object keyed by trigger type")
+    parsed = {}
+    for trigger, fields in overrides.items():
+        if not isinstance(fields, dict) or not set(fields) <= COPING_OVERRIDE_FIELDS:
+            raise ValueError(f"Overrides for {trigger} must be an object with keys from {sorted(COPING_OVERRIDE_FIELDS)}")
+        parsed[TriggerType(trigger)] = fields
+    return parsed
+
+def get_coping_definitions() -> Tuple[int, Dict[TriggerType, Dict[str, Any]]]:
+    """``(version, definitions)`` of the coping agents, reloading the override file if it changed.
+
+    A file that fails to load is counted in ``coping_agents_reload_failures_total``
+    and the previous definitions stay in use.
+    """
+    current = _coping_definitions
+    now = time.monotonic()
+    if not COPING_AGENTS_PATH or now - current["checked_at"] < COPING_AGENTS_RELOAD_S:
+        return current["version"], current["agents"]
+    with _coping_definitions_lock:
+        current["checked_at"] = now
+        try:
+            mtime = os.stat(COPING_AGENTS_PATH).st_mtime_ns
+            if mtime != current["mtime"]:
+                overrides = load_coping_overrides(COPING_AGENTS_PATH)
+                current["agents"] = {trigger: {**definition, **overrides.get(trigger, {})}
+                                     for trigger, definition in COPING_AGENTS.items()}
+                current["mtime"] = mtime
+                current["version"] += 1
+        except (OSError, ValueError) as e:
+            metrics.increment("coping_agents_reload_failures_total", {"error": type(e).__name__})
+        return current["version"], current["agents"]
+
+class CopingAgentRegistry:
+    """Coping agent node per trigger type; each chain (and model client) is built on first use
+    and rebuilt when the definitions are reloaded."""
+
+    def __init__(self):
+        self._chains: Dict[TriggerType, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+
+    def chain(self, trigger: TriggerType):
+        version, definitions = get_coping_definitions()
+        cached = self._chains.get(trigger)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._lock:
+            cached = self._chains.get(trigger)
+            if cached is None or cached[0] != version:
+                cached = self._chains[trigger] = (version, self._build(definitions[trigger]))
+            return cached[1]
+
+    def _build(self, definition: Dict[str, Any]):
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", definition["system"]),
+            MessagesPlaceholder(variable_name="messages"),
+            ("human", definition["instruction"])
+        ])
+        config = NODE_MODEL_CONFIG["coping"]
+        model = get_azure_chat_model(temperature=definition.get("temperature", config.get("temperature", 0)),
+                                     tier=definition.get("tier", config.get("tier", LARGE_TIER)))
+        return prompt | model
+
+    def agent(self, trigger: TriggerType) -> Callable[[AgentState], AgentState]:
+        node = COPING_NODES[trigger]
+
+        def coping_agent(state: AgentState) -> AgentState:
+            response = invoke_chain(node, self.chain(trigger), state, COPING_FALLBACK)
+            state["messages"].append(response)
+            state["next_step"] = "end"
+            return state
+
+        return coping_agent
+
+def create_coping_agents(registry: Optional[CopingAgentRegistry] = None) -> Dict[TriggerType, Callable[[AgentState], AgentState]]:
+    """The coping agent node for every trigger type (chains are built when a node first runs)"""
+    registry = registry or CopingAgentRegistry()
+    return {trigger: registry.agent(trigger) for trigger in COPING_AGENTS}
+
+# Speculative execution: while the classification nodes run, the coping agent for
+# the user's most common trigger starts in the background on the same messages.
+# The coping node commits its reply if the identified trigger matches, otherwise
+# it is discarded. Enable with WORKFLOW_SPECULATIVE=true or run_workflow(speculative=True).
+WORKFLOW_SPECULATIVE = os.getenv("WORKFLOW_SPECULATIVE", "false").lower() == "true"
+WORKFLOW_SPECULATION_WORKERS = int(os.getenv("WORKFLOW_SPECULATION_WORKERS", "8"))
+
+_speculation_executor = None
+_speculations: Dict[str, "Speculation"] = {}
+_speculation_stats = {"attempts": 0, "hits": 0, "misses": 0, "latency_saved_s": 0.0, "wasted_cost_usd": 0.0}
+_speculation_lock = threading.Lock()
+
+class Speculation:
+    """A coping agent run started before the trigger was known"""
+
+    def __init__(self, trigger: TriggerType, node_fn: Callable[[AgentState], AgentState], messages: List[BaseMessage]):
+        self.trigger = trigger
+        self.state = {"messages": list(messages), "next_step": "", "node_metrics": []}
+        self.started = time.perf_counter()
+        self.finished = None
+        self.settled = False
+        self.future = get_speculation_executor().submit(contextvars.copy_context().run, self._run, node_fn)
+
+    def _run(self, node_fn):
+        try:
+            with span("graph.speculation", self.trigger.value):
+                return node_fn(self.state)
+        finally:
+            self.finished = time.perf_counter()
+
+    def commit(self) -> Optional[AgentState]:
+        """Wait for the speculative run and return its state, or None if it failed"""
+        reached = time.perf_counter()
+        try:
+            state = self.future.result()
+        except Exception:
+            self.discard()
+            return None
+        # Time the reply was already in flight before the graph needed it
+        saved = min(self.finished - self.started, reached - self.started)
+        with _speculation_lock:
+            self.settled = True
+            _speculation_stats["hits"] += 1
+            _speculation_stats["latency_saved_s"] += saved
         return state
-    
-    return habitual_patterns_agent
 
-# Default coping solution agent for unknown triggers
-def create_default_coping_agent():
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a supportive AI assistant helping users who are drinking or considering drinking alcohol. "
-                  "Provide compassionate, practical coping strategies and alternatives to drinking."),
-        MessagesPlaceholder(variable_name="messages"),
-        ("human", "The user appears to be drinking. What coping strategies would you suggest?")
-    ])
-    
-    model = get_azure_chat_model(temperature=0.7)
-    chain = prompt | model
-    
-    def default_coping_agent(state: AgentState) -> AgentState:
-        response = chain.invoke({"messages": state["messages"]})
-        state["messages"].append(response)
-        state["next_step"] = "end"
-        return state
-    
-    return default_coping_agent
+    def discard(self):
+        """Cancel the run if it has not started; otherwise its reply is ignored"""
+        with _speculation_lock:
+            if self.settled:
+                return
+            self.settled = True
+            _speculation_stats["misses"] += 1
+        if not self.future.cancel():
+            # Still running or finished: its cost is wasted once the run ends
+            self.future.add_done_callback(self._add_wasted_cost)
+
+    def _add_wasted_cost(self, future):
+        wasted = sum(m["cost_usd"] for m in self.state["node_metrics"])
+        with _speculation_lock:
+            _speculation_stats["wasted_cost_usd"] += wasted
+
+def get_speculation_executor() -> ThreadPoolExecutor:
+    global _speculation_executor
+    if _speculation_executor is None:
+        with _speculation_lock:
+            if _speculation_executor is None:
+                _speculation_executor = ThreadPoolExecutor(
+                    max_workers=WORKFLOW_SPECULATION_WORKERS, thread_name_prefix="speculation")
+    return _speculation_executor
+
+def guess_trigger(memory: Dict[str, Any]) -> Optional[TriggerType]:
+    """Most likely trigger for this user, from the common triggers kept in memory"""
+    common_triggers = (memory or {}).get("common_triggers") or []
+    try:
+        return TriggerType(common_triggers[0]) if common_triggers else None
+    except ValueError:
+        return None
+
+def start_speculation(speculation_id: str, trigger: TriggerType, node_fn, messages: List[BaseMessage]):
+    with _speculation_lock:
+        _speculation_stats["attempts"] += 1
+    _speculations[speculation_id] = Speculation(trigger, node_fn, messages)
+
+def finish_speculation(speculation_id: str):
+    """Discard the speculation if the graph never committed it (miss or not drinking)"""
+    speculation = _speculations.pop(speculation_id, None)
+    if speculation is not None:
+        speculation.discard()
+
+def with_speculation(trigger: TriggerType, node_fn: Callable[[AgentState], AgentState]):
+    """Wrap a coping node so it commits a matching speculative reply instead of calling the model"""
+    def coping_node(state: AgentState, config: Dict[str, Any]) -> AgentState:
+        speculation_id = config.get("configurable", {}).get("speculation_id")
+        speculation = _speculations.get(speculation_id) if speculation_id else None
+        if speculation is not None and speculation.trigger == trigger:
+            speculative_state = speculation.commit()
+            if speculative_state is not None:
+                state["messages"].append(speculative_state["messages"][-1])
+                state.setdefault("node_metrics", []).extend(speculative_state["node_metrics"])
+                state["next_step"] = "end"
+                return state
+        elif speculation is not None:
+            speculation.discard()
+        return node_fn(state)
+
+    return coping_node
+
+def get_speculation_stats() -> Dict[str, Any]:
+    """Speculation hit rate, latency saved and cost of discarded replies"""
+    with _speculation_lock:
+        stats = dict(_speculation_stats)
+    settled = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / settled if settled else 0.0
+    return stats
 
 # Function to determine next step based on drinking status
 def get_next_step(state: AgentState) -> str:
@@ -323,26 +532,19 @@ def get_next_step(state: AgentState) -> str:
         return "identify_trigger"
     return "if not drink"
 
-# Updated function to route to appropriate coping agent based on trigger type
+# Route to the coping agent of the identified trigger type
 def get_coping_strategy(state: AgentState) -> str:
-    if state["trigger_type"] == TriggerType.STRESS:
-        return "stress_coping"
-    elif state["trigger_type"] == TriggerType.SOCIAL_PRESSURE:
-        return "social_pressure_coping"
-    elif state["trigger_type"] == TriggerType.BOREDOM:
-        return "boredom_coping"
-    elif state["trigger_type"] == TriggerType.NEGATIVE_EMOTIONS:
-        return "negative_emotions_coping"
-    elif state["trigger_type"] == TriggerType.FATIGUE:
-        return "fatigue_coping"
-    elif state["trigger_type"] == TriggerType.CELEBRATIONS:
-        return "celebrations_coping"
-    elif state["trigger_type"] == TriggerType.LONELINESS:
-        return "loneliness_coping"
-    elif state["trigger_type"] == TriggerType.HABITUAL_PATTERNS:
-        return "habitual_patterns_coping"
-    else:
-        return "default_coping"
+    return COPING_NODES.get(state["trigger_type"], COPING_NODES[TriggerType.UNKNOWN])
+
+def traced_node(name: str, node_fn: Callable):
+    """Wrap a graph node in a ``graph.node`` span, passing the run config through if the node takes it"""
+    takes_config = "config" in inspect.signature(node_fn).parameters
+
+    def node(state: AgentState, config: Dict[str, Any]) -> AgentState:
+        with span("graph.node", name):
+            return node_fn(state, config) if takes_config else node_fn(state)
+
+    return node
 
 # Router node that updates state and returns next step
 def router(state: AgentState) -> AgentState:
@@ -350,28 +552,24 @@ def router(state: AgentState) -> AgentState:
     return state
 
 # Create the workflow graph (uncompiled version)
-def create_workflow() -> StateGraph:
+def create_workflow(coping_agents: Optional[Dict[TriggerType, Callable]] = None) -> StateGraph:
+    if coping_agents is None:
+        coping_agents = create_coping_agents()
+
     # Initialize workflow graph
     workflow = StateGraph(AgentState)
     
-    # Add nodes
-    workflow.add_node("core_agent", create_core_agent())
-    workflow.add_node("router", router)
-    workflow.add_node("trigger_identification", create_trigger_identification_agent())
-    
-    # Add specialized coping strategy nodes
-    workflow.add_node("stress_coping", create_stress_coping_agent())
-    workflow.add_node("social_pressure_coping", create_social_pressure_coping_agent())
-    workflow.add_node("boredom_coping", create_boredom_coping_agent())
+    # Add nodes (each one traced)
+    workflow.add_node("core_agent", traced_node("core_agent", create_core_agent()))
+    workflow.add_node("router", traced_node("router", router))
+    workflow.add_node("trigger_identification",
+                      traced_node("trigger_identification", create_trigger_identification_agent()))
     
-    # Add the missing coping strategy nodes for other trigger types
-    workflow.add_node("negative_emotions_coping", create_negative_emotions_coping_agent())
-    workflow.add_node("fatigue_coping", create_fatigue_coping_agent())
-    workflow.add_node("celebrations_coping", create_celebrations_coping_agent())
-    workflow.add_node("loneliness_coping", create_loneliness_coping_agent())
-    workflow.add_node("habitual_patterns_coping", create_habitual_patterns_coping_agent())
+    # Add specialized coping strategy nodes (committing speculative replies when enabled)
+    for trigger, node_fn in coping_agents.items():
+        node = COPING_NODES[trigger]
+        workflow.add_node(node, traced_node(node, with_speculation(trigger, node_fn)))
     
-    workflow.add_node("default_coping", create_default_coping_agent())
     workflow.add_node("end_conversation", lambda x: x)
     
     # Add edges
@@ -392,38 +590,106 @@ def create_workflow() -> StateGraph:
     workflow.add_conditional_edges(
         "trigger_identification",
         get_coping_strategy,
-        {
-            "stress_coping": "stress_coping",
-            "social_pressure_coping": "social_pressure_coping",
-            "boredom_coping": "boredom_coping",
-            "negative_emotions_coping": "negative_emotions_coping",
-            "fatigue_coping": "fatigue_coping",
-            "celebrations_coping": "celebrations_coping",
-            "loneliness_coping": "loneliness_coping",
-            "habitual_patterns_coping": "habitual_patterns_coping",
-            "default_coping": "default_coping"
-        }
+        {node: node for node in COPING_NODES.values()}
     )
     
     # Add edges from all coping strategies to end
-    workflow.add_edge("stress_coping", "end_conversation")
-    workflow.add_edge("social_pressure_coping", "end_conversation")
-    workflow.add_edge("boredom_coping", "end_conversation")
-    workflow.add_edge("negative_emotions_coping", "end_conversation")
-    workflow.add_edge("fatigue_coping", "end_conversation")
-    workflow.add_edge("celebrations_coping", "end_conversation")
-    workflow.add_edge("loneliness_coping", "end_conversation")
-    workflow.add_edge("habitual_patterns_coping", "end_conversation")
-    workflow.add_edge("default_coping", "end_conversation")
+    for node in COPING_NODES.values():
+        workflow.add_edge(node, "end_conversation")
     
     # Set the final node
     workflow.set_finish_point("end_conversation")
     
     return workflow  # Return uncompiled workflow
 
+# Warm pool: compiled graphs, with their model clients, are kept per process and
+# reused across runs (LangGraph graphs are safe to invoke concurrently). Graphs are
+# taken round robin and rebuilt after WORKFLOW_POOL_MAX_AGE_S, so the router's
+# deployment choices stay current.
+WORKFLOW_POOL_SIZE = int(os.getenv("WORKFLOW_POOL_SIZE", "2"))
+WORKFLOW_POOL_MAX_AGE_S = float(os.getenv("WORKFLOW_POOL_MAX_AGE_S", "300"))
+
+class WarmWorkflow:
+    """A compiled graph and the coping agents it was built with"""
+
+    def __init__(self):
+        self.coping_agents = create_coping_agents()
+        self.graph = create_workflow(self.coping_agents).compile()
+        self.built_at = time.monotonic()
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.built_at > WORKFLOW_POOL_MAX_AGE_S
+
+_workflow_pool: List[Optional[WarmWorkflow]] = []
+_workflow_pool_next = 0
+_workflow_pool_lock = threading.Lock()
+
+def _reset_workflow_pool():
+    # Model clients hold sockets that must not be shared with a forked child
+    global _workflow_pool, _workflow_pool_lock
+    _workflow_pool = []
+    _workflow_pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_workflow_pool)
+
+def get_warm_workflow() -> WarmWorkflow:
+    """Next graph of the warm pool, built on first use and rebuilt when expired"""
+    global _workflow_pool_next
+    with _workflow_pool_lock:
+        if not _workflow_pool:
+            _workflow_pool.extend([None] * max(1, WORKFLOW_POOL_SIZE))
+        index = _workflow_pool_next % len(_workflow_pool)
+        _workflow_pool_next += 1
+        warm = _workflow_pool[index]
+    if warm is None or warm.expired():
+        # Built outside the lock; if two runs rebuild the same slot, the last one is kept
+        warm = WarmWorkflow()
+        with _workflow_pool_lock:
+            _workflow_pool[index] = warm
+    return warm
+
+def warm_workflow_pool():
+    """Build every graph of the pool ahead of the first run"""
+    for _ in range(max(1, WORKFLOW_POOL_SIZE)):
+        get_warm_workflow()
+
 # Function to run the workflow with memory persistence
-def run_workflow(messages: List[BaseMessage], user_id: str, thread_id: str = None) -> Dict:
-    from langgraph.checkpoint.memory import MemorySaver
+def run_workflow(messages: List[BaseMessage], user_id: str, thread_id: str = None,
+                 speculative: Optional[bool] = None) -> Dict:
+    with span("workflow.run", "run_workflow", **{"payload.request_bytes": payload_size(messages)}):
+        warm = get_warm_workflow()
+        initial_state, config, speculation_id = _start_run(warm, messages, user_id, thread_id, speculative)
+        try:
+            result = warm.graph.invoke(initial_state, config=config)
+        finally:
+            if speculation_id is not None:
+                finish_speculation(speculation_id)
+
+        # Only write to MongoDB at the end
+        store_agent_memory(user_id, result["memory"])
+        return result
+
+async def arun_workflow(messages: List[BaseMessage], user_id: str, thread_id: str = None,
+                        speculative: Optional[bool] = None) -> Dict:
+    """``run_workflow`` for an event loop: the graph runs with ``ainvoke`` and
+    the memory reads and writes on worker threads, so many runs share one loop."""
+    with span("workflow.run", "arun_workflow", **{"payload.request_bytes": payload_size(messages)}):
+        warm = await asyncio.to_thread(get_warm_workflow)
+        initial_state, config, speculation_id = await asyncio.to_thread(
+            _start_run, warm, messages, user_id, thread_id, speculative)
+        try:
+            result = await warm.graph.ainvoke(initial_state, config=config)
+        finally:
+            if speculation_id is not None:
+                finish_speculation(speculation_id)
+
+        await asyncio.to_thread(store_agent_memory, user_id, result["memory"])
+        return result
+
+def _start_run(warm: WarmWorkflow, messages: List[BaseMessage], user_id: str, thread_id: Optional[str],
+               speculative: Optional[bool]) -> Tuple[Dict, Dict, Optional[str]]:
+    """Initial state and run config, starting the speculative coping run if enabled"""
+    import uuid
 
     # Only read from MongoDB at the start
     latest_memory = get_latest_agent_memory(user_id)
@@ -434,29 +700,27 @@ def run_workflow(messages: List[BaseMessage], user_id: str, thread_id: str = Non
         "next_step": "core_agent",
         "drinking_status": None,
         "trigger_type": None,
-        "memory": latest_memory  # hydrate from DB
+        "memory": latest_memory,  # hydrate from DB
+        "node_metrics": []
     }
 
     # Generate a default thread_id if none is provided
     if thread_id is None:
-        import uuid
         thread_id = str(uuid.uuid4())
 
-    # Configure the thread_id for the checkpointer
+    # The thread_id identifies the run; state is not checkpointed across runs
+    # (memory is carried over through the agent_memory collection)
     config = {"configurable": {"thread_id": thread_id}}
 
-    # Create the uncompiled workflow
-    workflow = create_workflow()
-    memory_saver = MemorySaver()
-    app = workflow.compile(checkpointer=memory_saver)
-
-    # Run the workflow (all memory updates are in-memory for this session)
-    result = app.invoke(initial_state, config=config)
-
-    # Only write to MongoDB at the end
-    store_agent_memory(user_id, result["memory"])
+    # Start the likely coping agent alongside classification for returning users
+    speculation_id = None
+    guess = guess_trigger(latest_memory)
+    if (WORKFLOW_SPECULATIVE if speculative is None else speculative) and guess is not None:
+        speculation_id = str(uuid.uuid4())
+        start_speculation(speculation_id, guess, warm.coping_agents[guess], messages)
+        config["configurable"]["speculation_id"] = speculation_id
 
-    return result
+    return initial_state, config, speculation_id
 
 def display_workflow_flowchart():
     """
@@ -515,8 +779,8 @@ def display_workflow_flowchart():
 
 def insert_test_user(user_id: str, name: str = "Test User", email: str = "test@example.com"):
     """Insert a test user into the users collection if not already present."""
-    users_collection = db["users"]
-    if users_collection.find_one({"user_id": user_id}):
+    users = get_repositories().users
+    if users.get(user_id):
         print(f"User {user_id} already exists.")
         return
     user_profile = {
@@ -525,11 +789,12 @@ def insert_test_user(user_id: str, name: str = "Test User", email: str = "test@e
         "email": email,
         "created_at": datetime.datetime.now()
     }
-    users_collection.insert_one(user_profile)
+    users.create(user_profile)
     print(f"Inserted test user: {user_id}")
 
 def print_db_structure():
     """Print the collections and a sample document from each collection in the current MongoDB database."""
+    db = get_db()
     print(f"Database: {db.name}")
     collections = db.list_collection_names()
     print("Collections:", collections)
@@ -0,0 +1,430 @@
+"""Load balancing and request hedging across Azure OpenAI deployments.
+
+Deployments are configured with ``AZURE_DEPLOYMENTS``, a JSON list such as::
+
+    [{"name": "eastus", "deployment": "gpt4", "endpoint": "https://a.openai.azure.com/", "api_key": "..."},
+     {"name": "westus", "deployment": "gpt4", "endpoint": "https://b.openai.azure.com/", "api_key": "..."}]
+
+Entries may also set ``"tier"`` (``"large"`` by default, ``"fast"`` for a
+small model used by classification steps, or ``"embedding"``) and per-1K-token
+prices. Without ``AZURE_DEPLOYMENTS`` a large deployment is built from
+``GPT4_DEPLOYMENT`` / ``AZURE_ENDPOINT`` / ``AZURE_API_KEY``, plus a fast one
+from ``GPT_FAST_DEPLOYMENT`` and an embedding one from ``EMBEDDING_DEPLOYMENT``
+when set. Each request goes to the deployment of the
+requested tier with the best observed latency and remaining quota
+(power-of-two-choices), and every attempt takes a slot from the LLM
+scheduler (``llm_scheduler.py``) and runs through that deployment's
+resilience guard.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from llm_scheduler import SchedulerRejectedError, get_scheduler
+from resilience import LLMUnavailableError, guarded_call, is_retryable
+from tracing import metrics, payload_size, span
+from usage import record_usage
+
+API_VERSION = os.getenv("API_VERSION")
+
+# Hedging configuration
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "0.5"))
+LLM_HEDGE_DEFAULT_DELAY_S = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_S", "3"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+
+# Model tiers
+LARGE_TIER = "large"
+FAST_TIER = "fast"
+EMBEDDING_TIER = "embedding"
+
+# Default USD prices per 1K (prompt, completion) tokens, overridable per deployment
+TIER_PRICING = {
+    LARGE_TIER: (float(os.getenv("LLM_LARGE_PROMPT_PRICE_PER_1K", "0.01")),
+                 float(os.getenv("LLM_LARGE_COMPLETION_PRICE_PER_1K", "0.03"))),
+    FAST_TIER: (float(os.getenv("LLM_FAST_PROMPT_PRICE_PER_1K", "0.00015")),
+                float(os.getenv("LLM_FAST_COMPLETION_PRICE_PER_1K", "0.0006"))),
+    EMBEDDING_TIER: (float(os.getenv("LLM_EMBEDDING_PRICE_PER_1K", "0.0001")), 0.0),
+}
+
+# Deployments reporting fewer remaining requests or tokens than this are deprioritised
+LOW_QUOTA_REQUESTS = 5
+LOW_QUOTA_TOKENS = 4000  # a couple of calls (prompt plus up to 1000 completion tokens)
+LATENCY_WINDOW = 200
+EWMA_ALPHA = 0.2
+
+
+class HedgeCancelledError(LLMUnavailableError):
+    """A hedged request was not sent because the other one already answered"""
+
+
+class Deployment:
+    """One model deployment on one endpoint, with its observed latency and quota"""
+
+    def __init__(self, name, deployment, endpoint=None, api_key=None, api_version=None, client=None,
+                 tier=LARGE_TIER, prompt_price_per_1k=None, completion_price_per_1k=None):
+        self.name = name
+        self.deployment = deployment
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.api_version = api_version or API_VERSION
+        self.tier = tier
+        default_prompt_price, default_completion_price = TIER_PRICING.get(tier, TIER_PRICING[LARGE_TIER])
+        self.prompt_price_per_1k = default_prompt_price if prompt_price_per_1k is None else prompt_price_per_1k
+        self.completion_price_per_1k = (default_completion_price if completion_price_per_1k is None
+                                        else completion_price_per_1k)
+        self.ewma_latency = None
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.in_flight = 0
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """AzureOpenAI client for this endpoint, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from openai import AzureOpenAI
+
+                    from cassettes import http_client
+                    # Retries are handled by the resilience layer, so the SDK's own are disabled.
+                    # With a cassette installed, requests are recorded or replayed (see cassettes.py)
+                    self._client = AzureOpenAI(
+                        api_version=self.api_version,
+                        azure_endpoint=self.endpoint,
+                        api_key=self.api_key,
+                        max_retries=0,
+                        http_client=http_client(),
+                    )
+        return self._client
+
+    def record_latency(self, seconds, failed_after=None):
+        """Add an attempt's latency; a failed attempt weighs in the EWMA as ``failed_after`` seconds"""
+        with self._lock:
+            self.latencies.append(seconds)
+            observed = seconds if failed_after is None else max(seconds, failed_after)
+            if self.ewma_latency is None:
+                self.ewma_latency = observed
+            else:
+                self.ewma_latency += EWMA_ALPHA * (observed - self.ewma_latency)
+
+    def observe_headers(self, headers):
+        """Track remaining quota from Azure's x-ratelimit-* response headers"""
+        requests_left = headers.get("x-ratelimit-remaining-requests")
+        tokens_left = headers.get("x-ratelimit-remaining-tokens")
+        with self._lock:
+            if requests_left is not None:
+                self.remaining_requests = int(requests_left)
+            if tokens_left is not None:
+                self.remaining_tokens = int(tokens_left)
+
+    def cost(self, prompt_tokens, completion_tokens):
+        """USD cost of a call with the given token counts"""
+        return (prompt_tokens * self.prompt_price_per_1k + completion_tokens * self.completion_price_per_1k) / 1000
+
+    def score(self):
+        """Lower is better: expected latency inflated by load and low quota"""
+        latency = self.ewma_latency if self.ewma_latency is not None else 0.0
+        score = (latency + 0.05) * (1 + self.in_flight)
+        if self.remaining_requests is not None and self.remaining_requests < LOW_QUOTA_REQUESTS:
+            score *= LOW_QUOTA_REQUESTS / (self.remaining_requests + 1) * 10
+        if self.remaining_tokens is not None and self.remaining_tokens < LOW_QUOTA_TOKENS:
+            score *= LOW_QUOTA_TOKENS / (self.remaining_tokens + 1) * 10
+        return score
+
+
+def load_deployments():
+    """Build the deployment list from AZURE_DEPLOYMENTS, or GPT4_DEPLOYMENT / GPT_FAST_DEPLOYMENT /
+    EMBEDDING_DEPLOYMENT"""
+    raw = os.getenv("AZURE_DEPLOYMENTS")
+    if raw:
+        return [
+            Deployment(
+                name=entry.get("name") or entry["deployment"],
+                deployment=entry["deployment"],
+                endpoint=entry.get("endpoint") or os.getenv("AZURE_ENDPOINT"),
+                api_key=entry.get("api_key") or os.getenv("AZURE_API_KEY"),
+                api_version=entry.get("api_version"),
+                tier=entry.get("tier", LARGE_TIER),
+                prompt_price_per_1k=entry.get("prompt_price_per_1k"),
+                completion_price_per_1k=entry.get("completion_price_per_1k"),
+            )
+            for entry in json.loads(raw)
+        ]
+    deployment = os.getenv("GPT4_DEPLOYMENT")
+    deployments = [Deployment(
+        name=deployment,
+        deployment=deployment,
+        endpoint=os.getenv("AZURE_ENDPOINT"),
+        api_key=os.getenv("AZURE_API_KEY"),
+    )]
+    fast_deployment = os.getenv("GPT_FAST_DEPLOYMENT")
+    if fast_deployment:
+        deployments.append(Deployment(
+            name=fast_deployment,
+            deployment=fast_deployment,
+            endpoint=os.getenv("AZURE_ENDPOINT"),
+            api_key=os.getenv("AZURE_API_KEY"),
+            tier=FAST_TIER,
+        ))
+    embedding_deployment = os.getenv("EMBEDDING_DEPLOYMENT")
+    if embedding_deployment:
+        deployments.append(Deployment(
+            name=embedding_deployment,
+            deployment=embedding_deployment,
+            endpoint=os.getenv("AZURE_ENDPOINT"),
+            api_key=os.getenv("AZURE_API_KEY"),
+            tier=EMBEDDING_TIER,
+        ))
+    return deployments
+
+
+class DeploymentRouter:
+    """Spreads calls over deployments and optionally hedges slow ones"""
+
+    def __init__(self, deployments):
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        self.deployments = list(deployments)
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.hedges_wasted = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def tier_deployments(self, tier=LARGE_TIER):
+        """Deployments of a tier; chat tiers without their own deployments use the large tier"""
+        deployments = [d for d in self.deployments if d.tier == tier]
+        if deployments or tier == EMBEDDING_TIER:
+            return deployments
+        if tier != LARGE_TIER:
+            return self.tier_deployments(LARGE_TIER)
+        return [d for d in self.deployments if d.tier != EMBEDDING_TIER]
+
+    def has_tier(self, tier):
+        """Whether a deployment of exactly this tier is configured"""
+        return any(d.tier == tier for d in self.deployments)
+
+    def choose(self, exclude=(), tier=LARGE_TIER):
+        """Pick a deployment of ``tier`` by power-of-two-choices on latency/load/quota score"""
+        candidates = [d for d in self.tier_deployments(tier) if d.name not in exclude]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if first.score() <= second.score() else second
+
+    def hedge_delay(self, tier=LARGE_TIER):
+        """p95 of recent latencies across the tier's deployments, used as the hedging delay"""
+        samples = sorted(s for d in self.tier_deployments(tier) for s in list(d.latencies))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY_S
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return max(LLM_HEDGE_MIN_DELAY_S, p95)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _attempt(self, deployment, fn, timeout):
+        with deployment._lock:
+            deployment.in_flight += 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            return fn(deployment, timeout)
+        except Exception as e:
+            failed = is_retryable(e)
+            raise
+        finally:
+            with deployment._lock:
+                deployment.in_flight -= 1
+            # A throttled, failing or timed out attempt weighs as its whole timeout in routing,
+            # so an unhealthy deployment does not look fast to choose()
+            deployment.record_latency(time.perf_counter() - start, failed_after=timeout if failed else None)
+
+    def get(self, name):
+        """Deployment by name, or None"""
+        return next((d for d in self.deployments if d.name == name), None)
+
+    def call_on(self, deployment, fn, fallback=None, cancelled=None):
+        """Run ``fn(deployment, timeout)`` on a specific deployment, recording its latency.
+
+        Once the ``cancelled`` event is set, no further attempt is sent and
+        ``HedgeCancelledError`` is raised instead.
+        """
+        def attempt(timeout):
+            if cancelled is not None and cancelled.is_set():
+                raise HedgeCancelledError(f"Hedged request to {deployment.name} no longer needed")
+            # A scheduler slot per attempt: rate-limit waits and retry backoff do not hold one
+            with get_scheduler().slot():
+                return self._attempt(deployment, fn, timeout)
+
+        try:
+            return guarded_call(deployment.name, attempt, fallback=fallback)
+        except SchedulerRejectedError:
+            if fallback is None:
+                raise
+            return fallback() if callable(fallback) else fallback
+
+    def call(self, fn, hedge=False, fallback=None, tier=LARGE_TIER):
+        """Run ``fn(deployment, timeout)`` on the best deployment of ``tier``.
+
+        With ``hedge=True`` and more than one such deployment, a duplicate request
+        is sent to a second deployment once the primary exceeds the p95
+        delay (or fails); the first successful answer wins. The other request
+        is not sent, nor retried, from then on; one already in flight cannot
+        be stopped, so it runs to the end (its tokens are still charged) and
+        its answer is discarded and counted in ``hedges_wasted``.
+        """
+        primary = self.choose(tier=tier)
+        if primary is None:
+            raise ValueError(f"No {tier} deployment is configured")
+        if not hedge or len(self.tier_deployments(tier)) < 2:
+            return self.call_on(primary, fn, fallback=fallback)
+
+        executor = self._get_executor()
+        cancelled = threading.Event()
+
+        def submit(deployment):
+            return executor.submit(contextvars.copy_context().run, self.call_on, deployment, fn,
+                                   cancelled=cancelled)
+
+        futures = {submit(primary): primary}
+        pending = set(futures)
+        deadline = time.monotonic() + self.hedge_delay(tier)
+        hedged = False
+        errors = []
+        while pending:
+            timeout = None if hedged else max(0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    cancelled.set()
+                    for loser in pending:
+                        if not loser.cancel():
+                            loser.add_done_callback(lambda loser: self._count_wasted(loser, tier))
+                    if futures[future] is not primary:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return future.result()
+                errors.append(future.exception())
+            if not hedged and (not done or not pending):
+                # Primary is slow or already failed: send the duplicate now
+                hedged = True
+                secondary = self.choose(exclude={primary.name}, tier=tier)
+                if secondary is not None:
+                    with self._lock:
+                        self.hedges_sent += 1
+                    future = submit(secondary)
+                    futures[future] = secondary
+                    pending.add(future)
+        if fallback is not None:
+            return fallback() if callable(fallback) else fallback
+        raise errors[-1]
+
+    def _count_wasted(self, loser, tier):
+        if loser.exception() is None:
+            with self._lock:
+                self.hedges_wasted += 1
+            metrics.increment("llm_hedges_wasted_total", {"tier": tier})
+
+    def chat_completion(self, messages, hedge=False, fallback=None, tier=LARGE_TIER, **kwargs):
+        """Chat completion content from the best deployment, tracking quota headers"""
+        def call(deployment, timeout):
+            with span("llm.call", deployment.name, **{
+                "llm.tier": deployment.tier,
+                "payload.request_bytes": payload_size(messages)
+            }) as llm_span:
+                raw = deployment.client.chat.completions.with_raw_response.create(
+                    messages=messages,
+                    model=deployment.deployment,
+                    timeout=timeout,
+                    **kwargs
+                )
+                deployment.observe_headers(raw.headers)
+                response = raw.parse()
+                content = response.choices[0].message.content
+                if response.usage is not None:
+                    usage = response.usage
+                    llm_span.set_tokens(usage.prompt_tokens, usage.completion_tokens)
+                    record_usage(usage.prompt_tokens, usage.completion_tokens,
+                                 deployment.cost(usage.prompt_tokens, usage.completion_tokens))
+                llm_span.set_attribute("payload.response_bytes", len((content or "").encode("utf-8")))
+                return content
+
+        return self.call(call, hedge=hedge, fallback=fallback, tier=tier)
+
+    def embeddings(self, texts):
+        """Embedding vectors for ``texts``, in order, from the embedding tier"""
+        def call(deployment, timeout):
+            with span("llm.embeddings", deployment.name, **{
+                "llm.tier": deployment.tier,
+                "payload.request_bytes": sum(len(text.encode("utf-8")) for text in texts)
+            }) as llm_span:
+                response = deployment.client.embeddings.create(
+                    input=texts,
+                    model=deployment.deployment,
+                    timeout=timeout
+                )
+                if response.usage is not None:
+                    llm_span.set_tokens(response.usage.prompt_tokens, 0)
+                    record_usage(response.usage.prompt_tokens, 0, deployment.cost(response.usage.prompt_tokens, 0))
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        return self.call(call, tier=EMBEDDING_TIER)
+
+    def stats(self):
+        """Per-deployment routing statistics"""
+        return {
+            "deployments": [
+                {
+                    "name": d.name,
+                    "deployment": d.deployment,
+                    "tier": d.tier,
+                    "ewma_latency_s": d.ewma_latency,
+                    "in_flight": d.in_flight,
+                    "remaining_requests": d.remaining_requests,
+                    "remaining_tokens": d.remaining_tokens,
+                }
+                for d in self.deployments
+            ],
+            "hedge_delay_s": self.hedge_delay(),
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "hedges_wasted": self.hedges_wasted,
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Process-wide router built from the environment on first use"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = DeploymentRouter(load_deployments())
+    return _router
+
+
+def set_router(router):
+    """Replace the process-wide router (tests and benchmarks use stub deployments)"""
+    global _router
+    with _router_lock:
+        _router = router
@@ -0,0 +1,226 @@
+"""Process-wide admission control for LLM calls.
+
+Every attempt of a model call takes one of ``LLM_MAX_CONCURRENCY`` slots
+(see ``DeploymentRouter.call_on``); rate-limit waits and retry backoff happen
+without one. When all slots are busy, calls wait in a queue per priority
+class:
+
+- ``critical``: relapse support, served first and alone allowed to use its
+  ``reserved`` slots, so it never waits behind a full house of other calls
+- ``interactive``: chat and daily logs (the default)
+- ``background``: ingestion, summaries and other batch work
+
+A freed slot goes to the highest class with waiters; within a class, users
+take turns (round robin over per-user queues), so one user's burst cannot
+starve the others. A call that waits longer than its class's queue budget,
+or finds its class's queue full, is shed with ``SchedulerRejectedError`` and
+answered with the caller's fallback. When a critical call has to queue,
+waiting background calls are shed at once.
+
+Callers set the class of the calls they make with ``llm_priority(...)``; it
+is carried in a context variable, so worker threads started with a copied
+context inherit it. Per-class defaults can be overridden with
+``LLM_PRIORITY_CLASSES``, e.g. ``{"interactive": {"budget_s": 5}}``.
+
+Metrics: ``llm_queue_depth`` and ``llm_slots_in_use`` gauges,
+``llm_queue_wait_seconds`` histograms and ``llm_shed_total`` counters, per class.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from resilience import LLMUnavailableError
+from tracing import metrics
+
+CRITICAL = "critical"
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+# Highest priority first. budget_s: longest queue wait; max_queue: waiting calls
+# before new ones are shed; reserved: slots only this class (and higher) may use
+PRIORITY_CLASSES = OrderedDict([
+    (CRITICAL, {"budget_s": 20.0, "max_queue": 1000, "reserved": 2}),
+    (INTERACTIVE, {"budget_s": 10.0, "max_queue": 200, "reserved": 0}),
+    (BACKGROUND, {"budget_s": 30.0, "max_queue": 50, "reserved": 0}),
+])
+for _priority, _overrides in json.loads(os.getenv("LLM_PRIORITY_CLASSES", "{}")).items():
+    PRIORITY_CLASSES[_priority].update(_overrides)
+
+_priority = contextvars.ContextVar("llm_priority", default=(INTERACTIVE, None))
+
+
+class SchedulerRejectedError(LLMUnavailableError):
+    """Raised when a call is shed by admission control"""
+
+
+@contextmanager
+def llm_priority(priority, user_id=None):
+    """Run LLM calls made in the block with ``priority``, queued fairly per ``user_id``"""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown LLM priority: {priority}")
+    token = _priority.set((priority, user_id))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "shed")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.shed = False
+
+
+class LLMScheduler:
+    """Slots for concurrent LLM calls, handed out by priority class and round robin over users"""
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, classes=PRIORITY_CLASSES):
+        self.max_concurrency = max_concurrency
+        self.classes = classes
+        self.ranks = list(classes)
+        self.in_flight = 0
+        self._queues = {priority: OrderedDict() for priority in classes}  # user_id -> deque of waiters
+        self._depth = {priority: 0 for priority in classes}
+        self._lock = threading.Lock()
+
+    def _can_start(self, priority):
+        # Slots reserved by higher classes are off limits to this one
+        reserved = sum(self.classes[p]["reserved"] for p in self.ranks[:self.ranks.index(priority)])
+        return self.in_flight < self.max_concurrency - reserved
+
+    def _waiting_at_or_above(self, priority):
+        return any(self._depth[p] for p in self.ranks[:self.ranks.index(priority) + 1])
+
+    def _publish(self, priority):
+        metrics.set_gauge("llm_queue_depth", {"priority": priority}, self._depth[priority])
+        metrics.set_gauge("llm_slots_in_use", {}, self.in_flight)
+
+    def _shed_queue(self, priority, reason):
+        for queue in self._queues[priority].values():
+            for waiter in queue:
+                waiter.shed = True
+                waiter.event.set()
+                metrics.increment("llm_shed_total", {"priority": priority, "reason": reason})
+        self._queues[priority].clear()
+        self._depth[priority] = 0
+        self._publish(priority)
+
+    def _remove(self, priority, user_id, waiter):
+        queue = self._queues[priority].get(user_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._depth[priority] -= 1
+            if not queue:
+                del self._queues[priority][user_id]
+
+    def _dispatch(self):
+        """Hand free slots to waiters: highest class first, users in turn within a class"""
+        for priority in self.ranks:
+            queues = self._queues[priority]
+            while queues and self._can_start(priority):
+                user_id, queue = next(iter(queues.items()))
+                waiter = queue.popleft()
+                self._depth[priority] -= 1
+                if queue:
+                    queues.move_to_end(user_id)
+                else:
+                    del queues[user_id]
+                waiter.granted = True
+                self.in_flight += 1
+                waiter.event.set()
+            self._publish(priority)
+
+    def acquire(self, priority=None, user_id=None):
+        """Take a slot, waiting up to the class's queue budget; raises SchedulerRejectedError if shed"""
+        if priority is None:
+            priority, user_id = current_priority()
+        config = self.classes[priority]
+        with self._lock:
+            if self._can_start(priority) and not self._waiting_at_or_above(priority):
+                self.in_flight += 1
+                self._publish(priority)
+                metrics.histogram("llm_queue_wait_seconds", {"priority": priority}).observe(0.0)
+                return
+            if self._depth[priority] >= config["max_queue"]:
+                metrics.increment("llm_shed_total", {"priority": priority, "reason": "queue_full"})
+                raise SchedulerRejectedError(f"LLM queue for {priority} calls is full")
+            if priority == CRITICAL:
+                # Saturated with relapse support waiting: batch work gives way
+                self._shed_queue(BACKGROUND, "preempted")
+            waiter = _Waiter()
+            self._queues[priority].setdefault(user_id, deque()).append(waiter)
+            self._depth[priority] += 1
+            self._publish(priority)
+
+        start = time.perf_counter()
+        waiter.event.wait(config["budget_s"])
+        waited = time.perf_counter() - start
+        metrics.histogram("llm_queue_wait_seconds", {"priority": priority}).observe(waited)
+        with self._lock:
+            if waiter.granted:
+                return
+            if not waiter.shed:
+                self._remove(priority, user_id, waiter)
+                self._publish(priority)
+                metrics.increment("llm_shed_total", {"priority": priority, "reason": "budget"})
+        raise SchedulerRejectedError(f"LLM call ({priority}) shed after waiting {waited:.1f}s")
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority=None, user_id=None):
+        self.acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "max_concurrency": self.max_concurrency,
+                    "queued": dict(self._depth)}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _scheduler, _scheduler_lock
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    """Replace the process-wide scheduler (tests and benchmarks)"""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
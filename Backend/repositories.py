@@ -0,0 +1,766 @@
+"""Data-access layer for users, daily logs, conversations, milestones,
+notifications, relapse support, agent memory, conversation summaries,
+idempotency keys and the stub index of archived logs.
+
+Every query shape used by the handlers and the LangGraph workflow is a
+method here, with two backends:
+
+- ``MongoRepositories``: the production collections (through ``database.py``)
+- ``InMemoryRepositories``: dict-indexed tables in process memory, for tests,
+  benchmarks and single-node development
+
+``DATA_BACKEND`` (``mongo`` by default, or ``memory``) selects the backend
+used by ``get_repositories()``; ``set_repositories()`` swaps it at runtime.
+Conversation messages share the ``daily_logs`` collection with daily logs,
+as they always have.
+
+Inserts made inside ``repositories.unit_of_work()`` are queued and written
+when the block exits, with one ``insert_many`` per collection (in one
+multi-document transaction when ``MONGO_TRANSACTIONS`` is true, which needs
+a replica set). Reads inside the block do not see the queued writes, and
+nothing is written if the block raises.
+"""
+import contextvars
+import datetime
+import os
+import threading
+from contextlib import contextmanager
+
+from database import LazyCollection, get_db
+from tracing import count_round_trip
+
+DATA_BACKEND = os.getenv("DATA_BACKEND", "mongo")
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "false").lower() == "true"
+
+_unit_of_work = contextvars.ContextVar("unit_of_work", default=None)
+
+# Daily-log fields read by the analytics batch (analytics.py)
+LOG_ANALYTICS_FIELDS = ("user_id", "date", "alcohol_consumed", "meets_goal", "mood", "drink_reason")
+
+
+def record_time(document):
+    """When a daily_logs entry happened: a conversation message's timestamp or a daily log's date"""
+    return document.get("timestamp") if "is_user" in document else document.get("date")
+
+
+def record_key(document):
+    """Identity of a daily_logs entry, with or without its ``_id``"""
+    return document.get("_id") or document.get("log_id") or document.get("id") or record_time(document)
+
+
+def _dated(field, start, end):
+    condition = {"$exists": True}
+    if start is not None:
+        condition["$gte"] = start
+    if end is not None:
+        condition["$lt"] = end
+    return {field: condition}
+
+
+def _within(when, start, end):
+    return when is not None and (start is None or when >= start) and (end is None or when < end)
+
+
+class UnitOfWork:
+    """Inserts queued by repositories, grouped by collection in first-use order"""
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, collection, document):
+        self.pending.setdefault(collection, []).append(document)
+
+
+class Repositories:
+    """Base of the backend containers"""
+
+    @contextmanager
+    def unit_of_work(self, transaction=None):
+        """Queue the inserts made in the block and write them together on exit.
+
+        A nested block joins the outer one. ``transaction`` overrides
+        ``MONGO_TRANSACTIONS`` (ignored by the in-memory backend, whose
+        writes are always applied under one lock).
+        """
+        work = _unit_of_work.get()
+        if work is not None:
+            yield work
+            return
+        work = UnitOfWork()
+        token = _unit_of_work.set(work)
+        try:
+            yield work
+        finally:
+            _unit_of_work.reset(token)
+        if work.pending:
+            self.flush(work, MONGO_TRANSACTIONS if transaction is None else transaction)
+
+
+# MongoDB backend
+
+class MongoRepository:
+    collection_name = None
+
+    def __init__(self):
+        self.collection = LazyCollection(self.collection_name)
+
+    def _insert(self, document):
+        work = _unit_of_work.get()
+        if work is not None:
+            work.add(self.collection_name, document)
+        else:
+            self.collection.insert_one(document)
+
+
+class MongoUserRepository(MongoRepository):
+    collection_name = "users"
+
+    def create(self, user):
+        self._insert(user)
+
+    def get(self, user_id):
+        return self.collection.find_one({"user_id": user_id}, {"_id": 0})
+
+
+class MongoDailyLogRepository(MongoRepository):
+    collection_name = "daily_logs"
+
+    def create(self, log):
+        self._insert(log)
+
+    def last_log(self, user_id):
+        """The user's daily log with the latest date"""
+        return self.collection.find_one({"user_id": user_id}, {"_id": 0}, sort=[("date", -1)])
+
+    def recent_feedback(self, user_id, limit=10):
+        """Agent feedback of the first ``limit`` entries of the user's log collection"""
+        # remove the sort to avoid sorting by date temporarily
+        cursor = self.collection.find(
+            {"user_id": user_id},
+            {"_id": 0, "agent_feedback": 1, "date": 1}
+        ).limit(limit)
+        return [item for item in cursor if "agent_feedback" in item]
+
+    def for_users(self, user_ids, since):
+        """Analytics columns of the daily logs of ``user_ids`` dated ``since`` or later"""
+        return list(self.collection.find(
+            {"user_id": {"$in": list(user_ids)}, "log_id": {"$exists": True}, "date": {"$gte": since}},
+            {"_id": 0, **{field: 1 for field in LOG_ANALYTICS_FIELDS}}
+        ))
+
+    def active_users(self, since):
+        """Users with a daily log dated ``since`` or later"""
+        return self.collection.distinct("user_id", {"log_id": {"$exists": True}, "date": {"$gte": since}})
+
+    def between(self, user_id, start=None, end=None):
+        """The user's daily logs and messages dated in [start, end) (either bound may be None)"""
+        return list(self.collection.find(
+            {"user_id": user_id, "$or": [_dated("date", start, end),
+                                         {"is_user": {"$exists": True}, **_dated("timestamp", start, end)}]}
+        ))
+
+    def archivable_users(self, cutoff):
+        """Users with daily logs or messages dated before ``cutoff``"""
+        return self.collection.distinct("user_id", {"$or": [{"date": {"$lt": cutoff}}, {"timestamp": {"$lt": cutoff}}]})
+
+    def archivable(self, user_id, cutoff, messages_cutoff=None):
+        """The user's daily logs dated before ``cutoff`` and messages sent before ``messages_cutoff``"""
+        conditions = [{"is_user": {"$exists": False}, "date": {"$lt": cutoff}}]
+        if messages_cutoff is not None:
+            conditions.append({"is_user": {"$exists": True}, "timestamp": {"$lt": messages_cutoff}})
+        return list(self.collection.find({"user_id": user_id, "$or": conditions}))
+
+    def delete(self, documents):
+        """Remove entries returned by ``archivable`` once they are archived"""
+        if documents:
+            self.collection.delete_many({"_id": {"$in": [document["_id"] for document in documents]}})
+
+
+class MongoConversationRepository(MongoRepository):
+    collection_name = "daily_logs"
+
+    def __init__(self):
+        super().__init__()
+        self._indexed = False
+
+    def add(self, message):
+        self._insert(message)
+
+    def _filters(self, user_id, after=None):
+        # Conversation messages are the daily_logs entries with an is_user flag
+        filters = {"user_id": user_id, "is_user": {"$exists": True}}
+        if after is not None:
+            filters["timestamp"] = {"$gt": after}
+        return filters
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.collection.create_index([("user_id", 1), ("timestamp", 1)])
+            self._indexed = True
+
+    def since(self, user_id, after=None, limit=100):
+        """The user's oldest ``limit`` messages sent after ``after`` (all messages when None)"""
+        self._ensure_index()
+        return list(self.collection.find(self._filters(user_id, after), {"_id": 0})
+                    .sort([("timestamp", 1), ("_id", 1)]).limit(limit))
+
+    def recent(self, user_id, after=None, limit=10):
+        """The user's newest ``limit`` messages sent after ``after``, oldest first"""
+        self._ensure_index()
+        messages = list(self.collection.find(self._filters(user_id, after), {"_id": 0})
+                        .sort([("timestamp", -1), ("_id", -1)]).limit(limit))
+        messages.reverse()
+        return messages
+
+
+class MongoMilestoneRepository(MongoRepository):
+    collection_name = "motivations"
+
+    def create(self, milestone):
+        self._insert(milestone)
+
+    def list(self, user_id):
+        """The user's milestones, most recent first"""
+        return list(self.collection.find({"user_id": user_id}, {"_id": 0}).sort("achieved_at", -1))
+
+
+class MongoNotificationRepository(MongoRepository):
+    collection_name = "notifications"
+
+    def create(self, notification):
+        self._insert(notification)
+
+    def list(self, user_id):
+        """The user's notifications, most recent first"""
+        return list(self.collection.find({"user_id": user_id}, {"_id": 0}).sort("send_time_local", -1))
+
+
+class MongoRelapseSupportRepository(MongoRepository):
+    collection_name = "relapse_support"
+
+    def create(self, entry):
+        self._insert(entry)
+
+
+class MongoMemoryRepository(MongoRepository):
+    collection_name = "agent_memory"
+
+    def create(self, memory):
+        self._insert(memory)
+
+    def recent(self, user_id, limit=10):
+        """The user's memory entries, most recent first"""
+        return list(self.collection.find({"user_id": user_id}, {"_id": 0}).sort("timestamp", -1).limit(limit))
+
+    def latest(self, user_id):
+        """The user's most recently inserted memory entry"""
+        # Use _id, which is always indexed
+        return self.collection.find_one({"user_id": user_id}, {"_id": 0}, sort=[("_id", -1)])
+
+
+class MongoSummaryRepository(MongoRepository):
+    collection_name = "conversation_summaries"
+
+    def get(self, user_id):
+        return self.collection.find_one({"user_id": user_id}, {"_id": 0})
+
+    def save(self, summary):
+        """Create or update the user's summary (other fields, such as ``insights``, are kept)"""
+        self.collection.update_one({"user_id": summary["user_id"]}, {"$set": summary}, upsert=True)
+
+    def save_insights(self, insights):
+        """Store analytics (``{user_id: insights}``) on the users' summary documents in one bulk write"""
+        from pymongo import UpdateOne
+
+        if insights:
+            self.collection.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$set": {"user_id": user_id, "insights": doc}}, upsert=True)
+                for user_id, doc in insights.items()
+            ], ordered=False)
+
+
+class MongoArchiveRepository(MongoRepository):
+    """Stub index of archived daily_logs entries: one document per user and month (see archive.py)"""
+    collection_name = "log_archives"
+
+    def __init__(self):
+        super().__init__()
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.collection.create_index([("user_id", 1), ("month", 1)], unique=True)
+            self._indexed = True
+
+    def save(self, stub):
+        self._ensure_index()
+        self.collection.update_one({"user_id": stub["user_id"], "month": stub["month"]}, {"$set": stub}, upsert=True)
+
+    def for_user(self, user_id, start=None, end=None):
+        """The user's archive stubs overlapping [start, end), oldest month first"""
+        self._ensure_index()
+        filters = {"user_id": user_id}
+        if start is not None:
+            filters["last"] = {"$gte": start}
+        if end is not None:
+            filters["first"] = {"$lt": end}
+        return list(self.collection.find(filters, {"_id": 0}).sort("month", 1))
+
+
+class MongoIdempotencyRepository(MongoRepository):
+    """Responses of POST requests by idempotency key; a TTL index removes them at ``expires_at``"""
+    collection_name = "idempotency_keys"
+
+    def __init__(self):
+        super().__init__()
+        self._indexed = False
+
+    def _ensure_index(self):
+        if not self._indexed:
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+
+    def claim(self, record):
+        """Insert ``record`` (keyed by ``_id``) unless a live record has that key.
+
+        Returns None when the key was claimed, otherwise the existing record.
+        A record past its ``expires_at`` (a finished response past its TTL, or
+        the lease of a claim whose worker died) is taken over. Writes
+        immediately, outside any unit of work. ``expires_at`` is UTC, as the
+        TTL monitor expects.
+        """
+        from pymongo.errors import DuplicateKeyError
+
+        self._ensure_index()
+        try:
+            self.collection.insert_one(dict(record))
+            return None
+        except DuplicateKeyError:
+            pass
+        now = datetime.datetime.utcnow()
+        existing = self.get(record["_id"])
+        if existing is not None and existing["expires_at"] > now:
+            return existing
+        # Expired but not removed by the TTL monitor yet: take the key over
+        try:
+            self.collection.replace_one({"_id": record["_id"], "expires_at": {"$lte": now}}, dict(record), upsert=True)
+            return None
+        except DuplicateKeyError:
+            return self.get(record["_id"])
+
+    def get(self, key):
+        return self.collection.find_one({"_id": key})
+
+    def complete(self, key, response, expires_at):
+        """Store the response of the request holding ``key``, kept until ``expires_at`` (UTC)"""
+        self.collection.update_one({"_id": key}, {"$set": {"state": "completed", "response": response,
+                                                          "expires_at": expires_at}})
+
+    def release(self, key):
+        """Drop an unfinished claim so the request can be retried"""
+        self.collection.delete_one({"_id": key, "state": "in_flight"})
+
+
+class MongoRepositories(Repositories):
+    backend = "mongo"
+
+    def __init__(self):
+        self.users = MongoUserRepository()
+        self.daily_logs = MongoDailyLogRepository()
+        self.conversations = MongoConversationRepository()
+        self.milestones = MongoMilestoneRepository()
+        self.notifications = MongoNotificationRepository()
+        self.relapse_support = MongoRelapseSupportRepository()
+        self.memory = MongoMemoryRepository()
+        self.summaries = MongoSummaryRepository()
+        self.idempotency = MongoIdempotencyRepository()
+        self.archives = MongoArchiveRepository()
+
+    def flush(self, work, transaction):
+        if not transaction:
+            for name, documents in work.pending.items():
+                LazyCollection(name).insert_many(documents)
+            return
+
+        db = get_db()
+
+        def write(session):
+            for name, documents in work.pending.items():
+                count_round_trip()
+                db[name].insert_many(documents, session=session)
+
+        with db.client.start_session() as session:
+            session.with_transaction(write)
+            count_round_trip()  # commitTransaction
+
+
+# In-memory backend
+
+class MemoryTable:
+    """Rows of one collection in insertion order, indexed by user_id.
+
+    ``insert_one`` / ``insert_many`` mirror the pymongo calls, so seeding and
+    bulk tools can write to a table like to a collection. Each call counts as
+    one round trip, as the same call would against MongoDB.
+    """
+
+    def __init__(self, name, lock):
+        self.name = name
+        self.rows = []
+        self.by_user = {}
+        self._lock = lock
+        self._hooks = []
+
+    def on_insert(self, hook):
+        self._hooks.append(hook)
+
+    def insert_one(self, document):
+        self.insert_many([document])
+
+    def insert_many(self, documents, ordered=True):
+        count_round_trip()
+        with self._lock:
+            for document in documents:
+                row = {key: value for key, value in document.items() if key != "_id"}
+                self.rows.append(row)
+                self.by_user.setdefault(row.get("user_id"), []).append(row)
+                for hook in self._hooks:
+                    hook(row)
+
+    def for_user(self, user_id):
+        count_round_trip()
+        with self._lock:
+            return list(self.by_user.get(user_id, ()))
+
+    def delete_rows(self, user_id, predicate):
+        """Remove the user's rows matching ``predicate``; returns them"""
+        count_round_trip()
+        with self._lock:
+            rows = self.by_user.get(user_id, [])
+            removed = [row for row in rows if predicate(row)]
+            if removed:
+                doomed = {id(row) for row in removed}
+                self.by_user[user_id] = [row for row in rows if id(row) not in doomed]
+                self.rows = [row for row in self.rows if id(row) not in doomed]
+            return removed
+
+
+class InMemoryStore:
+    """A set of ``MemoryTable`` objects guarded by one lock"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tables = {}
+
+    def __getitem__(self, name):
+        with self.lock:
+            table = self.tables.get(name)
+            if table is None:
+                table = self.tables[name] = MemoryTable(name, self.lock)
+            return table
+
+
+def _newest_first(rows, key):
+    return sorted(rows, key=lambda row: (row.get(key) is not None, row.get(key) or 0), reverse=True)
+
+
+class MemoryRepository:
+    collection_name = None
+
+    def __init__(self, store):
+        self.table = store[self.collection_name]
+
+    def _insert(self, document):
+        work = _unit_of_work.get()
+        if work is not None:
+            work.add(self.collection_name, document)
+        else:
+            self.table.insert_one(document)
+
+
+class InMemoryUserRepository(MemoryRepository):
+    collection_name = "users"
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.by_id = {}
+        self.table.on_insert(lambda row: self.by_id.setdefault(row.get("user_id"), row))
+
+    def create(self, user):
+        self._insert(user)
+
+    def get(self, user_id):
+        count_round_trip()
+        row = self.by_id.get(user_id)
+        return dict(row) if row is not None else None
+
+
+class InMemoryDailyLogRepository(MemoryRepository):
+    collection_name = "daily_logs"
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.latest = {}
+        self.table.on_insert(self._index)
+
+    def _index(self, row):
+        if row.get("date") is None:
+            return
+        current = self.latest.get(row["user_id"])
+        if current is None or row["date"] >= current["date"]:
+            self.latest[row["user_id"]] = row
+
+    def create(self, log):
+        self._insert(log)
+
+    def last_log(self, user_id):
+        count_round_trip()
+        row = self.latest.get(user_id)
+        return dict(row) if row is not None else None
+
+    def recent_feedback(self, user_id, limit=10):
+        return [{key: row[key] for key in ("agent_feedback", "date") if key in row}
+                for row in self.table.for_user(user_id)[:limit] if "agent_feedback" in row]
+
+    def for_users(self, user_ids, since):
+        logs = []
+        for user_id in user_ids:
+            logs.extend({field: row[field] for field in LOG_ANALYTICS_FIELDS if field in row}
+                        for row in self.table.for_user(user_id)
+                        if "log_id" in row and row.get("date") is not None and row["date"] >= since)
+        return logs
+
+    def active_users(self, since):
+        count_round_trip()
+        return [user_id for user_id, row in list(self.latest.items()) if row["date"] >= since]
+
+    def between(self, user_id, start=None, end=None):
+        return [dict(row) for row in self.table.for_user(user_id) if _within(record_time(row), start, end)]
+
+    def archivable_users(self, cutoff):
+        count_round_trip()
+        with self.table._lock:
+            return [user_id for user_id, rows in self.table.by_user.items()
+                    if any((record_time(row) or cutoff) < cutoff for row in rows)]
+
+    def archivable(self, user_id, cutoff, messages_cutoff=None):
+        return [dict(row) for row in self.table.for_user(user_id) if self._archivable(row, cutoff, messages_cutoff)]
+
+    @staticmethod
+    def _archivable(row, cutoff, messages_cutoff):
+        if "is_user" in row:
+            return messages_cutoff is not None and _within(row.get("timestamp"), None, messages_cutoff)
+        return _within(row.get("date"), None, cutoff)
+
+    def delete(self, documents):
+        by_user = {}
+        for document in documents:
+            by_user.setdefault(document["user_id"], set()).add(record_key(document))
+        for user_id, keys in by_user.items():
+            self.table.delete_rows(user_id, lambda row: record_key(row) in keys)
+            with self.table._lock:
+                # The newest log may have been archived; index the newest remaining one
+                self.latest.pop(user_id, None)
+                for row in self.table.by_user.get(user_id, ()):
+                    self._index(row)
+
+
+class InMemoryConversationRepository(MemoryRepository):
+    collection_name = "daily_logs"
+
+    def add(self, message):
+        self._insert(message)
+
+    def _messages(self, user_id, after):
+        return [row for row in self.table.for_user(user_id)
+                if "is_user" in row and (after is None or row["timestamp"] > after)]
+
+    def since(self, user_id, after=None, limit=100):
+        messages = sorted(self._messages(user_id, after), key=lambda row: row["timestamp"])
+        return [dict(row) for row in messages[:limit]]
+
+    def recent(self, user_id, after=None, limit=10):
+        messages = sorted(self._messages(user_id, after), key=lambda row: row["timestamp"])
+        return [dict(row) for row in messages[-limit:]] if limit else []
+
+
+class InMemoryMilestoneRepository(MemoryRepository):
+    collection_name = "motivations"
+
+    def create(self, milestone):
+        self._insert(milestone)
+
+    def list(self, user_id):
+        return [dict(row) for row in _newest_first(self.table.for_user(user_id), "achieved_at")]
+
+
+class InMemoryNotificationRepository(MemoryRepository):
+    collection_name = "notifications"
+
+    def create(self, notification):
+        self._insert(notification)
+
+    def list(self, user_id):
+        return [dict(row) for row in _newest_first(self.table.for_user(user_id), "send_time_local")]
+
+
+class InMemoryRelapseSupportRepository(MemoryRepository):
+    collection_name = "relapse_support"
+
+    def create(self, entry):
+        self._insert(entry)
+
+
+class InMemoryMemoryRepository(MemoryRepository):
+    collection_name = "agent_memory"
+
+    def create(self, memory):
+        self._insert(memory)
+
+    def recent(self, user_id, limit=10):
+        return [dict(row) for row in _newest_first(self.table.for_user(user_id), "timestamp")[:limit]]
+
+    def latest(self, user_id):
+        rows = self.table.for_user(user_id)
+        return dict(rows[-1]) if rows else None
+
+
+class InMemorySummaryRepository(MemoryRepository):
+    collection_name = "conversation_summaries"
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.by_user = {}
+
+    def get(self, user_id):
+        count_round_trip()
+        summary = self.by_user.get(user_id)
+        return dict(summary) if summary is not None else None
+
+    def save(self, summary):
+        count_round_trip()
+        self.by_user[summary["user_id"]] = {**self.by_user.get(summary["user_id"], {}), **summary}
+
+    def save_insights(self, insights):
+        if insights:
+            count_round_trip()
+        for user_id, doc in insights.items():
+            self.by_user[user_id] = {**self.by_user.get(user_id, {"user_id": user_id}), "insights": doc}
+
+
+class InMemoryArchiveRepository(MemoryRepository):
+    collection_name = "log_archives"
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.by_user = {}
+        self._lock = store.lock
+
+    def save(self, stub):
+        count_round_trip()
+        with self._lock:
+            self.by_user.setdefault(stub["user_id"], {})[stub["month"]] = dict(stub)
+
+    def for_user(self, user_id, start=None, end=None):
+        count_round_trip()
+        with self._lock:
+            stubs = [dict(stub) for month, stub in sorted(self.by_user.get(user_id, {}).items())]
+        return [stub for stub in stubs
+                if (start is None or stub["last"] >= start) and (end is None or stub["first"] < end)]
+
+
+class InMemoryIdempotencyRepository(MemoryRepository):
+    collection_name = "idempotency_keys"
+
+    def __init__(self, store):
+        super().__init__(store)
+        self.by_key = {}
+        self._lock = store.lock
+
+    def _live(self, key):
+        record = self.by_key.get(key)
+        if record is not None and record["expires_at"] <= datetime.datetime.utcnow():
+            del self.by_key[key]
+            return None
+        return record
+
+    def claim(self, record):
+        count_round_trip()
+        with self._lock:
+            existing = self._live(record["_id"])
+            if existing is not None:
+                return dict(existing)
+            self.by_key[record["_id"]] = dict(record)
+            return None
+
+    def get(self, key):
+        count_round_trip()
+        with self._lock:
+            record = self._live(key)
+            return dict(record) if record is not None else None
+
+    def complete(self, key, response, expires_at):
+        count_round_trip()
+        with self._lock:
+            if key in self.by_key:
+                self.by_key[key].update(state="completed", response=response, expires_at=expires_at)
+
+    def release(self, key):
+        count_round_trip()
+        with self._lock:
+            if self.by_key.get(key, {}).get("state") == "in_flight":
+                del self.by_key[key]
+
+
+class InMemoryRepositories(Repositories):
+    backend = "memory"
+
+    def __init__(self, store=None):
+        self.store = store or InMemoryStore()
+        self.users = InMemoryUserRepository(self.store)
+        self.daily_logs = InMemoryDailyLogRepository(self.store)
+        self.conversations = InMemoryConversationRepository(self.store)
+        self.milestones = InMemoryMilestoneRepository(self.store)
+        self.notifications = InMemoryNotificationRepository(self.store)
+        self.relapse_support = InMemoryRelapseSupportRepository(self.store)
+        self.memory = InMemoryMemoryRepository(self.store)
+        self.summaries = InMemorySummaryRepository(self.store)
+        self.idempotency = InMemoryIdempotencyRepository(self.store)
+        self.archives = InMemoryArchiveRepository(self.store)
+
+    def flush(self, work, transaction):
+        with self.store.lock:
+            for name, documents in work.pending.items():
+                self.store[name].insert_many(documents)
+
+
+BACKENDS = {
+    "mongo": MongoRepositories,
+    "memory": InMemoryRepositories,
+}
+
+_repositories = None
+_repositories_lock = threading.Lock()
+
+
+def create_repositories(backend=DATA_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown DATA_BACKEND {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[backend]()
+
+
+def get_repositories():
+    """Process-wide repositories for the configured backend"""
+    global _repositories
+    if _repositories is None:
+        with _repositories_lock:
+            if _repositories is None:
+                _repositories = create_repositories()
+    return _repositories
+
+
+def set_repositories(repositories):
+    """Replace the process-wide repositories (tests and benchmarks use the in-memory backend)"""
+    global _repositories
+    with _repositories_lock:
+        _repositories = repositories
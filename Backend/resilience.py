@@ -0,0 +1,258 @@
+"""Shared resilience layer for LLM calls.
+
+Every call to a model deployment goes through ``guarded_call`` which applies,
+per deployment:
+
+- a token bucket that throttles the request rate,
+- a total timeout budget split across attempts,
+- retries on 429 / 5xx / timeouts with full-jitter exponential backoff,
+- a circuit breaker that fails fast (and returns the fallback) while the
+  deployment is unhealthy.
+"""
+import os
+import random
+import threading
+import time
+
+# Resilience configuration (all optional)
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", "5"))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+LLM_TIMEOUT_BUDGET_S = float(os.getenv("LLM_TIMEOUT_BUDGET_S", "30"))
+LLM_ATTEMPT_TIMEOUT_S = float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", "20"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.5"))
+LLM_BACKOFF_CAP_S = float(os.getenv("LLM_BACKOFF_CAP_S", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(Exception):
+    """Raised when a call cannot be served and no fallback was given"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Raised when the circuit breaker for a deployment is open"""
+
+
+class RateLimitedError(LLMUnavailableError):
+    """Raised when the token bucket cannot grant a slot within the budget"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to ``timeout`` seconds. Returns True on success."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate if self.rate > 0 else float("inf")
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures, half-open after ``reset_timeout``"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        """Return True if a call may go through; only one probe is allowed while half-open"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+def get_status_code(exc):
+    """Best-effort HTTP status code of an exception raised by openai / langchain / httpx"""
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def is_retryable(exc):
+    """Retry on throttling, server errors, timeouts and dropped connections"""
+    status = get_status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # openai.APITimeoutError / APIConnectionError and httpx transport errors carry no status
+    name = type(exc).__name__
+    return name in ("APITimeoutError", "APIConnectionError", "ConnectTimeout",
+                    "ReadTimeout", "ConnectError", "RemoteProtocolError")
+
+
+def get_retry_after(exc):
+    """Seconds requested by a Retry-After header, if any"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class DeploymentGuard:
+    """Rate limiter, retry policy and circuit breaker for one model deployment"""
+
+    def __init__(self, name, rate=LLM_RATE_LIMIT_RPS, burst=LLM_RATE_LIMIT_BURST,
+                 timeout_budget=LLM_TIMEOUT_BUDGET_S, attempt_timeout=LLM_ATTEMPT_TIMEOUT_S,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE_S,
+                 backoff_cap=LLM_BACKOFF_CAP_S, failure_threshold=LLM_BREAKER_FAILURES,
+                 reset_timeout=LLM_BREAKER_RESET_S):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.timeout_budget = timeout_budget
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff for the given (0-based) retry attempt"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def call(self, fn, timeout_budget=None):
+        """Call ``fn(timeout=<seconds>)`` under this guard's policy.
+
+        Raises CircuitOpenError / RateLimitedError when the call is rejected
+        up front, otherwise the last error once retries or the budget run out.
+        """
+        budget = self.timeout_budget if timeout_budget is None else timeout_budget
+        deadline = time.monotonic() + budget
+        attempt = 0
+        while True:
+            if not self.breaker.allow_request():
+                raise CircuitOpenError(f"Circuit open for deployment {self.name}")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.bucket.acquire(timeout=remaining):
+                # Nothing was sent, so give back the half-open probe slot
+                self.breaker.release_probe()
+                raise RateLimitedError(f"Rate limit budget exhausted for deployment {self.name}")
+            remaining = deadline - time.monotonic()
+            try:
+                result = fn(timeout=max(0.001, min(self.attempt_timeout, remaining)))
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # Client errors (bad request, auth) say nothing about deployment health:
+                    # leave the breaker's state and failure streak as they are
+                    self.breaker.release_probe()
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = max(self.backoff(attempt), get_retry_after(e) or 0)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return result
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(deployment):
+    """Return the process-wide guard for a deployment, creating it on first use"""
+    guard = _guards.get(deployment)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.setdefault(deployment, DeploymentGuard(deployment))
+    return guard
+
+
+def guarded_call(deployment, fn, fallback=None, timeout_budget=None):
+    """Run ``fn(timeout=...)`` through the deployment's guard.
+
+    ``fallback`` may be a value or a zero-argument callable. It is returned
+    immediately when the breaker is open or the rate limit budget is
+    exhausted, and after retries are exhausted for retryable errors.
+    Without a fallback those errors propagate.
+    """
+    try:
+        return get_guard(deployment).call(fn, timeout_budget=timeout_budget)
+    except Exception as e:
+        if fallback is None or not (isinstance(e, LLMUnavailableError) or is_retryable(e)):
+            raise
+        return fallback() if callable(fallback) else fallback
+
+
+def reset_guards():
+    """Drop all guards (used by tests and benchmarks to start from a clean state)"""
+    with _guards_lock:
+        _guards.clear()
@@ -0,0 +1,302 @@
+"""Local stand-ins for external services, used by tests and benchmarks.
+
+None of these talk to the network; they mimic just enough of the client
+surfaces used by ``app.py`` and ``workflow.py``.
+"""
+import random
+import threading
+import time
+import types
+import uuid
+import zlib
+
+
+class StubHTTPError(Exception):
+    """Error shaped like ``openai.APIStatusError`` (has ``status_code`` and ``response``)"""
+
+    def __init__(self, status_code, message="", headers=None):
+        super().__init__(message or f"Stub error {status_code}")
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+class StubTimeoutError(TimeoutError):
+    """Raised when an injected hang exceeds the caller's timeout"""
+
+
+class FaultInjector:
+    """Decides, per call, whether to inject latency, errors or hangs.
+
+    - ``latency``: fixed seconds added to every call (or a (low, high) tuple)
+    - ``error_rate``: probability of raising one of ``error_codes``
+    - ``hang_rate``: probability of sleeping until the caller's timeout expires
+    - ``retry_after``: value of the Retry-After header on injected 429s
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_codes=(429, 500, 503),
+                 hang_rate=0.0, retry_after=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.hang_rate = hang_rate
+        self.retry_after = retry_after
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def apply(self, timeout=None):
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            code = self._random.choice(self.error_codes) if self.error_codes else 500
+            latency = (self._random.uniform(*self.latency)
+                       if isinstance(self.latency, tuple) else self.latency)
+        if roll < self.hang_rate:
+            with self._lock:
+                self.failures += 1
+            time.sleep(timeout if timeout is not None else 60)
+            raise StubTimeoutError("Stub request timed out")
+        if latency:
+            time.sleep(latency if timeout is None else min(latency, timeout))
+            if timeout is not None and latency > timeout:
+                with self._lock:
+                    self.failures += 1
+                raise StubTimeoutError("Stub request timed out")
+        if roll < self.hang_rate + self.error_rate:
+            with self._lock:
+                self.failures += 1
+            headers = {}
+            if code == 429 and self.retry_after is not None:
+                headers["retry-after"] = str(self.retry_after)
+            raise StubHTTPError(code, headers=headers)
+
+
+class _StubRawResponse:
+    def __init__(self, headers, parsed):
+        self.headers = headers
+        self._parsed = parsed
+
+    def parse(self):
+        return self._parsed
+
+
+class _StubRawCompletions:
+    def __init__(self, completions):
+        self._completions = completions
+
+    def create(self, **kwargs):
+        parsed = self._completions.create(**kwargs)
+        headers = {}
+        if self._completions._owner.remaining_requests is not None:
+            headers["x-ratelimit-remaining-requests"] = str(self._completions._owner.remaining_requests)
+        return _StubRawResponse(headers, parsed)
+
+
+class _StubCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+        self.with_raw_response = _StubRawCompletions(self)
+
+    def create(self, messages, model=None, timeout=None, **kwargs):
+        self._owner.faults.apply(timeout)
+        content = self._owner.responder(messages)
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        completion_tokens = len(content.split())
+        return types.SimpleNamespace(
+            id=f"stub-{uuid.uuid4()}",
+            model=model,
+            choices=[types.SimpleNamespace(
+                index=0,
+                finish_reason="stop",
+                message=types.SimpleNamespace(role="assistant", content=content),
+            )],
+            usage=types.SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+
+class _StubEmbeddings:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, input, model=None, timeout=None, **kwargs):
+        self._owner.faults.apply(timeout)
+        texts = [input] if isinstance(input, str) else list(input)
+        return types.SimpleNamespace(
+            model=model,
+            data=[types.SimpleNamespace(index=i, embedding=stub_embedding(text, self._owner.embedding_dim))
+                  for i, text in enumerate(texts)],
+            usage=types.SimpleNamespace(
+                prompt_tokens=sum(len(text.split()) for text in texts),
+                total_tokens=sum(len(text.split()) for text in texts),
+            ),
+        )
+
+
+def stub_embedding(text, dim=64):
+    """Deterministic bag-of-words vector: texts sharing words get similar embeddings"""
+    vector = [0.0] * dim
+    for word in text.lower().split():
+        word = word.strip(".,;:!?\"'()")
+        if word:
+            vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+    return vector
+
+
+def default_responder(messages):
+    """Echo-style canned reply based on the last user message"""
+    last = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    return f"Thanks for sharing. You said: {last[:200]}"
+
+
+class FaultInjectingChatClient:
+    """Drop-in replacement for ``AzureOpenAI`` covering ``chat.completions.create``
+    (and its ``with_raw_response`` variant, which reports ``remaining_requests``
+    as an x-ratelimit header when set) and ``embeddings.create``"""
+
+    def __init__(self, faults=None, responder=default_responder, remaining_requests=None, embedding_dim=64):
+        self.faults = faults or FaultInjector()
+        self.responder = responder
+        self.remaining_requests = remaining_requests
+        self.embedding_dim = embedding_dim
+        self.chat = types.SimpleNamespace(completions=_StubCompletions(self))
+        self.embeddings = _StubEmbeddings(self)
+
+
+class StubResourceExistsError(StubHTTPError):
+    """Raised like ``azure.core.exceptions.ResourceExistsError``"""
+
+    def __init__(self, message="The specified blob already exists."):
+        super().__init__(409, message)
+
+
+class StubResourceNotFoundError(StubHTTPError):
+    """Raised like ``azure.core.exceptions.ResourceNotFoundError``"""
+
+    def __init__(self, message="The specified blob does not exist."):
+        super().__init__(404, message)
+
+
+class _StubDownload:
+    def __init__(self, data, chunk_size):
+        self._data = data
+        self._chunk_size = chunk_size
+        self.size = len(data)
+
+    def readall(self):
+        return self._data
+
+    def chunks(self):
+        for offset in range(0, len(self._data), self._chunk_size):
+            yield self._data[offset:offset + self._chunk_size]
+
+
+class InMemoryBlobClient:
+    """Block-blob client backed by an ``InMemoryBlobContainer``"""
+
+    def __init__(self, container, name):
+        self.container = container
+        self.blob_name = name
+
+    def _blob(self):
+        blob = self.container.blobs.get(self.blob_name)
+        if blob is None:
+            raise StubResourceNotFoundError()
+        return blob
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.read()
+        self.container.faults.apply()
+        with self.container.lock:
+            self.container.uncommitted.setdefault(self.blob_name, {})[block_id] = bytes(data)
+
+    def commit_block_list(self, block_list, content_settings=None, metadata=None, **kwargs):
+        self.container.faults.apply()
+        with self.container.lock:
+            staged = self.container.uncommitted.get(self.blob_name, {})
+            committed = self.container.blobs.get(self.blob_name, {}).get("blocks", {})
+            blocks = {}
+            for block in block_list:
+                block = getattr(block, "id", block)
+                if block in staged:
+                    blocks[block] = staged[block]
+                elif block in committed:
+                    blocks[block] = committed[block]
+                else:
+                    raise StubHTTPError(400, f"Invalid block id {block}")
+            self.container.uncommitted.pop(self.blob_name, None)
+            self._store(b"".join(blocks[getattr(b, "id", b)] for b in block_list),
+                        content_settings, metadata, blocks)
+
+    def upload_blob(self, data, overwrite=False, content_settings=None, metadata=None, **kwargs):
+        if not isinstance(data, (bytes, bytearray)):
+            data = data.read()
+        self.container.faults.apply()
+        with self.container.lock:
+            if not overwrite and self.blob_name in self.container.blobs:
+                raise StubResourceExistsError()
+            self._store(bytes(data), content_settings, metadata, {})
+
+    def _store(self, data, content_settings, metadata, blocks):
+        self.container.blobs[self.blob_name] = {
+            "data": data,
+            "blocks": blocks,
+            "metadata": dict(metadata or {}),
+            "content_type": getattr(content_settings, "content_type", None),
+        }
+
+    def download_blob(self, **kwargs):
+        self.container.faults.apply()
+        return _StubDownload(self._blob()["data"], self.container.chunk_size)
+
+    def get_blob_properties(self, **kwargs):
+        blob = self._blob()
+        return types.SimpleNamespace(
+            name=self.blob_name,
+            size=len(blob["data"]),
+            metadata=dict(blob["metadata"]),
+            content_settings=types.SimpleNamespace(content_type=blob["content_type"]),
+        )
+
+    def set_blob_metadata(self, metadata=None, **kwargs):
+        with self.container.lock:
+            self._blob()["metadata"] = dict(metadata or {})
+
+    def get_block_list(self, block_list_type="committed", **kwargs):
+        committed = [types.SimpleNamespace(id=b, size=len(d))
+                     for b, d in self.container.blobs.get(self.blob_name, {}).get("blocks", {}).items()]
+        uncommitted = [types.SimpleNamespace(id=b, size=len(d))
+                       for b, d in self.container.uncommitted.get(self.blob_name, {}).items()]
+        return committed, uncommitted
+
+    def exists(self, **kwargs):
+        return self.blob_name in self.container.blobs
+
+    def delete_blob(self, **kwargs):
+        with self.container.lock:
+            if self.container.blobs.pop(self.blob_name, None) is None:
+                raise StubResourceNotFoundError()
+
+
+class InMemoryBlobContainer:
+    """Stand-in for ``azure.storage.blob.ContainerClient`` holding blobs in a dict"""
+
+    def __init__(self, faults=None, chunk_size=4 * 1024 * 1024):
+        self.blobs = {}
+        self.uncommitted = {}
+        self.faults = faults or FaultInjector()
+        self.chunk_size = chunk_size
+        self.lock = threading.RLock()
+
+    def get_blob_client(self, blob):
+        return InMemoryBlobClient(self, blob)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        for name in sorted(self.blobs):
+            if name_starts_with is None or name.startswith(name_starts_with):
+                yield self.get_blob_client(name).get_blob_properties()
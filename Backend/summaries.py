@@ -0,0 +1,248 @@
+"""Rolling conversation summaries: bounded long-term memory for prompts.
+
+Each user has one document in ``conversation_summaries``: a short prose
+summary of their earlier conversations and structured facts (goals,
+recurring triggers, what helped), plus ``covered_until``, the timestamp of
+the last message folded into it.
+
+After a conversation is stored, ``note_messages`` schedules ``compact_user``
+on a background thread once ``SUMMARY_BATCH_MESSAGES`` new messages have
+accumulated. The job folds the messages after ``covered_until``, except the
+newest ``SUMMARY_KEEP_RECENT``, into the existing summary, one batch per
+model call, so a summary is updated incrementally rather than rebuilt.
+
+``get_conversation_context`` builds the history for a prompt: the summary as
+a system message, followed by at most ``SUMMARY_KEEP_RECENT`` raw messages
+that are not summarized yet. The prompt stays the same size however long the
+user's history grows. The same document carries the drinking trends and
+relapse-risk score stored by the nightly ``analytics.py`` batch
+(``insights``), which are added to the summary message.
+
+Run ``python summaries.py --user-id <id>`` (or ``--all``) to backfill
+summaries for existing conversations.
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_router import FAST_TIER, get_router
+from llm_scheduler import BACKGROUND, llm_priority
+from repositories import get_repositories
+from tracing import metrics, span
+from usage import usage_scope
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "10"))
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "20"))
+SUMMARY_MAX_BATCHES = int(os.getenv("SUMMARY_MAX_BATCHES", "20"))
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "1500"))
+SUMMARY_MAX_FACTS = int(os.getenv("SUMMARY_MAX_FACTS", "8"))
+SUMMARY_TRACKED_USERS = int(os.getenv("SUMMARY_TRACKED_USERS", "10000"))
+
+# Structured facts kept per user
+FACT_KINDS = ("goals", "triggers", "helped")
+MAX_FACT_CHARS = 200
+
+SUMMARY_PROMPT = (
+    "You maintain the long-term memory of a supportive assistant that helps a user reduce or quit alcohol. "
+    "You are given the current memory as JSON and newer conversation messages. Return only a JSON object "
+    "with the updated memory: \"summary\" (at most {max_chars} characters of prose covering the whole "
+    "relationship so far, most relevant first), \"goals\" (the user's goals), \"triggers\" (recurring "
+    "drinking triggers) and \"helped\" (strategies that helped the user). Each list has at most {max_facts} "
+    "short entries; merge duplicates and drop entries the newer messages contradict."
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = OrderedDict()  # user_id -> messages stored since the last scheduled compaction
+_running = set()
+_pending_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _executor, _executor_lock, _pending_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+    _pending.clear()
+    _running.clear()
+    _pending_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+    return _executor
+
+
+def format_message(message):
+    role = "User" if message.get("is_user") else "Assistant"
+    return f"[{message['timestamp']:%Y-%m-%d}] {role}: {message.get('message') or ''}"
+
+
+def parse_memory(content):
+    """The summary and facts from a model reply, clamped to the configured bounds"""
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    memory = json.loads(text)
+    if not isinstance(memory, dict) or not isinstance(memory.get("summary"), str):
+        raise ValueError("Summary reply must be a JSON object with a 'summary' string")
+    facts = {}
+    for kind in FACT_KINDS:
+        entries = memory.get(kind) or []
+        if not isinstance(entries, list):
+            raise ValueError(f"'{kind}' must be a list")
+        facts[kind] = [str(entry)[:MAX_FACT_CHARS] for entry in entries[:SUMMARY_MAX_FACTS]]
+    return memory["summary"][:SUMMARY_MAX_CHARS], facts
+
+
+def fold(summary, messages):
+    """Fold ``messages`` into ``summary`` (None for a new user) with one model call.
+
+    Returns ``(summary_text, facts)``; raises if the model is unavailable or
+    its reply cannot be parsed, leaving the stored summary unchanged.
+    """
+    current = {"summary": (summary or {}).get("summary", ""), **((summary or {}).get("facts") or {})}
+    content = get_router().chat_completion(
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT.format(max_chars=SUMMARY_MAX_CHARS,
+                                                                max_facts=SUMMARY_MAX_FACTS)},
+            {"role": "user", "content": "Current memory:\n" + json.dumps(current) + "\n\nNewer messages:\n"
+                                        + "\n".join(format_message(message) for message in messages)}
+        ],
+        tier=FAST_TIER,
+        temperature=0,
+        max_tokens=800
+    )
+    return parse_memory(content)
+
+
+def compact_user(user_id, keep_recent=SUMMARY_KEEP_RECENT, batch_size=SUMMARY_BATCH_MESSAGES,
+                 max_batches=SUMMARY_MAX_BATCHES):
+    """Fold the user's unsummarized messages, except the newest ``keep_recent``, into their summary.
+
+    Returns the number of messages folded.
+    """
+    repositories = get_repositories()
+    summary = repositories.summaries.get(user_id)
+    folded = 0
+    with span("summary.compact", "compact_user"), llm_priority(BACKGROUND, user_id), usage_scope("summaries"):
+        for _ in range(max_batches):
+            after = summary.get("covered_until") if summary else None
+            messages = repositories.conversations.since(user_id, after, limit=batch_size + keep_recent)
+            cut = min(batch_size, len(messages) - keep_recent)
+            if cut <= 0:
+                break
+            # Both messages of an exchange share a timestamp; never split them
+            while cut < len(messages) and messages[cut]["timestamp"] == messages[cut - 1]["timestamp"]:
+                cut += 1
+            text, facts = fold(summary, messages[:cut])
+            summary = {
+                "user_id": user_id,
+                "summary": text,
+                "facts": facts,
+                "covered_until": messages[cut - 1]["timestamp"],
+                "covered_messages": (summary or {}).get("covered_messages", 0) + cut,
+                "updated_at": datetime.datetime.now()
+            }
+            repositories.summaries.save(summary)
+            folded += cut
+            metrics.increment("summary_messages_folded_total", {}, cut)
+    return folded
+
+
+def _run_compaction(user_id):
+    try:
+        compact_user(user_id)
+    except Exception as e:
+        # The summary stays as it was; the messages are folded by a later run
+        metrics.increment("summary_failures_total", {"error": type(e).__name__})
+    finally:
+        with _pending_lock:
+            _running.discard(user_id)
+
+
+def note_messages(user_id, count=2):
+    """Record newly stored messages, scheduling a compaction once a batch has accumulated"""
+    if not SUMMARY_ENABLED:
+        return None
+    with _pending_lock:
+        pending = _pending.pop(user_id, 0) + count
+        if pending < SUMMARY_BATCH_MESSAGES or user_id in _running:
+            _pending[user_id] = pending
+            while len(_pending) > SUMMARY_TRACKED_USERS:
+                _pending.popitem(last=False)
+            return None
+        _running.add(user_id)
+    return get_executor().submit(_run_compaction, user_id)
+
+
+def format_insights(insights):
+    """One line describing a user's drinking trends and relapse risk"""
+    parts = [f"relapse risk {insights['risk_level']}"]
+    trend = insights.get("trend_units_per_week") or 0
+    if trend:
+        parts.append(f"consumption {'rising' if trend > 0 else 'falling'} by {abs(trend):g} units a week")
+    if insights.get("riskiest_weekday"):
+        parts.append(f"drinks most on {insights['riskiest_weekday']}s")
+    if insights.get("top_trigger"):
+        parts.append(f"most common trigger: {insights['top_trigger']}")
+    return "Recent drinking pattern: " + ", ".join(parts)
+
+
+def format_summary(summary):
+    """System message carrying a user's summary, facts and insights into a prompt"""
+    lines = []
+    if summary.get("summary"):
+        lines += ["Summary of earlier conversations with this user:", summary["summary"]]
+    labels = {"goals": "Goals", "triggers": "Recurring triggers", "helped": "What has helped"}
+    for kind in FACT_KINDS:
+        entries = (summary.get("facts") or {}).get(kind)
+        if entries:
+            lines.append(f"{labels[kind]}: " + "; ".join(entries))
+    if summary.get("insights"):
+        lines.append(format_insights(summary["insights"]))
+    return {"role": "system", "content": "\n".join(lines)}
+
+
+def get_prompt_context(user_id, limit=SUMMARY_KEEP_RECENT):
+    """``get_conversation_context`` plus the user's stored insights (None if not computed yet)"""
+    repositories = get_repositories()
+    summary = repositories.summaries.get(user_id)
+    after = summary.get("covered_until") if summary else None
+    context = [format_summary(summary)] if summary and (summary.get("summary") or summary.get("insights")) else []
+    for message in repositories.conversations.recent(user_id, after, limit):
+        context.append({
+            "role": "user" if message.get("is_user") else "assistant",
+            "content": message.get("message") or ""
+        })
+    return context, (summary or {}).get("insights")
+
+
+def get_conversation_context(user_id, limit=SUMMARY_KEEP_RECENT):
+    """Prompt history for a user: their summary, then the newest messages it does not cover"""
+    return get_prompt_context(user_id, limit)[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold conversations into rolling summaries")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", help="Summarize one user's conversations")
+    target.add_argument("--all", action="store_true", help="Summarize every user's conversations")
+    parser.add_argument("--max-batches", type=int, default=1000, help="Model calls per user at most")
+    args = parser.parse_args()
+
+    from database import get_db
+    user_ids = [args.user_id] if args.user_id else get_db()["daily_logs"].distinct("user_id", {"is_user": {"$exists": True}})
+    print(json.dumps({user_id: compact_user(user_id, max_batches=args.max_batches) for user_id in user_ids}))
@@ -0,0 +1,372 @@
+"""Lightweight tracing and in-process latency histograms.
+
+``span(name, target)`` times a block of work and records its duration,
+token counts and payload sizes into fixed-bucket histograms keyed by
+``(name, target)``. ``render_prometheus()`` / ``summary()`` expose them for
+the ``/metrics`` endpoint. When ``TRACE_EXPORT_PATH`` is set, every finished
+span is also appended to that file as one line of OTLP/JSON
+(``{"resourceSpans": [...]}``), the format read by OpenTelemetry's file
+receiver.
+
+Mongo commands are traced by registering ``create_mongo_command_tracer()``
+as a pymongo event listener. Data-access code calls ``count_round_trip()``
+for each database call; a span started with ``db.round_trips`` counting
+(``start_round_trip_count``) records the total in ``db_round_trips``.
+"""
+import bisect
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "sipcontrol-backend")
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 20, 30, 60)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+
+
+class Histogram:
+    """Fixed-bucket histogram with count and sum, safe to update from many threads"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside the matching bucket,
+        clamped to the observed min/max"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            low, high = self.min, self.max
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        estimate = high
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else high
+                estimate = lower + (upper - lower) * (rank - cumulative) / count
+                break
+            cumulative += count
+        return min(max(estimate, low), high)
+
+
+class MetricsRegistry:
+    """Histograms and counters keyed by metric name and label tuple"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, labels, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def render_prometheus(self):
+        """Prometheus text exposition of every metric"""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+        seen = set()
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f"# TYPE {name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for kind, items in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in items:
+                if name not in seen:
+                    lines.append(f"# TYPE {name} {kind}")
+                    seen.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Count, mean and p50/p95/p99 per histogram, slowest p99 first"""
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+        rows = []
+        for (name, labels), histogram in histograms:
+            if not histogram.count:
+                continue
+            rows.append({
+                "metric": name,
+                "labels": dict(labels),
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+            })
+        rows.sort(key=lambda row: (row["metric"], -row["p99"]))
+        return {
+            "histograms": rows,
+            "counters": [{"metric": n, "labels": dict(l), "value": v} for (n, l), v in counters],
+            "gauges": [{"metric": n, "labels": dict(l), "value": v} for (n, l), v in gauges],
+        }
+
+
+def _escape_label_value(value):
+    # Prometheus text format: backslash, double quote and line feed are escaped
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+
+metrics = MetricsRegistry()
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_round_trips = contextvars.ContextVar("round_trips", default=None)
+_export_lock = threading.Lock()
+
+
+class Span:
+    """A timed unit of work; attributes end up on the exported span"""
+
+    def __init__(self, name, target=None, parent=None, attributes=None):
+        self.name = name
+        self.target = target
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_tokens(self, prompt_tokens, completion_tokens):
+        self.attributes["llm.prompt_tokens"] = prompt_tokens
+        self.attributes["llm.completion_tokens"] = completion_tokens
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        self.error = error
+        record_span(self)
+
+
+def record_span(finished):
+    """Feed a finished span into the histograms and the optional OTLP export"""
+    labels = {"span": finished.name, "target": finished.target or ""}
+    metrics.histogram("span_duration_seconds", labels).observe(finished.duration)
+    if finished.error is not None:
+        metrics.increment("span_errors_total", labels)
+    tokens = (finished.attributes.get("llm.prompt_tokens", 0)
+              + finished.attributes.get("llm.completion_tokens", 0))
+    if tokens:
+        metrics.histogram("span_tokens", labels, TOKEN_BUCKETS).observe(tokens)
+    if "db.round_trips" in finished.attributes:
+        metrics.histogram("db_round_trips", labels, ROUND_TRIP_BUCKETS).observe(finished.attributes["db.round_trips"])
+    for key in ("payload.request_bytes", "payload.response_bytes"):
+        if key in finished.attributes:
+            metrics.histogram(key.replace(".", "_"), labels, SIZE_BUCKETS).observe(finished.attributes[key])
+    if TRACE_EXPORT_PATH:
+        export_span(finished)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def export_span(finished):
+    """Append one span to TRACE_EXPORT_PATH as an OTLP/JSON line"""
+    attributes = dict(finished.attributes)
+    if finished.target:
+        attributes["target"] = finished.target
+    span_json = {
+        "traceId": finished.trace_id,
+        "spanId": finished.span_id,
+        "name": finished.name,
+        "kind": 1,
+        "startTimeUnixNano": str(finished.start_ns),
+        "endTimeUnixNano": str(finished.start_ns + int(finished.duration * 1e9)),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()],
+        "status": {"code": 2, "message": str(finished.error)} if finished.error is not None else {"code": 1},
+    }
+    if finished.parent_span_id:
+        span_json["parentSpanId"] = finished.parent_span_id
+    line = json.dumps({"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [span_json]}],
+    }]})
+    with _export_lock:
+        with open(TRACE_EXPORT_PATH, "a") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def span(name, target=None, **attributes):
+    """Trace a block: ``with span("llm.call", "gpt4") as s: s.set_tokens(...)``"""
+    current = Span(name, target, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        _current_span.reset(token)
+        current.finish(error=e)
+        raise
+    _current_span.reset(token)
+    current.finish()
+
+
+def start_span(name, target=None, **attributes):
+    """Start a span outside a ``with`` block; pass the result to ``end_span``"""
+    current = Span(name, target, _current_span.get(), attributes)
+    return current, _current_span.set(current)
+
+
+def end_span(started, error=None):
+    current, token = started
+    _current_span.reset(token)
+    current.finish(error=error)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def set_span_attribute(key, value):
+    """Set an attribute on the active span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def start_round_trip_count():
+    """Count database round trips made in this context; pass the result to ``stop_round_trip_count``"""
+    counter = [0]
+    return counter, _round_trips.set(counter)
+
+
+def stop_round_trip_count(started):
+    """Stop counting and return the number of round trips"""
+    counter, token = started
+    _round_trips.reset(token)
+    return counter[0]
+
+
+def count_round_trip(count=1):
+    """Record ``count`` database round trips against the active count, if any"""
+    counter = _round_trips.get()
+    if counter is not None:
+        counter[0] += count
+
+
+def payload_size(messages):
+    """Approximate request payload size in bytes for a list of chat messages"""
+    total = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+        total += len(str(content or "").encode("utf-8"))
+    return total
+
+
+_mongo_command_tracer_class = None
+
+
+def create_mongo_command_tracer():
+    """pymongo listener recording every command as a ``mongo.command`` span.
+
+    pymongo is imported on first use so that importing this module stays cheap.
+    """
+    global _mongo_command_tracer_class
+    if _mongo_command_tracer_class is None:
+        from pymongo import monitoring
+
+        class MongoCommandTracer(monitoring.CommandListener):
+            """pymongo listener recording every command as a ``mongo.command`` span"""
+
+            def __init__(self):
+                self._started = {}
+                self._lock = threading.Lock()
+
+            def started(self, event):
+                collection = event.command.get(event.command_name)
+                target = f"{event.command_name}:{collection}" if isinstance(collection, str) else event.command_name
+                command_span = Span("mongo.command", target, _current_span.get(), {"db.name": event.database_name})
+                with self._lock:
+                    self._started[(event.request_id, event.connection_id)] = command_span
+
+            def _finish(self, event, error=None):
+                with self._lock:
+                    command_span = self._started.pop((event.request_id, event.connection_id), None)
+                if command_span is not None:
+                    command_span.finish(error=error)
+
+            def succeeded(self, event):
+                self._finish(event)
+
+            def failed(self, event):
+                self._finish(event, error=event.failure)
+
+        _mongo_command_tracer_class = MongoCommandTracer
+    return _mongo_command_tracer_class()
@@ -0,0 +1,261 @@
+"""Token accounting and quotas for model calls.
+
+Every model call's token usage (``response.usage``) is added to a ledger of
+time buckets (``USAGE_BUCKET_S`` wide, covering ``USAGE_WINDOW_S``), per
+user, per endpoint and per workflow node, plus a global total. Adding a call
+is a few counter increments; running totals over the window are kept
+alongside the buckets, and a bucket's counts are subtracted when it leaves the
+window, so a quota check is one dictionary lookup.
+
+A call is charged to the user it is scheduled for (``llm_scheduler``'s
+``llm_priority``) and to the endpoint of the HTTP request it serves, or to
+the job set with ``usage_scope`` for background work.
+
+Quotas are token counts over the window (0 disables one):
+
+- ``USAGE_USER_SOFT_TOKENS`` / ``USAGE_GLOBAL_SOFT_TOKENS``: prompts are cut
+  down to ``USAGE_SOFT_CONTEXT_MESSAGES`` recent messages, without document
+  sources or the graph workflow
+- ``USAGE_USER_HARD_TOKENS`` / ``USAGE_GLOBAL_HARD_TOKENS``: the user's last
+  reply to the same message is served from ``ResponseCache``, or a canned
+  reply; relapse support is never answered this way
+
+The ledger lives in process memory, like the metrics registry, so quotas and
+reports apply to each worker separately. ``GET /api/usage`` reports the
+heaviest users, endpoints and nodes.
+"""
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from llm_scheduler import current_priority
+from tracing import metrics
+
+USAGE_BUCKET_S = int(os.getenv("USAGE_BUCKET_S", "300"))
+USAGE_WINDOW_S = int(os.getenv("USAGE_WINDOW_S", "86400"))
+USAGE_USER_SOFT_TOKENS = int(os.getenv("USAGE_USER_SOFT_TOKENS", "0"))
+USAGE_USER_HARD_TOKENS = int(os.getenv("USAGE_USER_HARD_TOKENS", "0"))
+USAGE_GLOBAL_SOFT_TOKENS = int(os.getenv("USAGE_GLOBAL_SOFT_TOKENS", "0"))
+USAGE_GLOBAL_HARD_TOKENS = int(os.getenv("USAGE_GLOBAL_HARD_TOKENS", "0"))
+USAGE_SOFT_CONTEXT_MESSAGES = int(os.getenv("USAGE_SOFT_CONTEXT_MESSAGES", "2"))
+USAGE_CACHED_RESPONSES = int(os.getenv("USAGE_CACHED_RESPONSES", "10000"))
+
+# Quota states, from least to most degraded
+QUOTA_OK = "ok"
+QUOTA_SOFT = "soft"
+QUOTA_HARD = "hard"
+
+# Ledger dimensions
+GLOBAL = "global"
+USER = "user"
+ENDPOINT = "endpoint"
+NODE = "node"
+
+PROMPT, COMPLETION, CALLS, COST = range(4)
+
+_endpoint = contextvars.ContextVar("usage_endpoint", default=None)
+
+
+@contextmanager
+def usage_scope(endpoint):
+    """Charge model calls made in the block to ``endpoint`` (a route or a background job name)"""
+    token = _endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+def start_usage_scope(endpoint):
+    """``usage_scope`` outside a ``with`` block; pass the result to ``end_usage_scope``"""
+    return _endpoint.set(endpoint)
+
+
+def end_usage_scope(token):
+    _endpoint.reset(token)
+
+
+class TokenLedger:
+    """Token counts per (dimension, key) in time buckets, with running totals over the window"""
+
+    def __init__(self, bucket_s=USAGE_BUCKET_S, window_s=USAGE_WINDOW_S):
+        self.bucket_s = bucket_s
+        self.window_s = window_s
+        self.buckets = deque()  # (bucket start, {(dimension, key): [prompt, completion, calls, cost]})
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def _roll(self, now):
+        """Drop buckets that left the window and open the current one"""
+        start = int(now // self.bucket_s) * self.bucket_s
+        while self.buckets and self.buckets[0][0] <= now - self.window_s:
+            for key, counts in self.buckets.popleft()[1].items():
+                total = self.totals[key]
+                for i, value in enumerate(counts):
+                    total[i] -= value
+                if not total[CALLS]:
+                    del self.totals[key]
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append((start, {}))
+        return self.buckets[-1][1]
+
+    def record(self, prompt_tokens, completion_tokens, cost_usd=0.0, user_id=None, endpoint=None, node=None,
+               now=None):
+        keys = [(GLOBAL, "")]
+        if user_id is not None:
+            keys.append((USER, user_id))
+        if endpoint is not None:
+            keys.append((ENDPOINT, endpoint))
+        if node is not None:
+            keys.append((NODE, node))
+        with self._lock:
+            bucket = self._roll(time.time() if now is None else now)
+            for key in keys:
+                for counts in (bucket.setdefault(key, [0, 0, 0, 0.0]), self.totals.setdefault(key, [0, 0, 0, 0.0])):
+                    counts[PROMPT] += prompt_tokens
+                    counts[COMPLETION] += completion_tokens
+                    counts[CALLS] += 1
+                    counts[COST] += cost_usd
+
+    def tokens(self, dimension, key="", now=None):
+        """Tokens charged to ``key`` within the window"""
+        with self._lock:
+            self._roll(time.time() if now is None else now)
+            counts = self.totals.get((dimension, key))
+        return counts[PROMPT] + counts[COMPLETION] if counts else 0
+
+    def quota_state(self, user_id=None):
+        """``QUOTA_OK``, ``QUOTA_SOFT`` or ``QUOTA_HARD`` for a call on behalf of ``user_id``"""
+        global_tokens = self.tokens(GLOBAL)
+        user_tokens = self.tokens(USER, user_id) if user_id is not None else 0
+        if ((USAGE_GLOBAL_HARD_TOKENS and global_tokens >= USAGE_GLOBAL_HARD_TOKENS)
+                or (USAGE_USER_HARD_TOKENS and user_tokens >= USAGE_USER_HARD_TOKENS)):
+            return QUOTA_HARD
+        if ((USAGE_GLOBAL_SOFT_TOKENS and global_tokens >= USAGE_GLOBAL_SOFT_TOKENS)
+                or (USAGE_USER_SOFT_TOKENS and user_tokens >= USAGE_USER_SOFT_TOKENS)):
+            return QUOTA_SOFT
+        return QUOTA_OK
+
+    def report(self, top=10, now=None):
+        """Window totals, the ``top`` heaviest keys per dimension and global tokens per bucket"""
+        with self._lock:
+            self._roll(time.time() if now is None else now)
+            totals = {key: list(counts) for key, counts in self.totals.items()}
+            series = []
+            for start, bucket in self.buckets:
+                counts = bucket.get((GLOBAL, ""))
+                series.append({"start": start, "tokens": counts[PROMPT] + counts[COMPLETION] if counts else 0})
+
+        def row(key, counts):
+            return {
+                "key": key,
+                "prompt_tokens": counts[PROMPT],
+                "completion_tokens": counts[COMPLETION],
+                "tokens": counts[PROMPT] + counts[COMPLETION],
+                "calls": counts[CALLS],
+                "cost_usd": round(counts[COST], 6)
+            }
+
+        report = {
+            "window_s": self.window_s,
+            "bucket_s": self.bucket_s,
+            "quotas": {
+                "user_soft_tokens": USAGE_USER_SOFT_TOKENS,
+                "user_hard_tokens": USAGE_USER_HARD_TOKENS,
+                "global_soft_tokens": USAGE_GLOBAL_SOFT_TOKENS,
+                "global_hard_tokens": USAGE_GLOBAL_HARD_TOKENS
+            },
+            "total": row("", totals.get((GLOBAL, ""), [0, 0, 0, 0.0])),
+            "series": series
+        }
+        for dimension, name in ((USER, "users"), (ENDPOINT, "endpoints"), (NODE, "nodes")):
+            rows = [row(key, counts) for (d, key), counts in totals.items() if d == dimension]
+            rows.sort(key=lambda r: r["tokens"], reverse=True)
+            report[name] = rows[:top]
+        return report
+
+
+class ResponseCache:
+    """Recent replies per user and message, served instead of a model call over the hard quota"""
+
+    def __init__(self, size=USAGE_CACHED_RESPONSES):
+        self.size = size
+        self._replies = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id, message):
+        return hashlib.sha256(f"{user_id}\0{message}".encode("utf-8")).hexdigest()
+
+    def get(self, user_id, message):
+        key = self._key(user_id, message)
+        with self._lock:
+            reply = self._replies.get(key)
+            if reply is not None:
+                self._replies.move_to_end(key)
+            return reply
+
+    def put(self, user_id, message, reply):
+        key = self._key(user_id, message)
+        with self._lock:
+            self._replies[key] = reply
+            self._replies.move_to_end(key)
+            while len(self._replies) > self.size:
+                self._replies.popitem(last=False)
+
+
+_ledger = None
+_cache = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _ledger, _cache, _lock
+    _ledger = None
+    _cache = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_ledger():
+    global _ledger
+    if _ledger is None:
+        with _lock:
+            if _ledger is None:
+                _ledger = TokenLedger()
+    return _ledger
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def record_usage(prompt_tokens, completion_tokens, cost_usd=0.0, node=None):
+    """Charge one model call to the current user and endpoint"""
+    get_ledger().record(prompt_tokens, completion_tokens, cost_usd,
+                        user_id=current_priority()[1], endpoint=_endpoint.get(), node=node)
+    metrics.increment("llm_tokens_total", {"kind": "prompt"}, prompt_tokens)
+    metrics.increment("llm_tokens_total", {"kind": "completion"}, completion_tokens)
+
+
+def quota_state(user_id):
+    state = get_ledger().quota_state(user_id)
+    if state != QUOTA_OK:
+        metrics.increment("usage_quota_degraded_total", {"state": state})
+    return state
+
+
+def context_limit(state, default):
+    """Number of recent messages to put in a prompt in quota ``state``"""
+    return default if state == QUOTA_OK else min(default, USAGE_SOFT_CONTEXT_MESSAGES)